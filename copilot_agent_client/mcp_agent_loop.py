@@ -9,29 +9,38 @@ import json
 from PIL import Image
 import io
 
-from tools.image_tools import make_b64_url
+from copilot_front_end.mobile_action_helper import capture_frame, dectect_screen_on, press_home_key
 
-from copilot_front_end.mobile_action_helper import capture_screenshot, dectect_screen_on, press_home_key
-
-from copilot_front_end.mobile_action_helper import init_device, open_screen
+from copilot_front_end.mobile_action_helper import init_device, open_screen, is_settle_enabled
 from copilot_front_end.pu_frontend_executor import act_on_device, uiTars_to_frontend_action
 from copilot_front_end.mobile_action_helper import get_device_wm_size
+from copilot_agent_server.base_server import make_screenshot_observation
 from fastmcp.utilities.types import Image as MCPImage
 
 
-from megfile import smart_remove
-
 import time
 
-from tools.ask_llm_v2 import ask_llm_anything
+from tools.ask_llm_v2 import ask_llm_anything, ask_llm_anything_async
 
 import threading
 
-def auto_reply(current_image_url, task, info_action, model_provider, model_name):
-    """
-    Reply with information action.
-    """
-    messages_to_ask = [
+AUTO_REPLY_ARGS = {
+    "max_tokens": 1024,
+    "temperature": 0.5,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+}
+
+CAPTION_ARGS = {
+    "max_tokens": 256,
+    "temperature": 0.5,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+}
+
+
+def _auto_reply_messages(current_image_url, task, info_action):
+    return [
         {
             "role": "user",
             "content": [
@@ -70,32 +79,41 @@ def auto_reply(current_image_url, task, info_action, model_provider, model_name)
         }
     ]
 
+
+def _strip_thinking(response):
+    if "</think>" in response:
+        response = response.split("</think>")[-1].strip()
+    return response
+
+
+def auto_reply(current_image_url, task, info_action, model_provider, model_name):
+    """
+    Reply with information action.
+    """
     response = ask_llm_anything(
         model_provider=model_provider,
         model_name=model_name,
-        messages=messages_to_ask,
-        args={
-            "max_tokens": 1024,
-            "temperature": 0.5,
-            "top_p": 1.0,
-            "frequency_penalty": 0.0,
-        }
+        messages=_auto_reply_messages(current_image_url, task, info_action),
+        args=AUTO_REPLY_ARGS,
     )
+    return _strip_thinking(response)
 
-    if "</think>" in response:
-        response = response.split("</think>")[-1].strip()
-
-    return response
 
-def caption_current_screenshot(current_task, current_image_url, model_config, result_container=None):
+async def auto_reply_async(current_image_url, task, info_action, model_provider, model_name):
     """
-    Caption the current screenshot using the caption model specified in model_config.
+    Awaitable auto_reply; the event loop keeps running while the model answers.
     """
+    response = await ask_llm_anything_async(
+        model_provider=model_provider,
+        model_name=model_name,
+        messages=_auto_reply_messages(current_image_url, task, info_action),
+        args=AUTO_REPLY_ARGS,
+    )
+    return _strip_thinking(response)
 
-    model_name = model_config['model_name']
-    model_provider = model_config.get('model_provider', 'eval')
 
-    messages_to_ask = [
+def _caption_messages(current_task, current_image_url):
+    return [
         {
             "role": "user",
             "content": [
@@ -113,16 +131,16 @@ def caption_current_screenshot(current_task, current_image_url, model_config, re
         }
     ]
 
+
+def caption_current_screenshot(current_task, current_image_url, model_config, result_container=None):
+    """
+    Caption the current screenshot using the caption model specified in model_config.
+    """
     response = ask_llm_anything(
-        model_provider=model_provider,
-        model_name=model_name,
-        messages=messages_to_ask,
-        args={
-            "max_tokens": 256,
-            "temperature": 0.5,
-            "top_p": 1.0,
-            "frequency_penalty": 0.0,
-        },
+        model_provider=model_config.get('model_provider', 'eval'),
+        model_name=model_config['model_name'],
+        messages=_caption_messages(current_task, current_image_url),
+        args=CAPTION_ARGS,
         resize_config=model_config.get('image_preprocess', None)
     )
 
@@ -131,6 +149,20 @@ def caption_current_screenshot(current_task, current_image_url, model_config, re
 
     return response
 
+
+async def caption_current_screenshot_async(current_task, current_image_url, model_config):
+    """
+    Awaitable caption_current_screenshot; run it concurrently with the agent
+    step (e.g. asyncio.gather) instead of on a helper thread.
+    """
+    return await ask_llm_anything_async(
+        model_provider=model_config.get('model_provider', 'eval'),
+        model_name=model_config['model_name'],
+        messages=_caption_messages(current_task, current_image_url),
+        args=CAPTION_ARGS,
+        resize_config=model_config.get('image_preprocess', None)
+    )
+
 def gui_agent_loop(
         # the agent server to interact with
         agent_server,
@@ -247,6 +279,11 @@ def gui_agent_loop(
 
     delay_after_capture = agent_loop_config.get('delay_after_capture', 2)
 
+    # settle mode: capture as soon as the screen stops changing, instead of the fixed delay
+    settle_config = agent_loop_config.get('settle_config', None)
+    if is_settle_enabled(settle_config):
+        delay_after_capture = 0
+
     history_actions = []
     
 
@@ -270,6 +307,8 @@ def gui_agent_loop(
     action = None
 
     global_step_idx = 0
+    # time.monotonic() of the last action start, the settle wait only counts frames after it
+    action_start = None
     # restart the steps from 0, even continuing an existing session
     for step_idx in range(max_steps):
 
@@ -284,16 +323,17 @@ def gui_agent_loop(
             stop_reason = "MANUAL_STOP_SCREEN_OFF"
             break
 
-        image_path = capture_screenshot(device_id, "tmp_screenshot", print_command=False, show_window=False)
+        frame = capture_frame(device_id, print_command=False, show_window=False, settle_config=settle_config, since=action_start)
 
         # current step log use to store intermediate logs if enabled
         current_step_log = {
 
         }
 
-        image_b64_url = make_b64_url(image_path)
-
-        current_step_log["screenshot_b64_url"] = image_b64_url
+        # keep the in-memory frame, base64 is only produced when a screenshot is returned to the client
+        current_step_log["screenshot_frame"] = frame
+        if not enable_intermediate_screenshots and len(intermidiate_logs) > 0:
+            intermidiate_logs[-1].pop("screenshot_frame", None)
         
         if enable_intermediate_image_caption:
             # to start a thread to caption the image while the agent is thinking
@@ -301,25 +341,17 @@ def gui_agent_loop(
             caption_thread = threading.Thread(
                 target=lambda: caption_current_screenshot(
                     current_task=task,
-                    current_image_url=image_b64_url,
+                    current_image_url=frame,
                     model_config=agent_loop_config['caption_config'].get('model_config', agent_loop_config['model_config']),
                     result_container=caption_result_container
                 )
             )
             caption_thread.start()
 
-
-        smart_remove(image_path)
-        
         payload = {
             "session_id": session_id,
             "observation": {
-                "screenshot": {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": image_b64_url
-                    }
-                },
+                "screenshot": make_screenshot_observation(agent_server, frame),
             }
         }
 
@@ -373,7 +405,7 @@ def gui_agent_loop(
         if action['action_type'].upper() == "INFO":
             if reply_mode == "auto_reply":
                 print(f"AUTO REPLY INFO FROM MODEL!")
-                reply_info = auto_reply(image_b64_url, task, action, model_provider=agent_loop_config['model_config']['model_provider'], model_name=agent_loop_config['model_config']['model_name'])
+                reply_info = auto_reply(frame, task, action, model_provider=agent_loop_config['model_config']['model_provider'], model_name=agent_loop_config['model_config']['model_name'])
                 print(f"info: {reply_info}")
 
             elif reply_mode == "no_reply":
@@ -398,6 +430,7 @@ def gui_agent_loop(
             else:
                 raise ValueError(f"Unknown reply_mode: {reply_mode}")
 
+        action_start = time.monotonic()
         act_on_device(action, device_id, device_wm_size, print_command=True, reflush_app=reflush_app, show_window=False)
 
         history_actions.append(action)
@@ -430,10 +463,10 @@ def gui_agent_loop(
     
     # if intermediate caption is not enabled, but final caption is enabled, caption the final screenshot
     if enable_final_image_caption and not enable_intermediate_image_caption:
-        last_image_b64_url = intermidiate_logs[-1]['screenshot_b64_url']
+        last_frame = intermidiate_logs[-1]['screenshot_frame']
         caption_text = caption_current_screenshot(
             current_task=task,
-            current_image_url=last_image_b64_url,
+            current_image_url=last_frame,
             model_config=agent_loop_config['caption_config'].get('model_config', agent_loop_config['model_config']),
         )
         intermidiate_logs[-1]['screenshot_caption'] = caption_text
@@ -441,9 +474,9 @@ def gui_agent_loop(
     final_action_log = intermidiate_logs[-1] if len(intermidiate_logs) > 0 else {}
     final_action_log = final_action_log.copy()
 
-    if not enable_final_screenshot:
-        if 'screenshot_b64_url' in final_action_log:
-            del final_action_log['screenshot_b64_url']
+    screenshot_frame = final_action_log.pop('screenshot_frame', None)
+    if enable_final_screenshot and screenshot_frame is not None:
+        final_action_log['screenshot_b64_url'] = screenshot_frame.to_b64_url()
     if not enable_final_image_caption:
         if 'screenshot_caption' in final_action_log:
             del final_action_log['screenshot_caption']
@@ -453,8 +486,8 @@ def gui_agent_loop(
     if enable_intermediate_logs:
         for log in intermidiate_logs[:-1]:
             new_log = {}
-            if enable_intermediate_screenshots and 'screenshot_b64_url' in log:
-                new_log['screenshot_b64_url'] = log['screenshot_b64_url']
+            if enable_intermediate_screenshots and 'screenshot_frame' in log:
+                new_log['screenshot_b64_url'] = log['screenshot_frame'].to_b64_url()
             if enable_intermediate_image_caption and 'screenshot_caption' in log:
                 new_log['screenshot_caption'] = log['screenshot_caption']
             new_log['agent_action'] = log['agent_action']
@@ -486,6 +519,9 @@ def gui_agent_loop(
 
     # return_log['intermediate_logs'] = intermidiate_logs
 
+    # make sure the trace of the session is fully written before returning
+    agent_server.flush(session_id)
+
     # TODO: to support last screenshot and image caption
     # return_log['last_logs'] = 
 
@@ -10,14 +10,13 @@ import json
 from PIL import Image
 import io
 
-from tools.image_tools import draw_points, make_b64_url
+from tools.image_tools import draw_points
 
-from copilot_front_end.mobile_action_helper import capture_screenshot, dectect_screen_on, press_home_key
+from copilot_front_end.mobile_action_helper import capture_frame, dectect_screen_on, press_home_key
 
-from copilot_front_end.mobile_action_helper import init_device, open_screen
+from copilot_front_end.mobile_action_helper import init_device, open_screen, is_settle_enabled
 from copilot_front_end.pu_frontend_executor import act_on_device, uiTars_to_frontend_action
-
-from megfile import smart_remove
+from copilot_agent_server.base_server import make_screenshot_observation
 
 import time
 
@@ -158,7 +157,14 @@ def evaluate_task_on_device(agent_server, device_info, task, rollout_config, ext
     max_steps = rollout_config.get('max_steps', 40)
     delay_after_capture = rollout_config.get('delay_after_capture', 2)
 
+    # settle mode: capture as soon as the screen stops changing, instead of the fixed delay
+    settle_config = rollout_config.get('settle_config', None)
+    if is_settle_enabled(settle_config):
+        delay_after_capture = 0
+
     history_actions = []
+    # time.monotonic() of the last action start, the settle wait only counts frames after it
+    action_start = None
 
     for step_idx in range(max_steps):
         logger.debug(f"Step {step_idx + 1}/{max_steps} 开始")
@@ -168,21 +174,13 @@ def evaluate_task_on_device(agent_server, device_info, task, rollout_config, ext
             break
 
         logger.debug("正在捕获设备截图...")
-        image_path = capture_screenshot(device_id, "tmp_screenshot", print_command=False)
-        logger.debug(f"截图已保存: {image_path}")
-
-        image_b64_url = make_b64_url(image_path, resize_config=rollout_config['model_config'].get("resize_config", None))
-        smart_remove(image_path)
+        frame = capture_frame(device_id, print_command=False, settle_config=settle_config, since=action_start)
+        logger.debug(f"截图已捕获: {frame.size}")
 
         payload = {
             "session_id": session_id,
             "observation": {
-                "screenshot": {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": image_b64_url
-                    }
-                },
+                "screenshot": make_screenshot_observation(agent_server, frame, resize_config=rollout_config['model_config'].get("resize_config", None)),
             }
         }
 
@@ -191,7 +189,7 @@ def evaluate_task_on_device(agent_server, device_info, task, rollout_config, ext
             logger.debug(f"INFO 动作，需要回复: {info_action}")
 
             if auto_reply:
-                reply_info = reply_info_action(image_b64_url, task, info_action, model_provider=rollout_config['model_config']['model_provider'], model_name=rollout_config['model_config']['model_name'])
+                reply_info = reply_info_action(frame, task, info_action, model_provider=rollout_config['model_config']['model_provider'], model_name=rollout_config['model_config']['model_name'])
                 logger.debug(f"自动回复: {reply_info}")
             else:
                 print(f"\n[Agent 询问] {info_action.get('value', '')}")
@@ -202,6 +200,7 @@ def evaluate_task_on_device(agent_server, device_info, task, rollout_config, ext
 
         action = agent_server.automate_step(payload)['action']
         action = uiTars_to_frontend_action(action)
+        action_start = time.monotonic()
         act_on_device(action, device_id, device_wm_size, print_command=False, reflush_app=reflush_app)
         history_actions.append(action)
         logger.debug(f"Step {step_idx+1} 完成. Action: {action.get('action_type', 'UNKNOWN')}")
@@ -210,7 +209,8 @@ def evaluate_task_on_device(agent_server, device_info, task, rollout_config, ext
             logger.info(f"检测到终止动作: {action['action_type']}")
             break
 
-        time.sleep(delay_after_capture)
+        if delay_after_capture > 0:
+            time.sleep(delay_after_capture)
 
     if action['action_type'] in ['COMPLETE', "ABORT"]:
         stop_reason = action['action_type']
@@ -222,6 +222,9 @@ def evaluate_task_on_device(agent_server, device_info, task, rollout_config, ext
     return_log['stop_reason'] = stop_reason
     return_log['stop_steps'] = step_idx + 1
 
+    # session end: make sure the trace of the session is fully written
+    agent_server.flush(session_id)
+
     logger.info(f"任务完成 - 步数: {len(history_actions)}, 原因: {stop_reason}")
     return return_log
 
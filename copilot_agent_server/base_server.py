@@ -2,6 +2,10 @@ import json
 import jsonlines
 
 class BaseCopilotServer:
+    # whether `automate_step` accepts in-process image handles in the observation
+    # ({"type": "image_frame", "image_frame": ScreenFrame}) instead of base64 URLs
+    accepts_image_handles = False
+
     def __init__(self):
         pass
 
@@ -10,6 +14,34 @@ class BaseCopilotServer:
     
     def automate_step(self, *args, **kwargs):
         raise NotImplementedError
+
+    def flush(self, session_id=None):
+        """
+        Wait until everything logged for the session is persisted (no-op by default).
+        """
+        pass
+
+
+def make_screenshot_observation(agent_server, frame, resize_config=None):
+    """
+    Build the `observation['screenshot']` payload from a ScreenFrame:
+    the in-memory handle itself when the server accepts it, a base64 URL otherwise.
+    """
+    if getattr(agent_server, "accepts_image_handles", False):
+        if resize_config is not None:
+            from tools.image_tools import ScreenFrame
+            frame = ScreenFrame.from_bytes(frame.encode(resize_config=resize_config))
+        return {
+            "type": "image_frame",
+            "image_frame": frame
+        }
+
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": frame.to_b64_url(resize_config=resize_config)
+        }
+    }
     
 if __name__ == "__main__":
     pass
@@ -0,0 +1,130 @@
+"""
+Standalone HTTP agent server: serves `get_session` / `automate_step` of one
+shared LocalServer to thin device hosts using RemoteServer
+(copilot_agent_server/remote_server.py).
+
+Usage:
+    python -m copilot_agent_server.http_server
+    python -m copilot_agent_server.http_server --config mcp_server_config.yaml --host 0.0.0.0 --port 8706
+
+Endpoints:
+- POST /get_session: JSON payload, returns {"session_id"}
+- POST /automate_step: application/x-gelab-step body (JSON payload + screenshot
+  bytes, see remote_server.encode_step_body); a plain JSON payload with a
+  base64 image_url screenshot is accepted as well. Returns {"action", "current_step"}
+- POST /flush: {"session_id"}
+- GET /health
+- GET /llm_stats: {"endpoints": per-replica stats of balancer model providers
+  (tools/llm_balancer.py), "response_cache": response cache stats
+  (tools/llm_response_cache.py), null when the cache is disabled}
+
+Requests are handled concurrently on a thread pool (`http_max_concurrency`
+threads, default 64): steps of distinct sessions run in parallel, steps of one
+session are serialized by LocalServer.
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_agent_server.remote_server import STEP_CONTENT_TYPE, decode_step_body
+
+logger = logging.getLogger(__name__)
+
+
+def create_app(agent_server, max_concurrency: int = 64):
+    """
+    FastAPI application serving `agent_server` (any BaseCopilotServer).
+    """
+    import anyio
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+    from starlette.concurrency import run_in_threadpool
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # the blocking steps run on the anyio worker threads
+        anyio.to_thread.current_default_thread_limiter().total_tokens = max_concurrency
+        yield
+
+    app = FastAPI(title="gelab-zero agent server", lifespan=lifespan)
+
+    @app.exception_handler(AssertionError)
+    async def bad_request(request: Request, exc: AssertionError):
+        return JSONResponse(status_code=400, content={"error": str(exc)})
+
+    @app.exception_handler(Exception)
+    async def server_error(request: Request, exc: Exception):
+        logger.exception(f"{request.url.path} failed")
+        return JSONResponse(status_code=500, content={"error": f"{type(exc).__name__}: {exc}"})
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/llm_stats")
+    async def llm_stats():
+        from tools.ask_llm_v2 import get_endpoint_stats, get_response_cache_stats
+        return {
+            "endpoints": get_endpoint_stats(),
+            "response_cache": await run_in_threadpool(get_response_cache_stats),
+        }
+
+    @app.post("/get_session")
+    async def get_session(request: Request):
+        payload = await request.json()
+        session_id = await run_in_threadpool(agent_server.get_session, payload)
+        return {"session_id": session_id}
+
+    @app.post("/automate_step")
+    async def automate_step(request: Request):
+        body = await request.body()
+        if request.headers.get("content-type", "").startswith(STEP_CONTENT_TYPE):
+            payload = decode_step_body(body)
+        else:
+            payload = json.loads(body)
+        return await run_in_threadpool(agent_server.automate_step, payload)
+
+    @app.post("/flush")
+    async def flush(request: Request):
+        payload = await request.json()
+        await run_in_threadpool(agent_server.flush, payload.get("session_id"))
+        return {"status": "ok"}
+
+    return app
+
+
+def main():
+    import yaml
+    import uvicorn
+    from copilot_agent_server.local_server import get_local_server
+
+    parser = argparse.ArgumentParser(description="Serve the agent server over HTTP")
+    parser.add_argument("--config", default="mcp_server_config.yaml", help="yaml file with a server_config section")
+    parser.add_argument("--host", default=None, help="defaults to http_host of server_config, else 127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="defaults to http_port of server_config, else 8706")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        server_config = yaml.safe_load(f)["server_config"]
+
+    app = create_app(
+        get_local_server(server_config),
+        max_concurrency=server_config.get("http_max_concurrency", 64),
+    )
+    uvicorn.run(
+        app,
+        host=args.host or server_config.get("http_host", "127.0.0.1"),
+        port=args.port or server_config.get("http_port", 8706),
+        # device hosts keep their connection between steps
+        timeout_keep_alive=server_config.get("http_keep_alive", 75),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+from megfile import smart_open, smart_makedirs, smart_exists, smart_rename, smart_remove
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore:
+    """
+    Content-addressed store of the trace screenshots.
+
+    An image is stored once under the SHA-256 of its encoded bytes, sharded in
+    two levels of subdirectories: `{image_dir}/objects/ab/cd/abcd....jpeg`, so
+    identical frames (home screens, WAIT steps, ...) share one file and no
+    directory grows to millions of entries.
+
+    Every (session_id, image_name) referencing an object is recorded in a
+    SQLite index next to the objects (`index_path`, must be a local file).
+    `release_session` drops the references of a deleted session and `gc`
+    removes the objects nobody references any more.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS objects (
+        digest TEXT PRIMARY KEY,
+        size INTEGER,
+        refcount INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS refs (
+        session_id TEXT NOT NULL,
+        image_name TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        created REAL,
+        PRIMARY KEY (session_id, image_name)
+    );
+    CREATE INDEX IF NOT EXISTS objects_refcount ON objects (refcount);
+    """
+
+    def __init__(self, image_dir: str, index_path: str = None, timeout: float = 30.0):
+        self.image_dir = image_dir.rstrip('/')
+        self.objects_dir = f"{self.image_dir}/objects"
+        self.index_path = index_path or f"{self.objects_dir}/index.db"
+        self.timeout = timeout
+        # sqlite3 connections are not shared between threads
+        self._local = threading.local()
+
+        index_dir = self.index_path.rsplit('/', 1)[0] if '/' in self.index_path else ''
+        if index_dir and not smart_exists(index_dir):
+            smart_makedirs(index_dir)
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        # indexes created before refs had a creation time
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(refs)").fetchall()]
+        if "created" not in columns:
+            conn.execute("ALTER TABLE refs ADD COLUMN created REAL")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def digest(image_data: bytes) -> str:
+        return hashlib.sha256(image_data).hexdigest()
+
+    def object_path(self, digest: str) -> str:
+        return f"{self.objects_dir}/{digest[:2]}/{digest[2:4]}/{digest}.jpeg"
+
+    def digest_of_path(self, image_path: str):
+        """
+        The digest of an object path of this store, or None for any other path.
+        """
+        if not isinstance(image_path, str) or not image_path.startswith(self.objects_dir + "/"):
+            return None
+        return image_path.rsplit('/', 1)[-1][:-len(".jpeg")]
+
+    def put(self, image_data: bytes, session_id: str, image_name: str, digest: str = None) -> str:
+        """
+        Store encoded JPEG bytes referenced by (session_id, image_name).
+        The bytes are written only if the object does not exist yet.
+        Returns the object path.
+        """
+        if digest is None:
+            digest = self.digest(image_data)
+        image_path = self.object_path(digest)
+
+        # reference first: a concurrent gc can not remove the object any more
+        self.add_ref(digest, session_id, image_name, len(image_data))
+
+        if not smart_exists(image_path):
+            object_dir = image_path.rsplit('/', 1)[0]
+            if not smart_exists(object_dir):
+                smart_makedirs(object_dir, exist_ok=True)
+            # write then rename, readers never see a partial object
+            tmp_path = f"{image_path}.{uuid.uuid4().hex}.tmp"
+            with smart_open(tmp_path, "wb") as f:
+                f.write(image_data)
+            smart_rename(tmp_path, image_path)
+
+        return image_path
+
+    def add_ref(self, digest: str, session_id: str, image_name: str, size: int = None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT digest FROM refs WHERE session_id = ? AND image_name = ?",
+                (session_id, image_name),
+            ).fetchone()
+            if row is None or row[0] != digest:
+                if row is not None:
+                    # the image of this name was saved again with other content
+                    conn.execute("UPDATE objects SET refcount = refcount - 1 WHERE digest = ?", (row[0],))
+                conn.execute(
+                    "INSERT OR REPLACE INTO refs (session_id, image_name, digest, created) VALUES (?, ?, ?, ?)",
+                    (session_id, image_name, digest, time.time()),
+                )
+                conn.execute(
+                    "INSERT INTO objects (digest, size, refcount) VALUES (?, ?, 1) "
+                    "ON CONFLICT(digest) DO UPDATE SET refcount = refcount + 1",
+                    (digest, size),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release_session(self, session_id: str) -> int:
+        """
+        Drop all references of a session. Returns the number of dropped references.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT digest, COUNT(*) FROM refs WHERE session_id = ? GROUP BY digest", (session_id,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE objects SET refcount = refcount - ? WHERE digest = ?",
+                [(count, digest) for digest, count in rows],
+            )
+            conn.execute("DELETE FROM refs WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return sum(count for _, count in rows)
+
+    def list_sessions(self, min_age: float = None) -> list:
+        """
+        Sessions holding at least one reference; with `min_age`, only those
+        whose first reference is at least `min_age` seconds old.
+        """
+        if min_age is None:
+            rows = self._conn().execute("SELECT DISTINCT session_id FROM refs").fetchall()
+        else:
+            # references from before the creation time was recorded count as old
+            rows = self._conn().execute(
+                "SELECT session_id FROM refs GROUP BY session_id HAVING COALESCE(MIN(created), 0) <= ?",
+                (time.time() - min_age,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def gc(self, dry_run: bool = False, batch_size: int = 1000):
+        """
+        Remove the objects with no reference left.
+        Returns (number of removed objects, removed bytes).
+        """
+        conn = self._conn()
+        removed, removed_bytes = 0, 0
+        while True:
+            # the files are removed inside the write transaction, so a put of
+            # the same content waits and then writes the object again
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT digest, size FROM objects WHERE refcount <= 0 LIMIT ? OFFSET ?",
+                    (batch_size, removed if dry_run else 0),
+                ).fetchall()
+                if not dry_run:
+                    for digest, _ in rows:
+                        smart_remove(self.object_path(digest), missing_ok=True)
+                    conn.executemany("DELETE FROM objects WHERE digest = ?", [(digest,) for digest, _ in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            removed += len(rows)
+            removed_bytes += sum(size or 0 for _, size in rows)
+            if len(rows) < batch_size:
+                break
+
+        logger.info(f"Image gc {'(dry run) ' if dry_run else ''}removed {removed} objects, {removed_bytes} bytes")
+        return removed, removed_bytes
+
+    def reclaimable(self, released_sessions=()):
+        """
+        What `gc` would remove once the references of `released_sessions` are
+        dropped, without changing anything (dry runs).
+        Returns (number of objects, bytes).
+        """
+        conn = self._conn()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS released (session_id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM released")
+        conn.executemany("INSERT OR IGNORE INTO released (session_id) VALUES (?)", [(s,) for s in released_sessions])
+        row = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(o.size), 0) FROM objects o LEFT JOIN ("
+            "    SELECT digest, COUNT(*) AS n FROM refs WHERE session_id IN (SELECT session_id FROM released) GROUP BY digest"
+            ") r ON o.digest = r.digest WHERE o.refcount - COALESCE(r.n, 0) <= 0"
+        ).fetchone()
+        conn.execute("DELETE FROM released")
+        return row[0], row[1]
+
+    def stats(self) -> dict:
+        row = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0), "
+            "COALESCE(SUM(CASE WHEN refcount <= 0 THEN 1 ELSE 0 END), 0) FROM objects"
+        ).fetchone()
+        return {"objects": row[0], "bytes": row[1], "refs": row[2], "unreferenced": row[3]}
+
+
+_image_stores = {}
+_image_stores_lock = threading.Lock()
+
+
+def get_image_store(config: dict):
+    """
+    Get the image store described by a logger/server config, None when
+    screenshots use the flat layout:
+    - "image_store": "flat" (default, `{image_dir}/{session_id}_{name}.jpeg`) or "cas"
+    - "image_dir": root of the store
+    - "image_index_path": reference index, defaults to `{image_dir}/objects/index.db`
+    Instances are shared per image_dir.
+    """
+    layout = config.get("image_store", "flat")
+    if layout == "flat":
+        return None
+    if layout != "cas":
+        raise ValueError(f"Unknown image_store: {layout}")
+
+    image_dir = config["image_dir"].rstrip('/')
+    with _image_stores_lock:
+        if image_dir not in _image_stores:
+            _image_stores[image_dir] = ImageStore(image_dir, index_path=config.get("image_index_path"))
+        return _image_stores[image_dir]
@@ -2,16 +2,19 @@ import json
 import sys
 import os
 import logging
+import threading
 
 from copilot_agent_server.base_server import BaseCopilotServer
 
-from copilot_agent_server.local_server_logger import LocalServerLogger
+from copilot_agent_server.session_store import SessionStore
+from copilot_agent_server.trace_writer import flush_trace_writer
 
-from tools.image_tools import read_from_url, make_b64_url
+from tools.image_tools import read_bytes_from_url, prepare_b64_url, ScreenFrame
 
 from copilot_agent_server.parser_factory import get_parser
 
 from tools.ask_llm_v2 import ask_llm_anything
+from tools.prompt_tools import fill_prompt_template
 
 from copy import deepcopy
 
@@ -103,7 +106,61 @@ def _clean_base64_simple(messages):
         return messages
 
 
+def read_observation_image(screenshot):
+    """
+    Read the observation screenshot, return (image_data, image_handle).
+
+    image_data is the encoded image to persist, image_handle is an in-memory
+    ScreenFrame that travels in the messages until the model provider boundary.
+    Supported screenshot payloads:
+    - {"type": "image_url", "image_url": {"url": base64 URL or file path}}
+    - {"type": "image_bytes", "image_bytes": {"data": encoded bytes}}
+    - {"type": "image_frame", "image_frame": ScreenFrame} (in-process only)
+    """
+    screenshot_type = screenshot.get('type', 'image_url')
+
+    if screenshot_type == "image_frame":
+        image_handle = screenshot['image_frame']
+        return image_handle.encode(), image_handle
+
+    if screenshot_type == "image_bytes":
+        image_data = screenshot['image_bytes']['data']
+    else:
+        assert screenshot_type == "image_url", f"Unknown screenshot type: {screenshot_type}"
+        image_format, image_data = read_bytes_from_url(screenshot['image_url']['url'])
+
+    return image_data, ScreenFrame.from_bytes(image_data)
+
+
+def attach_image_handles(messages, image_handles):
+    """
+    Replace image references (stored file paths) in messages by in-memory image handles.
+    """
+    for msg in messages:
+        if type(msg['content']) == str:
+            continue
+        for content in msg['content']:
+            if content['type'] != "image_url":
+                continue
+            url = content['image_url']['url']
+            if isinstance(url, str) and url in image_handles:
+                content['image_url']['url'] = image_handles[url]
+    return messages
+
+
 class LocalServer(BaseCopilotServer):
+    """
+    In-process agent server, safe to share between threads so one instance
+    can serve all the devices of a host (see `get_local_server`).
+
+    Concurrency guarantee: the steps of one session are serialized by the
+    session lock and numbered 1, 2, ... without gaps or duplicates; steps of
+    distinct sessions share no lock beyond short bookkeeping (session cache,
+    trace writer queue) and run fully in parallel, LLM calls included.
+    """
+
+    # in-process callers may pass ScreenFrame handles instead of base64 URLs
+    accepts_image_handles = True
     
     def __init__(self, server_config: dict):
         super().__init__()
@@ -116,6 +173,22 @@ class LocalServer(BaseCopilotServer):
         assert "image_dir" in server_config, "server_config must contain 'image_dir'"
 
         self.debug = server_config.get("debug", False)
+
+        # parsed sessions stay in memory, steps only append to them
+        logger_config = {
+            key: server_config[key]
+            for key in ["log_dir", "image_dir", "storage_backend", "sqlite_path",
+                        "trace_queue_size", "trace_batch_size", "trace_fsync",
+                        "image_store", "image_index_path"]
+            if key in server_config
+        }
+        # trace records and screenshots are written behind the step by default
+        logger_config["async_write"] = server_config.get("async_write", True)
+        self.session_store = SessionStore(
+            logger_config,
+            max_sessions=server_config.get("session_cache_size", 256),
+            ttl=server_config.get("session_cache_ttl", 3600),
+        )
         
 
     
@@ -128,12 +201,6 @@ class LocalServer(BaseCopilotServer):
         import uuid
         session_id = str(uuid.uuid4())
 
-        server_logger = LocalServerLogger({
-            "log_dir": self.server_config["log_dir"],
-            "image_dir": self.server_config["image_dir"],
-            "session_id": session_id
-        })
-
         assert "task" in payload, "payload must contain 'task'"
         assert "task_type" in payload, "payload must contain 'task_type' indicating different parsers"
         assert "model_config" in payload, "payload must contain 'model_config'"
@@ -151,9 +218,21 @@ class LocalServer(BaseCopilotServer):
             "extra_info": extra_info
         }
 
-        server_logger.log_str(message_to_log, is_print=self.debug)
+        session = self.session_store.create(session_id, message_to_log)
+        session.server_logger.log_str(message_to_log, is_print=self.debug)
         return session_id
 
+    def flush(self, session_id: str = None):
+        """
+        Barrier: wait until the traces and images of the session are written.
+        """
+        # a streamed step still finishing holds the session lock
+        session = self.session_store.peek(session_id) if session_id is not None else None
+        if session is not None:
+            with session.lock:
+                pass
+        flush_trace_writer(session_id)
+
     def automate_step(self, payload: dict) -> dict:
         """
         Automate a step in the Copilot service.
@@ -161,18 +240,25 @@ class LocalServer(BaseCopilotServer):
         assert "session_id" in payload, "payload must contain 'session_id'"
         session_id = payload["session_id"]
 
-        server_logger = LocalServerLogger({
-            "log_dir": self.server_config["log_dir"],
-            "image_dir": self.server_config["image_dir"],
-            "session_id": session_id
-        })
-
-        logs = server_logger.read_logs()
-        assert len(logs) > 0, f"No logs found for session_id {session_id}"
-        current_ste = len(logs) - 1
+        # parsed from the session log only on a cache miss (e.g. after a restart);
+        # steps of one session run one at a time, other sessions are not blocked
+        session = self.session_store.acquire(session_id)
+        # a streamed step hands the lock over to its background thread
+        handover = {"done": False}
+        try:
+            return self._automate_step(session, payload, handover)
+        finally:
+            if not handover["done"]:
+                self.session_store.release(session)
+
+    def _automate_step(self, session, payload: dict, handover: dict) -> dict:
+        """
+        One step of a session, called with the session lock held.
+        """
+        server_logger = session.server_logger
+        current_ste = session.current_step
 
-        config_log = logs[0]
-        config_dict = config_log['message']
+        config_dict = session.config
         task_type = config_dict['task_type']
         model_config = config_dict['model_config']
         task = config_dict['task']
@@ -182,33 +268,32 @@ class LocalServer(BaseCopilotServer):
         # current image
         assert "observation" in payload, "payload must contain 'observation'"
         observation = payload['observation']
-        image_url = observation['screenshot']['image_url']['url']
 
-        image = read_from_url(image_url)
-        image_inner_url = server_logger.save_image(image, f"step_{current_ste+1}")
+        # keep the uploaded bytes as they are, decode only if they are not JPEG
+        image_data, image_handle = read_observation_image(observation['screenshot'])
+        image_inner_url = server_logger.save_image_bytes(image_data, f"step_{current_ste+1}")
 
         query = observation.get('query', '')
 
-        def get_envs_acts_from_logs(logs):
-            environments = []
-            actions = []
-            for log in logs[1:]:
-                msg = log['message']
-                assert "environment" in msg, "log message must contain 'environment'"
-                assert "action" in msg, "log message must contain 'action'"
-                environments.append(msg['environment'])
-                actions.append(msg['action'])
-            return environments, actions
-
-        environments, actions = get_envs_acts_from_logs(logs)
+        environments = list(session.environments)
+        actions = list(session.actions)
 
         current_env = {
             "image": image_inner_url,
             "user_comment": query
         }
+        # content-addressed screenshots are also referenced by their hash
+        image_digest = server_logger.image_digest(image_inner_url)
+        if image_digest is not None:
+            current_env["image_digest"] = image_digest
         environments.append(current_env)
 
-        parser = get_parser(task_type)
+        # "prompt_layout": "prefix_cache" puts the static instructions in a leading
+        # system message that serving engines with prefix caching reuse across steps
+        parser_kwargs = {}
+        if "prompt_layout" in model_config:
+            parser_kwargs["prompt_layout"] = model_config["prompt_layout"]
+        parser = get_parser(task_type, **parser_kwargs)
         messages_to_ask = parser.env2messages4ask(
             task = task,
             environments = environments,
@@ -216,6 +301,19 @@ class LocalServer(BaseCopilotServer):
         )
         asked_messages = deepcopy(messages_to_ask)
 
+        # per-step variables of the parser's prompt template, if it has one
+        prompt_template = getattr(parser, "prompt_template", None)
+        prompt_variables = None
+        if prompt_template is not None:
+            prompt_variables = parser.env2prompt_variables(
+                task = task,
+                environments = environments,
+                actions = actions,
+            )
+
+        # the current screenshot stays in memory, no re-read of the stored file
+        attach_image_handles(messages_to_ask, {image_inner_url: image_handle})
+
         model_name = model_config['model_name']
         model_provider = model_config.get('model_provider', 'eval')
         args = model_config.get('args', {
@@ -242,42 +340,146 @@ class LocalServer(BaseCopilotServer):
                                 continue
                             assert content['type'] == "image_url"
                             image_url = content['image_url']['url']
-                            image_resize_url = make_b64_url(image_url, resize_config={
+                            resize_config = {
                                 "is_resize": True,
                                 "target_image_size": target_size
-                            })
-                            content['image_url']['url'] = image_resize_url
+                            }
+                            # memoized; images already at the target size are sent as they are
+                            if isinstance(image_url, ScreenFrame):
+                                content['image_url']['url'] = ScreenFrame.from_bytes(image_url.encode(resize_config=resize_config))
+                            else:
+                                content['image_url']['url'] = prepare_b64_url(image_url, resize_config=resize_config)
 
                 resize_image_in_messages(messages_to_ask, target_image_size)
 
-        llm_start_time = time.time()
-        response = ask_llm_anything(
+        # token usage reported by the provider, including cached prompt tokens
+        usage = {}
+        ask_kwargs = dict(
             model_provider=model_provider,
             model_name=model_name,
             messages=messages_to_ask,
-            args=args
+            args=args,
+            usage_container=usage,
         )
-        llm_end_time = time.time()
-
-        action = parser.str2action(response)
+        llm_start_time = time.time()
 
-        # 构造日志消息
-        log_message = {
-            "environment": current_env,
-            "action": action,
-            "asked_messages": clean_base64_in_messages(asked_messages, environments),
-            "model_response": response,
-            "model_config": model_config,
-            "llm_cost": {
+        def finish_step(response, llm_end_time, action_time=None, action=None, error=None):
+            # a streamed step that failed after its early action was returned
+            # is recorded with that action and the error
+            if action is None:
+                action = parser.str2action(response)
+
+            # store the template reference instead of the full prompt when it rebuilds losslessly
+            stored_messages = clean_base64_in_messages(asked_messages, environments)
+            if prompt_template is not None and fill_prompt_template(prompt_template, prompt_variables) == stored_messages:
+                server_logger.save_prompt_template(prompt_template)
+                stored_messages = {
+                    "template_id": prompt_template["template_id"],
+                    "variables": prompt_variables
+                }
+
+            llm_cost = {
                 "llm_time": llm_end_time - llm_start_time,
                 "llm_start_time": llm_start_time,
                 "llm_end_time": llm_end_time
-            },
-        }
-
-        server_logger.log_str(log_message, is_print=self.debug)
+            }
+            if action_time is not None:
+                # streamed: when the action was handed to the caller
+                llm_cost["action_time"] = action_time - llm_start_time
+            if usage:
+                llm_cost["usage"] = usage
+
+            # 构造日志消息
+            log_message = {
+                "environment": current_env,
+                "action": action,
+                "asked_messages": stored_messages,
+                "model_response": response,
+                "model_config": model_config,
+                "llm_cost": llm_cost,
+            }
+            if error is not None:
+                log_message["error"] = error
+
+            server_logger.log_str(log_message, is_print=self.debug)
+            session.append_step(current_env, action)
+            return action
+
+        if model_config.get('stream', self.server_config.get('stream_actions', False)):
+            action = self._stream_step(session, ask_kwargs, parser, finish_step, handover)
+        else:
+            response = ask_llm_anything(**ask_kwargs)
+            action = finish_step(response, time.time())
 
         return {
             "action": action,
             "current_step": current_ste + 1
-        }
\ No newline at end of file
+        }
+
+    def _stream_step(self, session, ask_kwargs, parser, finish_step, handover):
+        """
+        Stream the completion on a background thread and return the action as
+        soon as its type and parameters are complete (without the summary), so
+        the device can act while the summary is still generated. The thread
+        logs the full step and then releases the session lock: the next step of
+        the session waits for it, other sessions do not. If the stream fails
+        after the action was returned, the step is still logged with that
+        action, the partial response and the error.
+        """
+        result = {}
+        ready = threading.Event()
+
+        def on_delta(text):
+            result["text"] = text
+            if ready.is_set():
+                return
+            action = parser.str2action_partial(text)
+            if action is not None:
+                result["action"] = action
+                result["action_time"] = time.time()
+                ready.set()
+
+        def run():
+            try:
+                response = ask_llm_anything(**ask_kwargs, stream_callback=on_delta)
+                action = finish_step(response, time.time(), result.get("action_time"))
+                # no early action (e.g. no summary after it): return the full one
+                result.setdefault("action", action)
+            except Exception as e:
+                logger.error(f"Session {session.session_id}: streamed step failed: {e}")
+                result["error"] = e
+                if "action" in result:
+                    # the caller already acts on the early action: keep the step
+                    try:
+                        finish_step(
+                            result.get("text", ""), time.time(), result["action_time"],
+                            action=result["action"], error=f"{type(e).__name__}: {e}"
+                        )
+                    except Exception as log_error:
+                        logger.error(f"Session {session.session_id}: failed to log the streamed step: {log_error}")
+            finally:
+                ready.set()
+                self.session_store.release(session)
+
+        handover["done"] = True
+        threading.Thread(target=run, daemon=True, name=f"step-{session.session_id}").start()
+
+        ready.wait()
+        if "action" not in result:
+            raise result["error"]
+        return result["action"]
+
+_local_servers = {}
+_local_servers_lock = threading.Lock()
+
+
+def get_local_server(server_config: dict) -> LocalServer:
+    """
+    Get the process-wide LocalServer of a server config, so that all callers
+    (MCP tools, devices) share its session cache and session locks.
+    """
+    key = json.dumps(server_config, sort_keys=True, default=str)
+    with _local_servers_lock:
+        if key not in _local_servers:
+            _local_servers[key] = LocalServer(server_config)
+        return _local_servers[key]
@@ -9,6 +9,15 @@ import base64
 from io import BytesIO
 from PIL import Image
 
+from tools.image_tools import sniff_image_format
+from copilot_agent_server.trace_storage import get_trace_storage
+from copilot_agent_server.trace_writer import get_trace_writer, flush_trace_writer
+from copilot_agent_server.image_store import get_image_store
+from tools.prompt_tools import fill_prompt_template
+
+# prompt templates already stored / loaded in this process
+_saved_prompt_templates = set()
+_loaded_prompt_templates = {}
 
 
 class LocalServerLogger(BaseLogger):
@@ -45,19 +54,78 @@ class LocalServerLogger(BaseLogger):
         
         self.log_target_file = f"{log_dir}/{session_id}.jsonl"
 
+        # jsonl (default) or sqlite, see trace_storage.py
+        self.storage = get_trace_storage({**logger_config, "log_dir": log_dir})
+
+        # flat (default) or content-addressed "cas" screenshots, see image_store.py
+        self.image_store = get_image_store({**logger_config, "image_dir": image_dir})
+
+        # write-behind: records and images are written by a background thread
+        self.writer = None
+        if logger_config.get("async_write", False):
+            self.writer = get_trace_writer(
+                max_queue=logger_config.get("trace_queue_size", 1024),
+                batch_size=logger_config.get("trace_batch_size", 64),
+                fsync=logger_config.get("trace_fsync", "none"),
+            )
+
         pass
 
-    def read_logs(self):
-        if not smart_exists(self.log_target_file):
-            return []
-        
-        # with smart_open(self.log_target_file, 'r') as f:
-        with smart_open(self.log_target_file, 'r',encoding='utf-8') as f:
-            reader = jsonlines.Reader(f)
-            logs = [obj for obj in reader]
-        
+    def flush(self):
+        """
+        Wait until all pending writes of this process are on the storage.
+        """
+        flush_trace_writer(self.session_id)
+
+    def read_logs(self, expand_prompts: bool = True):
+        """
+        All records of the session. Step prompts stored as a template reference
+        are rebuilt into the exact asked_messages unless `expand_prompts` is False.
+        """
+        self.flush()
+        logs = self.storage.read_logs(self.session_id)
+        if expand_prompts:
+            for log in logs[1:]:
+                self.expand_asked_messages(log['message'])
         return logs
 
+    def save_prompt_template(self, template: dict):
+        """
+        Store a prompt template once per process and storage.
+        """
+        key = (id(self.storage), template["template_id"])
+        if key not in _saved_prompt_templates:
+            self.storage.save_prompt_template(template)
+            _saved_prompt_templates.add(key)
+
+    def expand_asked_messages(self, message: dict):
+        """
+        Rebuild `asked_messages` in place from {"template_id", "variables"}.
+        """
+        asked_messages = message.get("asked_messages")
+        if isinstance(asked_messages, dict) and "template_id" in asked_messages:
+            template_id = asked_messages["template_id"]
+            if template_id not in _loaded_prompt_templates:
+                _loaded_prompt_templates[template_id] = self.storage.load_prompt_template(template_id)
+            message["asked_messages"] = fill_prompt_template(
+                _loaded_prompt_templates[template_id], asked_messages["variables"]
+            )
+        return message
+
+    def read_config(self):
+        """
+        The session_start record of the session, or None.
+        """
+        self.flush()
+        return self.storage.read_config(self.session_id)
+
+    def read_env_actions(self):
+        """
+        (environments, actions) of all steps of the session.
+        """
+        self.flush()
+        return self.storage.read_env_actions(self.session_id)
+
     def log_str(self, message_dict, is_print: bool = False):
         
         log_message = {
@@ -66,14 +134,53 @@ class LocalServerLogger(BaseLogger):
             "message": message_dict
         }
 
-        # with smart_open(self.log_target_file, 'a') as f:
-        with smart_open(self.log_target_file, 'a',encoding='utf-8') as f:
-            writer = jsonlines.Writer(f)
-            writer.write(log_message)
+        if self.writer is not None:
+            self.writer.log(self.storage, self.session_id, log_message)
+        else:
+            self.storage.append(self.session_id, log_message)
         
         if is_print:
             print(json.dumps(log_message, indent=2, ensure_ascii=False))
 
+    def image_digest(self, image_path: str):
+        """
+        Content digest of a saved image, None for the flat layout.
+        """
+        if self.image_store is None:
+            return None
+        return self.image_store.digest_of_path(image_path)
+
+    def save_image_bytes(self, image_data: bytes, image_name: str) -> str:
+        """
+        Save already encoded image bytes to the image directory.
+        JPEG bytes are written verbatim (no decode / re-encode), other formats
+        are decoded and stored through `save_image`.
+        Returns the path where the image is saved.
+        """
+        assert isinstance(image_data, bytes) and len(image_data) > 0, "image_data must be non-empty bytes"
+
+        if sniff_image_format(image_data) != "jpeg":
+            return self.save_image(Image.open(BytesIO(image_data)), image_name)
+
+        if self.image_store is not None:
+            # the object path only depends on the content
+            image_path = self.image_store.object_path(self.image_store.digest(image_data))
+        else:
+            image_path = f"{self.image_dir}/{self.session_id}_{image_name}.jpeg"
+
+        if self.writer is not None:
+            self.writer.save_image(self.storage, self.session_id, image_name, image_path, image_data, self.image_store)
+            return image_path
+
+        if self.image_store is not None:
+            self.image_store.put(image_data, self.session_id, image_name)
+        else:
+            with smart_open(image_path, "wb") as f:
+                f.write(image_data)
+        self.storage.record_image(self.session_id, image_name, image_path, len(image_data))
+
+        return image_path
+
     def save_image(self, image: Image.Image, image_name: str) -> str:
         """
         Save a PIL Image to the image directory with the given image name.
@@ -82,14 +189,26 @@ class LocalServerLogger(BaseLogger):
         assert isinstance(image, Image.Image), "image must be a PIL Image"
         assert (isinstance(image_name, str) or isinstance(image_name, int)) and len(image_name) > 0, "image_name must be a non-empty string"
 
+        if self.writer is not None and self.image_store is None:
+            # encoded and written by the writer thread
+            image_path = f"{self.image_dir}/{self.session_id}_{image_name}.jpeg"
+            self.writer.save_image(self.storage, self.session_id, image_name, image_path, image)
+            return image_path
+
         # to compress image into jpeg format
         buffered = BytesIO()
         image = image.convert('RGB')
         image.save(buffered, format="JPEG", quality=85)
         image_data = buffered.getvalue()
+
+        if self.image_store is not None:
+            # the object path needs the encoded bytes
+            return self.save_image_bytes(image_data, image_name)
+
         image_path = f"{self.image_dir}/{self.session_id}_{image_name}.jpeg"
         with smart_open(image_path, "wb") as f:
             f.write(image_data)
+        self.storage.record_image(self.session_id, image_name, image_path, len(image_data))
 
         return image_path
 
@@ -1,6 +1,6 @@
 from copilot_tools.parser_0920_summary import Parser0920Summary
 
-def get_parser(parser_name):
+def get_parser(parser_name, **parser_kwargs):
     
     parser_name_map = {
         "parser_0922_summary": Parser0920Summary,
@@ -8,7 +8,7 @@ def get_parser(parser_name):
     }
 
     if parser_name in parser_name_map:
-        return parser_name_map[parser_name]()
+        return parser_name_map[parser_name](**parser_kwargs)
     else:
         raise ValueError(f"Unknown parser name: {parser_name}")
 
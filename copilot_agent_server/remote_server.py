@@ -0,0 +1,120 @@
+import json
+import struct
+import logging
+
+from copilot_agent_server.base_server import BaseCopilotServer
+
+logger = logging.getLogger(__name__)
+
+
+# automate_step body: 4-byte big-endian length of the JSON payload, the JSON
+# payload, then the encoded screenshot bytes (no base64)
+STEP_CONTENT_TYPE = "application/x-gelab-step"
+
+
+def encode_step_body(payload: dict, image_data: bytes) -> bytes:
+    payload_data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return struct.pack(">I", len(payload_data)) + payload_data + image_data
+
+
+def decode_step_body(body: bytes) -> dict:
+    """
+    Rebuild the automate_step payload, the screenshot as an image_bytes observation.
+    """
+    assert len(body) >= 4, "truncated step body"
+    (payload_size,) = struct.unpack(">I", body[:4])
+    assert len(body) >= 4 + payload_size, "truncated step body"
+    payload = json.loads(body[4:4 + payload_size].decode("utf-8"))
+    payload["observation"]["screenshot"] = {
+        "type": "image_bytes",
+        "image_bytes": {"data": body[4 + payload_size:]}
+    }
+    return payload
+
+
+def screenshot_bytes(screenshot: dict) -> bytes:
+    """
+    Encoded bytes of an observation screenshot (frame handle, bytes or URL).
+    """
+    screenshot_type = screenshot.get('type', 'image_url')
+    if screenshot_type == "image_frame":
+        return screenshot['image_frame'].encode()
+    if screenshot_type == "image_bytes":
+        return screenshot['image_bytes']['data']
+
+    assert screenshot_type == "image_url", f"Unknown screenshot type: {screenshot_type}"
+    from tools.image_tools import read_bytes_from_url
+    _, image_data = read_bytes_from_url(screenshot['image_url']['url'])
+    return image_data
+
+
+class RemoteServerError(Exception):
+    pass
+
+
+class RemoteServer(BaseCopilotServer):
+    """
+    Thin client of the HTTP agent server (copilot_agent_server/http_server.py),
+    a drop-in replacement of LocalServer for `evaluate_task_on_device` and
+    `gui_agent_loop`: the parsers, traces and model credentials stay on the
+    server. Connections are kept alive and pooled, the screenshots are sent as
+    binary bodies. Safe to share between threads.
+
+    server_config:
+    - "server_url": e.g. "http://127.0.0.1:8706"
+    - "request_timeout": seconds, default 300 (a step includes the LLM call)
+    - "pool_size": pooled connections, default 16
+    """
+
+    # screenshots are read from the frame handles and sent as raw bytes
+    accepts_image_handles = True
+
+    def __init__(self, server_config: dict):
+        super().__init__()
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        assert "server_url" in server_config, "server_config must contain 'server_url'"
+        self.server_url = server_config["server_url"].rstrip('/')
+        self.timeout = server_config.get("request_timeout", 300)
+
+        pool_size = server_config.get("pool_size", 16)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, path: str, **kwargs):
+        response = self.session.post(f"{self.server_url}{path}", timeout=self.timeout, **kwargs)
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("error", response.text)
+            except ValueError:
+                detail = response.text
+            raise RemoteServerError(f"{path} failed with HTTP {response.status_code}: {detail}")
+        return response.json()
+
+    def get_session(self, payload: dict) -> str:
+        return self._post("/get_session", json=payload)["session_id"]
+
+    def automate_step(self, payload: dict) -> dict:
+        assert "observation" in payload, "payload must contain 'observation'"
+        observation = payload["observation"]
+        image_data = screenshot_bytes(observation["screenshot"])
+
+        payload = {
+            **payload,
+            "observation": {key: value for key, value in observation.items() if key != "screenshot"}
+        }
+        return self._post(
+            "/automate_step",
+            data=encode_step_body(payload, image_data),
+            headers={"Content-Type": STEP_CONTENT_TYPE},
+        )
+
+    def flush(self, session_id=None):
+        self._post("/flush", json={"session_id": session_id})
+
+    def close(self):
+        self.session.close()
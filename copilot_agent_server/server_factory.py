@@ -1,9 +1,11 @@
-
-from copilot_agent_server.local_server import LocalServer as LocalParserServer
-
-
 def get_server_class(server_type: str):
+    # imported on demand: a thin device host using the remote server does
+    # not need the parsers, the trace storage or the model clients
     if server_type == "local_parser_server":
+        from copilot_agent_server.local_server import LocalServer as LocalParserServer
         return LocalParserServer
+    elif server_type == "remote_server":
+        from copilot_agent_server.remote_server import RemoteServer
+        return RemoteServer
     else:
-        raise ValueError(f"Unknown server_type: {server_type}")
\ No newline at end of file
+        raise ValueError(f"Unknown server_type: {server_type}")
@@ -0,0 +1,188 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from copilot_agent_server.local_server_logger import LocalServerLogger
+
+logger = logging.getLogger(__name__)
+
+
+class SessionState:
+    """
+    Parsed state of one session: the session_start config plus the
+    environments and actions of all finished steps.
+
+    `lock` serializes the steps of the session: a step reads `current_step`,
+    runs and appends under it, so step numbers are assigned atomically.
+    """
+    def __init__(self, session_id: str, config: dict, server_logger: LocalServerLogger):
+        self.session_id = session_id
+        self.config = config
+        self.server_logger = server_logger
+
+        self.environments = []
+        self.actions = []
+
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+
+    @property
+    def current_step(self) -> int:
+        """
+        Number of finished steps.
+        """
+        return len(self.actions)
+
+    def append_step(self, environment: dict, action: dict):
+        self.environments.append(environment)
+        self.actions.append(action)
+
+
+class SessionStore:
+    """
+    In-memory store of parsed sessions, in front of the trace storage.
+
+    A step only appends its environment and action to the cached state, the
+    trace storage is read again only on a cache miss (evicted session or server
+    restart). Sessions idle for longer than `ttl` seconds, and the least
+    recently used ones beyond `max_sessions`, are evicted; a session whose
+    lock is held (a step is running) is never evicted.
+
+    There is exactly one state per cached session: concurrent misses on the
+    same session load it once, misses on distinct sessions load in parallel.
+    """
+    def __init__(self, logger_config: dict, max_sessions: int = 256, ttl: float = 3600):
+        # log_dir / image_dir / storage backend, shared by the loggers of all sessions
+        self.logger_config = logger_config
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        # per-session locks of the loads in progress
+        self._load_locks = {}
+
+    def _make_logger(self, session_id: str) -> LocalServerLogger:
+        return LocalServerLogger({
+            **self.logger_config,
+            "session_id": session_id
+        })
+
+    def create(self, session_id: str, config: dict) -> SessionState:
+        """
+        Register a new session, `config` is the session_start log message.
+        """
+        state = SessionState(session_id, config, self._make_logger(session_id))
+        self._put(state)
+        return state
+
+    def get(self, session_id: str) -> SessionState:
+        """
+        Get the state of a session, loading it from its log file on a cache miss.
+        """
+        state, load_lock = self._lookup(session_id)
+        if state is not None:
+            return state
+
+        with load_lock:
+            # another caller may have loaded it meanwhile
+            state, _ = self._lookup(session_id)
+            if state is None:
+                try:
+                    state = self._load(session_id)
+                    self._put(state)
+                finally:
+                    with self._lock:
+                        self._load_locks.pop(session_id, None)
+        return state
+
+    def _lookup(self, session_id: str):
+        """
+        (cached state, None) on a hit, (None, lock of the load) on a miss.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+                state.last_access = time.monotonic()
+                return state, None
+            return None, self._load_locks.setdefault(session_id, threading.Lock())
+
+    def acquire(self, session_id: str) -> SessionState:
+        """
+        Take the lock of a session and return its state. The lock may be
+        released by another thread (e.g. when a step finishes in background).
+        """
+        while True:
+            state = self.get(session_id)
+            state.lock.acquire()
+            with self._lock:
+                current = self._sessions.get(session_id)
+            if current is state:
+                state.last_access = time.monotonic()
+                return state
+            # evicted before the lock was taken, use the reloaded state
+            state.lock.release()
+
+    def release(self, state: SessionState):
+        state.last_access = time.monotonic()
+        state.lock.release()
+
+    @contextmanager
+    def locked(self, session_id: str):
+        """
+        Hold the lock of a session for one step, yields its state.
+        """
+        state = self.acquire(session_id)
+        try:
+            yield state
+        finally:
+            self.release(state)
+
+    def peek(self, session_id: str):
+        """
+        The cached state of a session, or None (no load from storage).
+        """
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _load(self, session_id: str) -> SessionState:
+        server_logger = self._make_logger(session_id)
+        config_log = server_logger.read_config()
+        assert config_log is not None, f"No logs found for session_id {session_id}"
+
+        state = SessionState(session_id, config_log['message'], server_logger)
+        environments, actions = server_logger.read_env_actions()
+        for environment, action in zip(environments, actions):
+            state.append_step(environment, action)
+
+        logger.debug(f"Session {session_id} loaded from storage ({state.current_step} steps)")
+        return state
+
+    def _put(self, state: SessionState):
+        with self._lock:
+            self._sessions[state.session_id] = state
+            self._sessions.move_to_end(state.session_id)
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id in list(self._sessions.keys()):
+            state = self._sessions[session_id]
+            if now - state.last_access > self.ttl and not state.lock.locked():
+                del self._sessions[session_id]
+
+        # least recently used first, skipping the sessions with a running step
+        overflow = len(self._sessions) - self.max_sessions
+        for session_id in list(self._sessions.keys()):
+            if overflow <= 0:
+                break
+            if not self._sessions[session_id].lock.locked():
+                del self._sessions[session_id]
+                overflow -= 1
@@ -0,0 +1,505 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import zipfile
+import jsonlines
+
+from megfile import smart_open, smart_makedirs, smart_exists
+
+
+class BaseTraceStorage:
+    """
+    Storage backend of the session traces written by LocalServerLogger.
+
+    A trace is a list of records {"session_id", "timestamp", "message"}: the
+    first one is the session_start config, each following one is a step
+    (environment, action, asked_messages, ...). Steps are numbered from 1.
+    """
+
+    def append(self, session_id: str, record: dict):
+        raise NotImplementedError
+
+    def append_many(self, session_id: str, records: list, fsync: bool = False):
+        """
+        Append several records of one session at once (used by the trace writer).
+        """
+        for record in records:
+            self.append(session_id, record)
+
+    def sync(self, session_id: str):
+        """
+        Make the records already appended to a session durable (fsync).
+        """
+        pass
+
+    def read_logs(self, session_id: str) -> list:
+        """
+        All records of a session, the session_start config first.
+        """
+        raise NotImplementedError
+
+    def read_config(self, session_id: str):
+        """
+        The session_start record, or None for an unknown session.
+        """
+        logs = self.read_logs(session_id)
+        return logs[0] if len(logs) > 0 else None
+
+    def read_steps(self, session_id: str, start: int = 1, end: int = None) -> list:
+        """
+        Step records `start` to `end` (inclusive, 1-based).
+        """
+        steps = self.read_logs(session_id)[1:]
+        return steps[start - 1:end]
+
+    def read_env_actions(self, session_id: str):
+        """
+        (environments, actions) of all steps of a session.
+        """
+        environments, actions = [], []
+        for record in self.read_steps(session_id):
+            msg = record['message']
+            assert "environment" in msg, "log message must contain 'environment'"
+            assert "action" in msg, "log message must contain 'action'"
+            environments.append(msg['environment'])
+            actions.append(msg['action'])
+        return environments, actions
+
+    def record_image(self, session_id: str, image_name: str, image_path: str, size: int):
+        """
+        Register an image stored for a session (the bytes stay in image_dir).
+        """
+        pass
+
+    def read_image(self, session_id: str, image_path: str) -> bytes:
+        """
+        Encoded bytes of an image referenced by a step environment.
+        """
+        with smart_open(image_path, "rb") as f:
+            return f.read()
+
+    def save_prompt_template(self, template: dict):
+        """
+        Store a prompt template once (see tools/prompt_tools.make_prompt_template).
+        """
+        raise NotImplementedError
+
+    def load_prompt_template(self, template_id: str) -> dict:
+        raise NotImplementedError
+
+    def delete_session(self, session_id: str):
+        raise NotImplementedError
+
+    def list_sessions(self) -> list:
+        raise NotImplementedError
+
+
+class JsonlTraceStorage(BaseTraceStorage):
+    """
+    One JSONL file per session under `log_dir` (the original layout).
+
+    Old sessions can be packed by `archive_session` into
+    `{log_dir}/archive/{session_id}.zip` (the trace and its images), they stay
+    readable through the same methods.
+    """
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+
+    def _log_file(self, session_id: str) -> str:
+        return f"{self.log_dir}/{session_id}.jsonl"
+
+    def _archive_file(self, session_id: str) -> str:
+        return f"{self.log_dir}/archive/{session_id}.zip"
+
+    def append(self, session_id: str, record: dict):
+        self.append_many(session_id, [record])
+
+    def append_many(self, session_id: str, records: list, fsync: bool = False):
+        with smart_open(self._log_file(session_id), 'a', encoding='utf-8') as f:
+            writer = jsonlines.Writer(f)
+            writer.write_all(records)
+            if fsync:
+                self._fsync(f)
+
+    def sync(self, session_id: str):
+        log_file = self._log_file(session_id)
+        if smart_exists(log_file):
+            with smart_open(log_file, 'a', encoding='utf-8') as f:
+                self._fsync(f)
+
+    @staticmethod
+    def _fsync(f):
+        f.flush()
+        try:
+            os.fsync(f.fileno())
+        except (AttributeError, io.UnsupportedOperation):
+            # remote (object store) files have no file descriptor
+            pass
+
+    def _open_trace(self, session_id: str):
+        """
+        Text stream of the trace, from the live file or the archive, or None.
+        """
+        log_file = self._log_file(session_id)
+        if smart_exists(log_file):
+            return smart_open(log_file, 'r', encoding='utf-8')
+
+        archive_file = self._archive_file(session_id)
+        if smart_exists(archive_file):
+            with smart_open(archive_file, 'rb') as f:
+                with zipfile.ZipFile(f) as archive:
+                    data = archive.read("trace.jsonl")
+            return io.StringIO(data.decode('utf-8'))
+
+        return None
+
+    def read_logs(self, session_id: str) -> list:
+        f = self._open_trace(session_id)
+        if f is None:
+            return []
+
+        with f:
+            reader = jsonlines.Reader(f)
+            logs = [obj for obj in reader]
+
+        return logs
+
+    def read_config(self, session_id: str):
+        # the config is the first line, no need to parse the rest
+        f = self._open_trace(session_id)
+        if f is None:
+            return None
+
+        with f:
+            line = f.readline()
+        return json.loads(line) if line.strip() else None
+
+    def read_image(self, session_id: str, image_path: str) -> bytes:
+        if smart_exists(image_path) or not smart_exists(self._archive_file(session_id)):
+            return super().read_image(session_id, image_path)
+
+        with smart_open(self._archive_file(session_id), 'rb') as f:
+            with zipfile.ZipFile(f) as archive:
+                return archive.read(f"images/{image_path.rsplit('/', 1)[-1]}")
+
+    def session_file(self, session_id: str):
+        """
+        The live trace file of a session, else its archive, else None.
+        """
+        for path in [self._log_file(session_id), self._archive_file(session_id)]:
+            if smart_exists(path):
+                return path
+        return None
+
+    def is_archived(self, session_id: str) -> bool:
+        return smart_exists(self._archive_file(session_id))
+
+    def archive_session(self, session_id: str) -> list:
+        """
+        Pack the trace and the images of a session into one compressed archive
+        and remove the live trace file. The images are left in place for the
+        caller to remove (flat files) or release (content-addressed objects).
+        Returns the paths of the packed images.
+        """
+        log_file = self._log_file(session_id)
+        with smart_open(log_file, 'rb') as f:
+            trace = f.read()
+
+        image_paths = []
+        for line in trace.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            image_path = json.loads(line)['message'].get('environment', {}).get('image')
+            if isinstance(image_path, str) and image_path not in image_paths and smart_exists(image_path):
+                image_paths.append(image_path)
+
+        archive_file = self._archive_file(session_id)
+        tmp_file = f"{archive_file}.tmp"
+        with smart_open(tmp_file, 'wb') as f:
+            with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("trace.jsonl", trace)
+                for image_path in image_paths:
+                    with smart_open(image_path, 'rb') as image_file:
+                        # JPEG does not deflate, store it as is
+                        archive.writestr(
+                            f"images/{image_path.rsplit('/', 1)[-1]}",
+                            image_file.read(),
+                            compress_type=zipfile.ZIP_STORED,
+                        )
+
+        from megfile import smart_rename, smart_remove
+        smart_rename(tmp_file, archive_file)
+        smart_remove(log_file)
+        return image_paths
+
+    def _template_file(self, template_id: str) -> str:
+        return f"{self.log_dir}/prompt_templates/{template_id}.json"
+
+    def save_prompt_template(self, template: dict):
+        template_file = self._template_file(template["template_id"])
+        if smart_exists(template_file):
+            return
+        with smart_open(template_file, 'w', encoding='utf-8') as f:
+            json.dump(template, f, ensure_ascii=False)
+
+    def load_prompt_template(self, template_id: str) -> dict:
+        with smart_open(self._template_file(template_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def delete_session(self, session_id: str):
+        from megfile import smart_remove
+        smart_remove(self._log_file(session_id), missing_ok=True)
+        smart_remove(self._archive_file(session_id), missing_ok=True)
+
+    def list_sessions(self, include_archived: bool = True) -> list:
+        from megfile import smart_glob
+        files = smart_glob(f"{self.log_dir}/*.jsonl")
+        sessions = set(f.rsplit('/', 1)[-1][:-len(".jsonl")] for f in files)
+        if include_archived:
+            files = smart_glob(f"{self.log_dir}/archive/*.zip")
+            sessions.update(f.rsplit('/', 1)[-1][:-len(".zip")] for f in files)
+        return sorted(sessions)
+
+
+class SqliteTraceStorage(BaseTraceStorage):
+    """
+    SQLite database with sessions, steps and images tables, indexed by
+    session_id and step. WAL mode lets several writer processes share it.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        timestamp TEXT,
+        task TEXT,
+        task_type TEXT,
+        model_name TEXT,
+        record TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS steps (
+        session_id TEXT NOT NULL,
+        step INTEGER NOT NULL,
+        timestamp TEXT,
+        environment TEXT NOT NULL,
+        action TEXT NOT NULL,
+        record TEXT NOT NULL,
+        PRIMARY KEY (session_id, step)
+    );
+    CREATE TABLE IF NOT EXISTS prompt_templates (
+        template_id TEXT PRIMARY KEY,
+        template TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS images (
+        session_id TEXT NOT NULL,
+        image_name TEXT NOT NULL,
+        image_path TEXT NOT NULL,
+        size INTEGER,
+        PRIMARY KEY (session_id, image_name)
+    );
+    """
+
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        # sqlite3 connections are not shared between threads
+        self._local = threading.local()
+
+        db_dir = db_path.rsplit('/', 1)[0] if '/' in db_path else ''
+        if db_dir and not smart_exists(db_dir):
+            smart_makedirs(db_dir)
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, session_id: str, record: dict):
+        self.append_many(session_id, [record])
+
+    def append_many(self, session_id: str, records: list, fsync: bool = False):
+        # one transaction per batch; with synchronous=NORMAL a WAL commit is
+        # not fsynced, so a durable batch commits with synchronous=FULL
+        conn = self._conn()
+        if fsync:
+            conn.execute("PRAGMA synchronous=FULL")
+        try:
+            with conn:
+                for record in records:
+                    self._insert(conn, session_id, record)
+        finally:
+            if fsync:
+                conn.execute("PRAGMA synchronous=NORMAL")
+
+    def sync(self, session_id: str):
+        # the WAL holds every committed record: checkpoint it into the
+        # database (fsyncing both), or fsync it directly while readers block the checkpoint
+        busy, _, _ = self._conn().execute("PRAGMA wal_checkpoint(FULL)").fetchone()
+        if busy:
+            wal_path = f"{self.db_path}-wal"
+            if os.path.exists(wal_path):
+                fd = os.open(wal_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def _insert(self, conn, session_id: str, record: dict):
+        msg = record['message']
+        if msg.get("log_type") == "session_start":
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, timestamp, task, task_type, model_name, record) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    record.get("timestamp"),
+                    msg.get("task"),
+                    msg.get("task_type"),
+                    msg.get("model_config", {}).get("model_name"),
+                    json.dumps(record, ensure_ascii=False),
+                ),
+            )
+        else:
+            # the step number is assigned inside the write transaction
+            conn.execute(
+                "INSERT INTO steps (session_id, step, timestamp, environment, action, record) "
+                "SELECT ?, COALESCE(MAX(step), 0) + 1, ?, ?, ?, ? FROM steps WHERE session_id = ?",
+                (
+                    session_id,
+                    record.get("timestamp"),
+                    json.dumps(msg.get("environment"), ensure_ascii=False),
+                    json.dumps(msg.get("action"), ensure_ascii=False),
+                    json.dumps(record, ensure_ascii=False),
+                    session_id,
+                ),
+            )
+
+    def read_logs(self, session_id: str) -> list:
+        config = self.read_config(session_id)
+        if config is None:
+            return []
+        return [config] + self.read_steps(session_id)
+
+    def read_config(self, session_id: str):
+        row = self._conn().execute(
+            "SELECT record FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def read_steps(self, session_id: str, start: int = 1, end: int = None) -> list:
+        rows = self._conn().execute(
+            "SELECT record FROM steps WHERE session_id = ? AND step >= ? AND step <= ? ORDER BY step",
+            (session_id, start, end if end is not None else 2**62),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def read_env_actions(self, session_id: str):
+        # only the two small columns, not the full records with asked_messages
+        rows = self._conn().execute(
+            "SELECT environment, action FROM steps WHERE session_id = ? ORDER BY step",
+            (session_id,),
+        ).fetchall()
+        environments = [json.loads(row[0]) for row in rows]
+        actions = [json.loads(row[1]) for row in rows]
+        return environments, actions
+
+    def count_steps(self, session_id: str) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM steps WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0]
+
+    def record_image(self, session_id: str, image_name: str, image_path: str, size: int):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO images (session_id, image_name, image_path, size) VALUES (?, ?, ?, ?)",
+                (session_id, image_name, image_path, size),
+            )
+
+    def save_prompt_template(self, template: dict):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO prompt_templates (template_id, template) VALUES (?, ?)",
+                (template["template_id"], json.dumps(template, ensure_ascii=False)),
+            )
+
+    def load_prompt_template(self, template_id: str) -> dict:
+        row = self._conn().execute(
+            "SELECT template FROM prompt_templates WHERE template_id = ?", (template_id,)
+        ).fetchone()
+        assert row is not None, f"Unknown prompt template: {template_id}"
+        return json.loads(row[0])
+
+    def delete_session(self, session_id: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM steps WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM images WHERE session_id = ?", (session_id,))
+
+    def list_sessions(self) -> list:
+        rows = self._conn().execute("SELECT session_id FROM sessions ORDER BY timestamp").fetchall()
+        return [row[0] for row in rows]
+
+    def session_stats(self) -> list:
+        """
+        (session_id, start timestamp, size in bytes) of every session with a
+        config or a step. The start is the config timestamp, else the first
+        step's (None if neither has one); the size is the stored records plus
+        the recorded image bytes.
+        """
+        rows = self._conn().execute("""
+            WITH ids AS (SELECT session_id FROM sessions UNION SELECT session_id FROM steps)
+            SELECT ids.session_id,
+                COALESCE(
+                    (SELECT timestamp FROM sessions WHERE session_id = ids.session_id),
+                    (SELECT MIN(timestamp) FROM steps WHERE session_id = ids.session_id)
+                ),
+                COALESCE((SELECT length(CAST(record AS BLOB)) FROM sessions WHERE session_id = ids.session_id), 0)
+                + COALESCE((SELECT SUM(length(CAST(record AS BLOB))) FROM steps WHERE session_id = ids.session_id), 0)
+                + COALESCE((SELECT SUM(size) FROM images WHERE session_id = ids.session_id), 0)
+            FROM ids
+        """).fetchall()
+        return [tuple(row) for row in rows]
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_trace_storage(config: dict) -> BaseTraceStorage:
+    """
+    Get the trace storage described by a logger/server config:
+    - "storage_backend": "jsonl" (default) or "sqlite"
+    - "log_dir": directory of the JSONL traces
+    - "sqlite_path": database file, defaults to `{log_dir}/traces.db`
+    Instances are shared per backend and location.
+    """
+    backend = config.get("storage_backend", "jsonl")
+    log_dir = config["log_dir"].rstrip('/')
+
+    if backend == "jsonl":
+        key = (backend, log_dir)
+    elif backend == "sqlite":
+        key = (backend, config.get("sqlite_path", f"{log_dir}/traces.db"))
+    else:
+        raise ValueError(f"Unknown storage_backend: {backend}")
+
+    with _storages_lock:
+        if key not in _storages:
+            if backend == "jsonl":
+                _storages[key] = JsonlTraceStorage(log_dir)
+            else:
+                _storages[key] = SqliteTraceStorage(key[1])
+        return _storages[key]
@@ -0,0 +1,209 @@
+import atexit
+import logging
+import queue
+import threading
+from io import BytesIO
+
+from megfile import smart_open
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+# fsync policies of the write-behind writer:
+# - "none": leave it to the OS / object store
+# - "batch": fsync the JSONL files after each written batch
+# - "flush": fsync all traces written since the last barrier when a flush
+#   barrier is reached (e.g. at session end)
+FSYNC_POLICIES = ["none", "batch", "flush"]
+
+
+class TraceWriteError(Exception):
+    """
+    Raised by `TraceWriter.flush` when writes enqueued before the barrier failed.
+    """
+
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__(f"{len(errors)} trace write(s) failed: " + "; ".join(errors[:3]))
+
+
+class TraceWriter:
+    """
+    Write-behind writer of session traces and screenshots.
+
+    `log` and `save_image` only enqueue the work and return; one background
+    thread drains the bounded queue in batches, appending all records of a
+    session with a single open of its trace and encoding/writing images off
+    the step critical path. `flush(session_id)` blocks until everything
+    enqueued before it is written, and raises TraceWriteError if some of
+    those writes (of the session, or of any session without `session_id`)
+    failed. When the queue is full, producers block (back-pressure) instead
+    of growing memory without bound.
+    """
+
+    def __init__(self, max_queue: int = 1024, batch_size: int = 64, fsync: str = "none"):
+        assert fsync in FSYNC_POLICIES, f"Unknown fsync policy: {fsync}"
+        self.batch_size = batch_size
+        self.fsync = fsync
+
+        # traces written but not fsynced yet ("flush" policy), and write
+        # errors not reported to a flush caller yet; used by the writer thread only
+        self._dirty = {}
+        self._errors = {}
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="trace-writer")
+        self._thread.start()
+
+    def log(self, storage, session_id: str, record: dict):
+        self._queue.put(("log", storage, session_id, record))
+
+    def save_image(self, storage, session_id: str, image_name: str, image_path: str, image, image_store=None):
+        """
+        Enqueue an image write, `image` is encoded JPEG bytes or a PIL Image
+        (JPEG-encoded by the writer thread). With an `image_store`, the bytes
+        are put in the content-addressed store, `image_path` being their object path.
+        """
+        self._queue.put(("image", storage, session_id, (image_name, image_path, image, image_store)))
+
+    def flush(self, session_id: str = None, timeout: float = None) -> bool:
+        """
+        Barrier: wait until everything enqueued so far is written.
+        Returns False on timeout, raises TraceWriteError if writes failed.
+        """
+        barrier = {"done": threading.Event(), "errors": []}
+        self._queue.put(("barrier", None, session_id, barrier))
+        if not barrier["done"].wait(timeout):
+            return False
+        if barrier["errors"]:
+            raise TraceWriteError(barrier["errors"])
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"Trace writer failed to write a batch: {e}")
+                self._add_error(None, f"batch: {e}")
+                # never leave a flush caller waiting
+                for kind, _, _, item in batch:
+                    if kind == "barrier":
+                        item["errors"].extend(self._take_errors(None))
+                        item["done"].set()
+
+    def _add_error(self, session_id, message: str):
+        self._errors.setdefault(session_id, []).append(message)
+
+    def _take_errors(self, session_id) -> list:
+        """
+        Pop the pending errors reported to a barrier of `session_id` (None: all).
+        """
+        if session_id is None:
+            errors = [error for session_errors in self._errors.values() for error in session_errors]
+            self._errors.clear()
+            return errors
+        return self._errors.pop(session_id, []) + self._errors.pop(None, [])
+
+    def _write_batch(self, batch):
+        # images first, so a trace record never points to a missing image
+        for kind, storage, session_id, item in batch:
+            if kind == "image":
+                self._write_image(storage, session_id, *item)
+
+        barriers = [(session_id, item) for kind, _, session_id, item in batch if kind == "barrier"]
+
+        # group the records per trace, keeping their order
+        records = {}
+        for kind, storage, session_id, item in batch:
+            if kind == "log":
+                records.setdefault((id(storage), session_id), (storage, session_id, []))[2].append(item)
+
+        for key, (storage, session_id, session_records) in records.items():
+            try:
+                storage.append_many(session_id, session_records, fsync=self.fsync == "batch")
+            except Exception as e:
+                logger.error(f"Failed to write {len(session_records)} trace records of session {session_id}: {e}")
+                self._add_error(session_id, f"records of session {session_id}: {e}")
+                continue
+            if self.fsync == "flush":
+                self._dirty[key] = (storage, session_id)
+
+        # a barrier makes every trace written since the last one durable
+        if self.fsync == "flush" and len(barriers) > 0:
+            for storage, session_id in self._dirty.values():
+                try:
+                    storage.sync(session_id)
+                except Exception as e:
+                    logger.error(f"Failed to fsync the trace of session {session_id}: {e}")
+                    self._add_error(session_id, f"fsync of session {session_id}: {e}")
+            self._dirty.clear()
+
+        for session_id, barrier in barriers:
+            barrier["errors"].extend(self._take_errors(session_id))
+            barrier["done"].set()
+
+    def _write_image(self, storage, session_id, image_name, image_path, image, image_store):
+        try:
+            if isinstance(image, Image.Image):
+                buffered = BytesIO()
+                image.convert('RGB').save(buffered, format="JPEG", quality=85)
+                image = buffered.getvalue()
+            if image_store is not None:
+                image_store.put(image, session_id, image_name, digest=image_store.digest_of_path(image_path))
+            else:
+                with smart_open(image_path, "wb") as f:
+                    f.write(image)
+            storage.record_image(session_id, image_name, image_path, len(image))
+        except Exception as e:
+            logger.error(f"Failed to save image {image_path}: {e}")
+            self._add_error(session_id, f"image {image_path}: {e}")
+
+
+_trace_writers = {}
+_trace_writers_lock = threading.Lock()
+
+
+def get_trace_writer(max_queue: int = 1024, batch_size: int = 64, fsync: str = "none") -> TraceWriter:
+    """
+    Get the process-wide trace writer of the given settings, created on first use.
+    Loggers configured with different settings (e.g. trace_fsync) get different writers.
+    """
+    key = (max_queue, batch_size, fsync)
+    with _trace_writers_lock:
+        if key not in _trace_writers:
+            _trace_writers[key] = TraceWriter(max_queue=max_queue, batch_size=batch_size, fsync=fsync)
+            atexit.register(_flush_at_exit, _trace_writers[key])
+        return _trace_writers[key]
+
+
+def _flush_at_exit(writer: TraceWriter):
+    try:
+        writer.flush(None, timeout=30.0)
+    except TraceWriteError as e:
+        logger.error(f"Trace writer: {e}")
+
+
+def flush_trace_writer(session_id: str = None, timeout: float = None) -> bool:
+    """
+    Flush the process-wide trace writers, if any was ever started.
+    Raises TraceWriteError if writes enqueued before the flush failed.
+    """
+    with _trace_writers_lock:
+        writers = list(_trace_writers.values())
+    flushed, errors = True, []
+    for writer in writers:
+        try:
+            flushed = writer.flush(session_id, timeout=timeout) and flushed
+        except TraceWriteError as e:
+            errors.extend(e.errors)
+    if errors:
+        raise TraceWriteError(errors)
+    return flushed
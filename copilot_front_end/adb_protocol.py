@@ -0,0 +1,463 @@
+"""
+Pure-Python client of the adb host protocol.
+
+Talks directly to the local adb server (127.0.0.1:5037 by default) instead of
+forking a shell and an `adb` client binary for every command:
+
+    request  := <4 hex digits length><payload>
+    response := "OKAY" | "FAIL" <4 hex digits length><message>
+
+Device services are reached by first switching the connection to a device
+with `host:transport:<serial>`. Shell commands use the shell v2 protocol when
+the device supports it, which multiplexes stdout, stderr and the exit code on
+one stream; older devices fall back to the legacy `shell:` service.
+
+The adb server closes a connection once a service has been bound to it, so
+connections cannot be reused after a command. The pool keeps connections that
+are opened ahead of time (warm) and refilled in the background, so a command
+does not pay for the connect on its critical path.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_ADB_HOST = "127.0.0.1"
+DEFAULT_ADB_PORT = 5037
+
+# shell v2 packet ids
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+SYNC_DATA_MAX = 64 * 1024
+
+
+class AdbProtocolError(Exception):
+    """
+    The adb server answered FAIL, or the stream is not what the protocol expects.
+    """
+
+
+def encode_request(payload):
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return b"%04x" % len(payload) + payload
+
+
+def decode_shell_v2(data):
+    """
+    Split a shell v2 stream into (exit_code, stdout, stderr) bytes.
+    """
+    stdout, stderr = bytearray(), bytearray()
+    exit_code = None
+    offset = 0
+    while offset + 5 <= len(data):
+        packet_id, length = struct.unpack("<BI", data[offset:offset + 5])
+        packet = data[offset + 5:offset + 5 + length]
+        offset += 5 + length
+        if packet_id == SHELL_ID_STDOUT:
+            stdout += packet
+        elif packet_id == SHELL_ID_STDERR:
+            stderr += packet
+        elif packet_id == SHELL_ID_EXIT:
+            exit_code = packet[0] if packet else 0
+    return exit_code, bytes(stdout), bytes(stderr)
+
+
+def parse_device_list(payload):
+    """
+    Parse `serial\\tstate` lines (the body of `host:devices` / `track-devices`).
+    """
+    devices = {}
+    for line in payload.splitlines():
+        parts = line.strip().split("\t")
+        if len(parts) >= 2:
+            devices[parts[0]] = parts[1]
+    return devices
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise AdbProtocolError(f"Connection closed while reading {size} bytes")
+        data += chunk
+    return bytes(data)
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _read_status(sock):
+    status = _recv_exactly(sock, 4)
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        length = int(_recv_exactly(sock, 4), 16)
+        message = _recv_exactly(sock, length).decode("utf-8", errors="replace")
+        raise AdbProtocolError(message)
+    raise AdbProtocolError(f"Unexpected adb status: {status!r}")
+
+
+def _read_hex_payload(sock):
+    length = int(_recv_exactly(sock, 4), 16)
+    return _recv_exactly(sock, length).decode("utf-8", errors="replace")
+
+
+class AdbClient:
+    """
+    Blocking client of the local adb server, with a pool of warm connections.
+    """
+
+    def __init__(self, host=DEFAULT_ADB_HOST, port=DEFAULT_ADB_PORT, pool_size=4, timeout=10.0, adb_path=None):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.adb_path = adb_path or shutil.which("adb") or "adb"
+
+        self._idle = deque()
+        self._pool_lock = threading.Condition()
+        self._refiller = None
+        self._server_started = False
+
+        # serial -> whether the device supports shell v2
+        self._shell_v2 = {}
+
+    # ---------------------------------------------------------------
+    # connections
+    # ---------------------------------------------------------------
+    def _connect(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except ConnectionRefusedError:
+            if self._server_started:
+                raise
+            # the adb client binary starts the server on demand, do the same once
+            self._server_started = True
+            logger.info("adb server is not running, starting it")
+            subprocess.run([self.adb_path, "start-server"], capture_output=True)
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _refill(self):
+        while True:
+            with self._pool_lock:
+                while len(self._idle) >= self.pool_size:
+                    self._pool_lock.wait()
+            try:
+                sock = self._connect()
+            except OSError as e:
+                logger.debug(f"Failed to warm an adb connection: {e}")
+                time.sleep(1.0)
+                continue
+            with self._pool_lock:
+                self._idle.append(sock)
+
+    def _acquire(self):
+        """
+        Take a warm connection from the pool, or open a new one.
+        Returns (sock, pooled).
+        """
+        with self._pool_lock:
+            if self.pool_size > 0 and self._refiller is None:
+                self._refiller = threading.Thread(target=self._refill, daemon=True, name="adb-connection-pool")
+                self._refiller.start()
+
+            sock = None
+            if self._idle:
+                sock = self._idle.popleft()
+            self._pool_lock.notify()
+
+        if sock is not None:
+            return sock, True
+        return self._connect(), False
+
+    def _request(self, request, serial=None):
+        """
+        Open a connection, optionally switch it to `serial`, and send `request`.
+        Returns the connection once the server answered OKAY; the caller owns it.
+        """
+        for attempt in range(2):
+            sock, pooled = self._acquire()
+            try:
+                if serial is not None:
+                    sock.sendall(encode_request(f"host:transport:{serial}"))
+                    _read_status(sock)
+                sock.sendall(encode_request(request))
+                _read_status(sock)
+                return sock
+            except AdbProtocolError as e:
+                sock.close()
+                # a warm connection may have been dropped by a restarted server
+                if pooled and attempt == 0 and "Connection closed" in str(e):
+                    continue
+                raise
+            except OSError:
+                sock.close()
+                if pooled and attempt == 0:
+                    continue
+                raise
+
+    def close(self):
+        with self._pool_lock:
+            while self._idle:
+                self._idle.popleft().close()
+
+    # ---------------------------------------------------------------
+    # host services
+    # ---------------------------------------------------------------
+    def version(self):
+        sock = self._request("host:version")
+        try:
+            return int(_read_hex_payload(sock), 16)
+        finally:
+            sock.close()
+
+    def devices(self):
+        """
+        Return {serial: state} of the attached devices.
+        """
+        sock = self._request("host:devices")
+        try:
+            return parse_device_list(_read_hex_payload(sock))
+        finally:
+            sock.close()
+
+    def track_devices(self):
+        """
+        Yield {serial: state} snapshots, one each time the device list changes.
+        """
+        sock = self._request("host:track-devices")
+        sock.settimeout(None)
+        try:
+            while True:
+                yield parse_device_list(_read_hex_payload(sock))
+        finally:
+            sock.close()
+
+    def features(self, serial):
+        sock = self._request(f"host-serial:{serial}:features")
+        try:
+            return _read_hex_payload(sock).split(",")
+        finally:
+            sock.close()
+
+    # ---------------------------------------------------------------
+    # device services
+    # ---------------------------------------------------------------
+    def open_service(self, serial, service, timeout=None):
+        """
+        Bind a device service (e.g. `exec:sh`) and return the raw connection.
+        """
+        sock = self._request(service, serial=serial)
+        sock.settimeout(timeout)
+        return sock
+
+    def _supports_shell_v2(self, serial):
+        if serial not in self._shell_v2:
+            try:
+                self._shell_v2[serial] = "shell_v2" in self.features(serial)
+            except AdbProtocolError:
+                self._shell_v2[serial] = False
+        return self._shell_v2[serial]
+
+    def run(self, serial, command, timeout=None):
+        """
+        Run a shell command on the device.
+        Returns a `subprocess.CompletedProcess` (text stdout/stderr), like
+        `subprocess.run(f"adb -s {serial} shell {command}", capture_output=True, text=True)`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        if self._supports_shell_v2(serial):
+            sock = self.open_service(serial, f"shell,v2,raw:{command}", timeout=timeout)
+            try:
+                exit_code, stdout, stderr = decode_shell_v2(_recv_all(sock))
+            finally:
+                sock.close()
+        else:
+            sock = self.open_service(serial, f"shell:{command}", timeout=timeout)
+            try:
+                exit_code, stdout, stderr = 0, _recv_all(sock), b""
+            finally:
+                sock.close()
+
+        return subprocess.CompletedProcess(
+            args=command,
+            returncode=exit_code if exit_code is not None else -1,
+            stdout=stdout.decode("utf-8", errors="replace"),
+            stderr=stderr.decode("utf-8", errors="replace"),
+        )
+
+    def shell(self, serial, command, timeout=None):
+        """
+        Run a shell command on the device and return its stdout.
+        """
+        return self.run(serial, command, timeout=timeout).stdout
+
+    def push(self, serial, local_path, remote_path, mode=0o644):
+        """
+        Push a local file to the device with the sync service.
+        `remote_path` is the full destination file path (or a directory ending with "/").
+        """
+        if remote_path.endswith("/"):
+            remote_path = remote_path + os.path.basename(local_path)
+
+        with open(local_path, "rb") as f:
+            data = f.read()
+
+        sock = self.open_service(serial, "sync:", timeout=self.timeout)
+        try:
+            header = f"{remote_path},{mode}".encode("utf-8")
+            sock.sendall(b"SEND" + struct.pack("<I", len(header)) + header)
+            for offset in range(0, len(data), SYNC_DATA_MAX):
+                chunk = data[offset:offset + SYNC_DATA_MAX]
+                sock.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+            sock.sendall(b"DONE" + struct.pack("<I", int(time.time())))
+
+            status = _recv_exactly(sock, 4)
+            length = struct.unpack("<I", _recv_exactly(sock, 4))[0]
+            if status != b"OKAY":
+                message = _recv_exactly(sock, length).decode("utf-8", errors="replace")
+                raise AdbProtocolError(f"Failed to push {local_path} to {remote_path}: {message}")
+            sock.sendall(b"QUIT" + struct.pack("<I", 0))
+        finally:
+            sock.close()
+
+
+class AsyncAdbClient:
+    """
+    asyncio variant of `AdbClient`, for running many device commands concurrently.
+    """
+
+    def __init__(self, host=DEFAULT_ADB_HOST, port=DEFAULT_ADB_PORT, timeout=10.0, max_concurrency=32):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._shell_v2 = {}
+
+    async def _read_status(self, reader):
+        status = await reader.readexactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(await reader.readexactly(4), 16)
+            message = (await reader.readexactly(length)).decode("utf-8", errors="replace")
+            raise AdbProtocolError(message)
+        raise AdbProtocolError(f"Unexpected adb status: {status!r}")
+
+    async def _read_hex_payload(self, reader):
+        length = int(await reader.readexactly(4), 16)
+        return (await reader.readexactly(length)).decode("utf-8", errors="replace")
+
+    async def _request(self, request, serial=None):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            if serial is not None:
+                writer.write(encode_request(f"host:transport:{serial}"))
+                await self._read_status(reader)
+            writer.write(encode_request(request))
+            await self._read_status(reader)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def devices(self):
+        reader, writer = await self._request("host:devices")
+        try:
+            return parse_device_list(await self._read_hex_payload(reader))
+        finally:
+            writer.close()
+
+    async def features(self, serial):
+        reader, writer = await self._request(f"host-serial:{serial}:features")
+        try:
+            return (await self._read_hex_payload(reader)).split(",")
+        finally:
+            writer.close()
+
+    async def run(self, serial, command, timeout=None):
+        """
+        Run a shell command on the device, returns a `subprocess.CompletedProcess`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        async with self._semaphore:
+            if serial not in self._shell_v2:
+                try:
+                    self._shell_v2[serial] = "shell_v2" in await self.features(serial)
+                except AdbProtocolError:
+                    self._shell_v2[serial] = False
+
+            service = f"shell,v2,raw:{command}" if self._shell_v2[serial] else f"shell:{command}"
+            reader, writer = await self._request(service, serial=serial)
+            try:
+                data = await asyncio.wait_for(reader.read(), timeout=timeout)
+            finally:
+                writer.close()
+
+        if self._shell_v2[serial]:
+            exit_code, stdout, stderr = decode_shell_v2(data)
+        else:
+            exit_code, stdout, stderr = 0, data, b""
+
+        return subprocess.CompletedProcess(
+            args=command,
+            returncode=exit_code if exit_code is not None else -1,
+            stdout=stdout.decode("utf-8", errors="replace"),
+            stderr=stderr.decode("utf-8", errors="replace"),
+        )
+
+    async def shell(self, serial, command, timeout=None):
+        return (await self.run(serial, command, timeout=timeout)).stdout
+
+
+_adb_client = None
+_adb_client_lock = threading.Lock()
+
+
+def get_adb_client() -> AdbClient:
+    """
+    Get the process-wide adb protocol client.
+    """
+    global _adb_client
+    with _adb_client_lock:
+        if _adb_client is None:
+            _adb_client = AdbClient()
+        return _adb_client
+
+
+__all__ = [
+    "AdbClient",
+    "AdbProtocolError",
+    "AsyncAdbClient",
+    "decode_shell_v2",
+    "encode_request",
+    "get_adb_client",
+    "parse_device_list",
+]
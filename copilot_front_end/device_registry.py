@@ -0,0 +1,139 @@
+"""
+Cached registry of the devices attached to the local adb server.
+
+Instead of enumerating all devices before every adb command, the registry
+keeps the serial list in memory. It is kept up to date by a background
+`host:track-devices` watcher, which pushes a new snapshot each time a device
+is attached, detached or changes state. When the watcher cannot run, a
+periodic refresher re-lists the devices instead.
+"""
+
+import logging
+import threading
+import time
+
+from copilot_front_end.adb_protocol import get_adb_client
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRegistry:
+    """
+    In-memory serial -> state map of the attached devices.
+    """
+
+    def __init__(self, refresh_interval=5.0, miss_refresh_interval=1.0):
+        # period of the fallback refresher when track-devices is not available
+        self.refresh_interval = refresh_interval
+        # minimal gap between two refreshes triggered by unknown serials
+        self.miss_refresh_interval = miss_refresh_interval
+
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._last_refresh = 0.0
+
+        self._watcher = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """
+        Take an initial snapshot and start the background watcher (idempotent).
+        """
+        with self._start_lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._stop_event.clear()
+            self.refresh()
+            self._watcher = threading.Thread(target=self._watch, daemon=True, name="adb-device-registry")
+            self._watcher.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def refresh(self):
+        """
+        Re-list the devices synchronously.
+        """
+        self._update(get_adb_client().devices())
+
+    def _update(self, devices):
+        with self._lock:
+            if devices.keys() != self._devices.keys():
+                logger.debug(f"Device list changed: {sorted(devices)}")
+            self._devices = devices
+            self._last_refresh = time.monotonic()
+
+    def list_devices(self):
+        """
+        Serials of all attached devices, served from the cache.
+        """
+        self.start()
+        with self._lock:
+            return [serial for serial, state in self._devices.items() if state == "device"]
+
+    def has_device(self, device_id):
+        """
+        O(1) check whether a device is attached.
+        An unknown serial triggers one (rate limited) refresh before giving up,
+        so a just-attached device is not rejected before the watcher sees it.
+        """
+        self.start()
+        with self._lock:
+            if self._devices.get(device_id) == "device":
+                return True
+            stale = time.monotonic() - self._last_refresh >= self.miss_refresh_interval
+
+        if stale:
+            self.refresh()
+            with self._lock:
+                return self._devices.get(device_id) == "device"
+        return False
+
+    def __contains__(self, device_id):
+        return self.has_device(device_id)
+
+    def _watch(self):
+        while not self._stop_event.is_set():
+            try:
+                self._track_devices()
+            except Exception as e:
+                logger.debug(f"adb track-devices unavailable, falling back to polling: {e}")
+
+            # track-devices exited (adb server restarted or missing), poll until the next retry
+            if self._stop_event.wait(self.refresh_interval):
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh device list: {e}")
+
+    def _track_devices(self):
+        """
+        Follow `host:track-devices`, each message describes the full device list.
+        """
+        for devices in get_adb_client().track_devices():
+            self._update(devices)
+            if self._stop_event.is_set():
+                break
+
+
+_device_registry = None
+_device_registry_lock = threading.Lock()
+
+
+def get_device_registry() -> DeviceRegistry:
+    """
+    Get the process-wide device registry.
+    """
+    global _device_registry
+    with _device_registry_lock:
+        if _device_registry is None:
+            _device_registry = DeviceRegistry()
+        return _device_registry
+
+
+__all__ = [
+    "DeviceRegistry",
+    "get_device_registry",
+]
@@ -0,0 +1,250 @@
+"""
+Per-device state service.
+
+Keeps screen power, orientation, manufacturer, focused activity and IME
+visibility of each device, answering from a TTL cache. Cache misses are
+served by one long-lived shell per device, bound through the adb protocol
+client, instead of spawning a new `adb shell dumpsys ...` process for every
+probe. Callers that change the device state (actions, screen on/off) push
+invalidations or known values.
+"""
+
+import re
+import logging
+import threading
+import time
+import queue
+from uuid import uuid4
+
+from copilot_front_end.adb_protocol import get_adb_client
+
+logger = logging.getLogger(__name__)
+
+
+# seconds a cached value stays valid, None means it never expires
+DEFAULT_STATE_TTL = {
+    "screen_on": 3.0,
+    # also invalidated by app switches and coordinate actions (see pu_frontend_executor)
+    "orientation": 1.0,
+    "manufacturer": None,
+    "focused_activity": 1.0,
+    "ime_visible": 1.0,
+}
+
+# state keys that may change when an action is performed on the device;
+# orientation is dropped by app switches and coordinate actions (see pu_frontend_executor)
+VOLATILE_STATE_KEYS = ["screen_on", "focused_activity", "ime_visible"]
+
+
+class ShellSession:
+    """
+    A long-lived `sh` on the device, bound through the adb protocol client (`exec:sh`).
+    Commands are written to its stdin and their output is read up to an end marker.
+    """
+
+    def __init__(self, device_id, adb_client=None):
+        self.device_id = device_id
+        self.adb_client = adb_client
+
+        self._sock = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        adb_client = self.adb_client or get_adb_client()
+        self._sock = adb_client.open_service(self.device_id, "exec:sh")
+        self._lines = queue.Queue()
+
+        def pump(sock, lines):
+            try:
+                for line in sock.makefile("r", encoding="utf-8", errors="replace"):
+                    lines.put(line)
+            except (OSError, ValueError):
+                pass
+            lines.put(None)
+
+        threading.Thread(target=pump, args=(self._sock, self._lines), daemon=True).start()
+        logger.debug(f"Started long-lived shell for device {self.device_id}")
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._lines = None
+
+    def run(self, command, timeout=5.0):
+        """
+        Run a shell command on the device and return its output.
+        """
+        with self._lock:
+            if self._sock is None:
+                self._start()
+
+            marker = f"__GELAB_END_{uuid4().hex}__"
+            try:
+                self._sock.sendall(f"{command}; echo {marker}\n".encode("utf-8"))
+            except OSError as e:
+                self._close()
+                raise RuntimeError(f"adb shell for device {self.device_id} is gone: {e}")
+
+            output = []
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    line = self._lines.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    # the shell is stuck, restart it on the next command
+                    self._close()
+                    raise TimeoutError(f"adb shell command timed out on device {self.device_id}: {command}")
+
+                if line is None:
+                    self._close()
+                    raise RuntimeError(f"adb shell for device {self.device_id} exited")
+                if marker in line:
+                    break
+                output.append(line)
+
+            return "".join(output)
+
+
+class DeviceStateService:
+    """
+    Cached state of one device, refreshed on demand through a long-lived shell.
+    """
+
+    def __init__(self, device_id, ttl=None, shell=None):
+        self.device_id = device_id
+
+        self.ttl = dict(DEFAULT_STATE_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+
+        self.shell = shell if shell is not None else ShellSession(device_id)
+
+        # key -> (value, expires_at)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+        self._probes = {
+            "screen_on": self._probe_screen_on,
+            "orientation": self._probe_orientation,
+            "manufacturer": self._probe_manufacturer,
+            "focused_activity": self._probe_focused_activity,
+            "ime_visible": self._probe_ime_visible,
+        }
+
+    def get(self, key):
+        """
+        Get a state value, from the cache if it is still fresh.
+        """
+        assert key in self._probes, f"Unknown device state: {key}"
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                value, expires_at = cached
+                if expires_at is None or time.monotonic() < expires_at:
+                    return value
+
+        value = self._probes[key]()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """
+        Push a known value into the cache (e.g. from the live scrcpy session).
+        """
+        ttl = self.ttl.get(key)
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._cache[key] = (value, expires_at)
+
+    def invalidate(self, keys=None):
+        """
+        Drop cached values, all volatile states by default.
+        """
+        if keys is None:
+            keys = VOLATILE_STATE_KEYS
+        with self._lock:
+            for key in keys:
+                self._cache.pop(key, None)
+
+    def close(self):
+        self.shell.close()
+
+    def is_screen_on(self):
+        return self.get("screen_on")
+
+    def get_orientation(self):
+        return self.get("orientation")
+
+    def get_manufacturer(self):
+        return self.get("manufacturer")
+
+    def get_focused_activity(self):
+        return self.get("focused_activity")
+
+    def is_ime_visible(self):
+        return self.get("ime_visible")
+
+    # probes, the grep runs inside the device shell so it also works on Windows hosts
+    def _probe_screen_on(self):
+        output = self.shell.run("dumpsys display | grep mScreenState")
+        return "ON" in output
+
+    def _probe_orientation(self):
+        output = self.shell.run("dumpsys input | grep -m 1 -o -E 'orientation=[0-9]'")
+        match = re.search(r"orientation=(\d)", output)
+        return int(match.group(1)) if match else 0
+
+    def _probe_manufacturer(self):
+        return self.shell.run("getprop ro.product.manufacturer").strip().lower()
+
+    def _probe_focused_activity(self):
+        output = self.shell.run("dumpsys window | grep -m 1 mCurrentFocus")
+        match = re.search(r"\s([\w.]+/[\w.$]+)\}", output)
+        return match.group(1) if match else output.strip()
+
+    def _probe_ime_visible(self):
+        output = self.shell.run("dumpsys input_method | grep -m 1 mInputShown")
+        return "mInputShown=true" in output
+
+
+_state_services = {}
+_state_services_lock = threading.Lock()
+
+
+def get_device_state(device_id) -> DeviceStateService:
+    """
+    Get the (process-wide) state service of the specified device.
+    """
+    with _state_services_lock:
+        if device_id not in _state_services:
+            _state_services[device_id] = DeviceStateService(device_id)
+        return _state_services[device_id]
+
+
+def invalidate_device_state(device_id, keys=None):
+    """
+    Invalidate cached states of the specified device, if it has a state service.
+    """
+    with _state_services_lock:
+        service = _state_services.get(device_id)
+    if service is not None:
+        service.invalidate(keys)
+
+
+__all__ = [
+    "DeviceStateService",
+    "ShellSession",
+    "get_device_state",
+    "invalidate_device_state",
+]
@@ -15,11 +15,13 @@ _scrcpy_path = os.path.join(os.path.dirname(_gelab_root), 'scrcpy-py-ddlx')
 if os.path.exists(_scrcpy_path) and _scrcpy_path not in sys.path:
     sys.path.insert(0, _scrcpy_path)
 from copilot_front_end.package_map import find_package_name
+from copilot_front_end.device_state_service import get_device_state, invalidate_device_state
+from copilot_front_end.device_registry import get_device_registry
+from copilot_front_end.adb_protocol import get_adb_client
 
 import time
 from tqdm import tqdm
 
-from megfile import smart_copy
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +32,7 @@ def _get_adb_command(device_id=None):
     if device_id is None:
         adb_command = "adb "
     else:
-        assert device_id in list_devices(), f"Device {device_id} not found in connected devices."
+        assert get_device_registry().has_device(device_id), f"Device {device_id} not found in connected devices."
         adb_command = f"adb -s {device_id} "
     return adb_command
 
@@ -61,17 +63,17 @@ def close_app_on_device(device_id, app_name, print_command = False):
     """
     Close the specified app on the device.
     """
-    adb_command = _get_adb_command(device_id)
+    _get_adb_command(device_id)
     
     package_name = find_package_name(app_name)
     if package_name is None:
         raise ValueError(f"App {app_name} not found in package map.")
     
-    command = f"{adb_command} shell am force-stop {package_name}"
+    command = f"am force-stop {package_name}"
     if print_command:
-        print(f"Executing command: {command}")
+        print(f"Executing command: adb -s {device_id} shell {command}")
     
-    subprocess.run(command, shell=True, capture_output=True, text=True)
+    get_adb_client().run(device_id, command)
 
 def press_home_key(device_id, print_command=False, show_window=False):
     """
@@ -87,24 +89,24 @@ def init_device(device_id, print_command = False):
     """
     Initialize the device by checking if yadb is installed.
     """
-    adb_command = _get_adb_command(device_id)
+    _get_adb_command(device_id)
+    adb_client = get_adb_client()
     
     # adb -s DEVICE_ID shell ls /data/local/tmp 
     # except yadb 
-    command = f"{adb_command} shell md5sum /data/local/tmp/yadb"
+    command = "md5sum /data/local/tmp/yadb"
     if print_command:
-        print(f"Executing command: {command}")
+        print(f"Executing command: adb -s {device_id} shell {command}")
     
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    result = adb_client.run(device_id, command)
     if "29a0cd3b3adea92350dd5a25594593df" not in result.stdout:
         # to push yadb into the device
-        command = f"{adb_command} push yadb /data/local/tmp"
         logger.info(f"YADB not installed, installing on device {device_id}...")
 
         if print_command:
-            print(f"Executing command: {command}")
+            print(f"Executing command: adb -s {device_id} push yadb /data/local/tmp")
 
-        subprocess.run(command, shell=True, capture_output=True, text=True)
+        adb_client.push(device_id, "yadb", "/data/local/tmp/yadb")
     else:
         logger.debug(f"YADB already installed on device {device_id}")
 
@@ -122,39 +124,12 @@ def init_all_devices():
 def dectect_screen_on(device_id, print_command = False):
     """
     Detect whether the screen is on for the specified device.
+    Served by the cached device state service (see device_state_service.py).
     """
-    adb_command = _get_adb_command(device_id)
-    
-    # adb shell dumpsys display | grep mScreenState
-
-    #duplicate the command, support win platform
-    # command = f"{adb_command} shell dumpsys display | grep mScreenState"
-    # if print_command:
-    #     print(f"Executing command: {command}")
-    
-    # result = subprocess.run(command, shell=True, capture_output=True, text=True)
-    # screen_state = result.stdout.strip()
-
+    if print_command:
+        print(f"Detecting screen state of device {device_id}")
 
-    if sys.platform == "win32":
-        # On Windows, we need to decode the output
-        command = f"{adb_command} shell dumpsys display"
-        if print_command:
-            print(f"Executing command: {command}")
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
-        result.stdout = result.stdout.encode('utf-8').decode('utf-8')
-        screen_state = local_str_grep(result.stdout, "mScreenState").strip()
-    else:
-        command = f"{adb_command} shell dumpsys display | grep mScreenState"
-        if print_command:
-            print(f"Executing command: {command}")
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
-        screen_state = result.stdout.strip()
-    
-    if "ON" in screen_state:
-        return True
-    else:
-        return False
+    return get_device_state(device_id).is_screen_on()
 
 def press_power_key(device_id, print_command=False, show_window=False):
     """
@@ -187,11 +162,7 @@ def get_manufacturer(device_id):
     """
     Get the manufacturer of the specified device.
     """
-    adb_command = _get_adb_command(device_id)
-    command = f"{adb_command} shell getprop ro.product.manufacturer"
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
-    manufacturer = result.stdout.strip().lower()
-    return manufacturer
+    return get_device_state(device_id).get_manufacturer()
 
 def _open_screen(device_id, print_command=False, show_window=False):
     """
@@ -209,6 +180,7 @@ def _open_screen(device_id, print_command=False, show_window=False):
     if client:
         # 打开屏幕
         client.turn_screen_on()
+        get_device_state(device_id).invalidate(["screen_on"])
         time.sleep(0.2)
         manufacturer = get_manufacturer(device_id)
         if "vivo" in manufacturer:
@@ -231,56 +203,101 @@ def open_screen(device_id, print_command=False, show_window=False):
 
 def list_devices():
     """
-    List all connected mobile devices (using scrcpy-py-ddlx).
+    List all connected mobile devices.
+    Served by the cached device registry, which follows `adb track-devices`.
     """
-    from scrcpy_py_ddlx.core.adb import ADBManager
-    adb = ADBManager()
-    devices = adb.list_devices()
-    return [d.serial for d in devices]
+    return get_device_registry().list_devices()
 
-def capture_screenshot(device_id, tmp_file_dir="tmp_screenshot", image_name=None, print_command=False, show_window=False):
+# default values of an enabled settle config: return once the screen has not changed
+# for `quiet_window` seconds, but never wait longer than `timeout` seconds
+DEFAULT_SETTLE_CONFIG = {
+    "enable": True,
+    "quiet_window": 0.4,
+    "timeout": 3.0,
+    "diff_threshold": 2.0,
+}
+
+def is_settle_enabled(settle_config):
     """
-    Capture a screenshot of the specified device and save it to the specified directory (using scrcpy-py-ddlx).
+    Whether the settle mode is enabled by the given settle config.
     """
-    from .scrcpy_connection_manager import get_scrcpy_manager
-    import time
-    import numpy as np
-    from PIL import Image
+    return settle_config is not None and settle_config.get("enable", True)
 
-    # 确保使用绝对路径
-    tmp_file_dir = os.path.abspath(tmp_file_dir)
-    if not os.path.exists(tmp_file_dir):
-        os.makedirs(tmp_file_dir)
+def wait_for_screen_settle(device_id, settle_config=None, show_window=False, since=None):
+    """
+    Wait until the screen of the specified device stops changing (using scrcpy-py-ddlx).
+    Only frames after `since` (time.monotonic() of the action start, defaults to now)
+    count, so a screen that was still before the action does not end the wait.
+    Returns the first settled frame (numpy array), or None if no frame is available.
+    """
+    from .scrcpy_connection_manager import get_scrcpy_manager
 
-    if image_name is None:
-        image_name = f"uuid_{uuid4()}.png"
+    config = dict(DEFAULT_SETTLE_CONFIG)
+    if settle_config is not None:
+        config.update(settle_config)
 
-    screen_shot_pic_path = os.path.join(tmp_file_dir, image_name)
+    manager = get_scrcpy_manager()
+    return manager.wait_for_settle(
+        device_id,
+        quiet_window=config["quiet_window"],
+        timeout=config["timeout"],
+        diff_threshold=config["diff_threshold"],
+        show_window=show_window,
+        since=since,
+    )
+
+def capture_frame(device_id, print_command=False, show_window=False, settle_config=None, since=None):
+    """
+    Capture a screenshot of the specified device as an in-memory ScreenFrame (using scrcpy-py-ddlx).
+    No file is written; call `frame.save(path)` only when a file is actually needed.
+
+    By default the frame is taken after a fixed delay. With an enabled
+    `settle_config` (see `wait_for_screen_settle`) it is taken as soon as the
+    screen has settled instead, without the fixed delay. Pass the
+    time.monotonic() of the previous action start as `since`, so that frames
+    from before the action cannot end the wait.
+    """
+    from .scrcpy_connection_manager import get_scrcpy_manager
+    from tools.image_tools import ScreenFrame
 
     manager = get_scrcpy_manager()
     client = manager.get_client(device_id, show_window=show_window)
     if client is None:
         raise RuntimeError(f"无法连接到设备 {device_id}")
 
-    # 非懒加载模式：需要等待视频流稳定
-    time.sleep(1.0)
-
-    # 使用 scrcpy-py-ddlx 截图
-    # 不使用 filename 参数（异步保存），而是获取 numpy 数组手动保存
-    max_retries = 10
-    for attempt in range(max_retries):
-        frame = client.screenshot()  # 返回 numpy 数组或 None
+    if is_settle_enabled(settle_config):
+        # 等待画面稳定后直接返回稳定帧（替代固定的 sleep）
+        frame = wait_for_screen_settle(device_id, settle_config=settle_config, show_window=show_window, since=since)
         if frame is not None:
-            # 手动保存为 PNG（同步）
-            img = Image.fromarray(frame)
-            img.save(screen_shot_pic_path)
-            if os.path.exists(screen_shot_pic_path):
-                return screen_shot_pic_path
+            return ScreenFrame(frame, timestamp=time.monotonic())
+    else:
+        # 非 settle 模式：等待视频流稳定
+        time.sleep(1.0)
 
-        if attempt < max_retries - 1:
-            time.sleep(0.5)
+    # 直接取环形缓冲区中的最新帧（numpy 数组，不落盘），无需轮询
+    latest = manager.get_latest_frame(device_id, timeout=5.0, show_window=show_window)
+    if latest is not None:
+        timestamp, frame = latest
+        return ScreenFrame(frame, timestamp=timestamp)
 
-    raise RuntimeError(f"截图失败: 设备 {device_id}")    
+    raise RuntimeError(f"截图失败: 设备 {device_id}")
+
+def capture_screenshot(device_id, tmp_file_dir="tmp_screenshot", image_name=None, print_command=False, show_window=False):
+    """
+    Capture a screenshot of the specified device and save it to the specified directory (using scrcpy-py-ddlx).
+    """
+    # 确保使用绝对路径
+    tmp_file_dir = os.path.abspath(tmp_file_dir)
+    if not os.path.exists(tmp_file_dir):
+        os.makedirs(tmp_file_dir)
+
+    if image_name is None:
+        image_name = f"uuid_{uuid4()}.png"
+
+    screen_shot_pic_path = os.path.join(tmp_file_dir, image_name)
+
+    frame = capture_frame(device_id, print_command=print_command, show_window=show_window)
+    return frame.save(screen_shot_pic_path)
 
 def get_device_wm_size(device_id, show_window=True):
     """
@@ -515,6 +532,9 @@ def act_on_device(device_id, action, print_command=False, refush_app=True, devic
 
     action_type = action['action_type']
 
+    # the action may change the screen, drop the cached device state
+    invalidate_device_state(device_id)
+
     if action_type == "Click":
         if device_wm_size is None:
             real_point = action['args']['point']
@@ -529,9 +549,10 @@ def act_on_device(device_id, action, print_command=False, refush_app=True, devic
         if package_name is None:
             raise ValueError(f"App {app_name} not found in package map.")
 
-        # scrcpy-py-ddlx 启动应用
+        # scrcpy-py-ddlx 启动应用，等待界面稳定（最多 2 秒）
+        action_start = time.monotonic()
         client.start_app(package_name)
-        time.sleep(2)
+        wait_for_screen_settle(device_id, settle_config={"timeout": 2.0}, since=action_start)
 
     elif action_type == "Type":
         text = action['args']['text']
@@ -653,27 +674,27 @@ class BaseMoboleActionHelper:
         # to wait for the action to be completed
         time.sleep(capture_duration)
 
-        is_screenshot = False
+        frame = None
 
         # to get the observation
         for i in range(3):
             try:
-                screen_shot_pic_path = capture_screenshot(self.device_id, tmp_file_dir="tmp_screenshot")
-                is_screenshot = True
+                frame = capture_frame(self.device_id)
                 break
             except Exception as e:
                 logger.warning(f"Screenshot attempt {i+1}/3 failed: {e}")
                 time.sleep(0.5)
 
 
-        if not is_screenshot:
+        if frame is None:
             raise ValueError(f"Error capturing screenshot: {e}")
         # to check if the screenshot is valid
 
         if image_full_path is not None:
-            # to copy the image to the full path
-            smart_copy(screen_shot_pic_path, image_full_path)
-            screen_shot_pic_path = image_full_path
+            # write the frame straight to the full path, no tmp file round trip
+            screen_shot_pic_path = frame.save(image_full_path)
+        else:
+            screen_shot_pic_path = frame.save(os.path.join(os.path.abspath("tmp_screenshot"), f"uuid_{uuid4()}.png"))
             
 
         observation = {
@@ -711,7 +732,9 @@ __all__ = [
     # 应用管理
     "close_app_on_device",
     # 截图
+    "capture_frame",
     "capture_screenshot",
+    "wait_for_screen_settle",
     # 辅助函数
     "model_act2front_act",
     "normlize_point",
@@ -15,6 +15,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from copilot_front_end.package_map import find_package_name
+from copilot_front_end.device_state_service import get_device_state, invalidate_device_state
+from copilot_front_end.adb_protocol import get_adb_client
 
 logger = logging.getLogger(__name__)
 
@@ -189,11 +191,29 @@ def _convert_point_to_realworld_point(point, wm_size):
     real_y = int((float(y) / 1000) * wm_size[1])
     return (real_x, real_y)
 
+def _wait_for_screen_settle(device_id, timeout, show_window=False, since=None):
+    """
+    Wait for the screen to settle after an action started at `since`
+    (time.monotonic()), capped by `timeout` seconds.
+    Falls back to a fixed sleep when there is no live scrcpy connection.
+    """
+    manager_module = sys.modules.get("copilot_front_end.scrcpy_connection_manager")
+    if manager_module is None or not manager_module.get_scrcpy_manager().is_connected(device_id):
+        time.sleep(timeout)
+        return
+
+    from copilot_front_end.mobile_action_helper import wait_for_screen_settle
+    wait_for_screen_settle(device_id, settle_config={"timeout": timeout}, show_window=show_window, since=since)
+
 def _detect_screen_orientation(device_id):
     """
     Detect the screen orientation of the specified device.
     adb shell dumpsys input | grep -m 1 -o -E "orientation=[0-9]" | head -n 1 | grep -m 1 -o -E "[0-9]"
     """
+    if device_id is not None:
+        # served by the cached device state service (long-lived adb shell)
+        return get_device_state(device_id).get_orientation()
+
     # adb_command = _get_adb_command(device_id)
     if device_id is None:
         adb_command = "adb"
@@ -226,6 +246,48 @@ def _detect_screen_orientation(device_id):
     return result
 
 
+# actions that may switch apps, and with them the screen orientation
+APP_SWITCH_ACTIONS = ["AWAKE", "BACK", "HOME", "HOT_KEY"]
+
+def _invalidate_state_for_action(device_id, frontend_action):
+    """
+    Drop the cached device states that the action may change. Coordinate
+    actions may open a landscape app as well (video, game), so the
+    orientation is probed again before the next tap is mapped.
+    """
+    invalidate_device_state(device_id)
+    if frontend_action["action_type"] in APP_SWITCH_ACTIONS or _has_coordinates(frontend_action):
+        invalidate_device_state(device_id, ["orientation"])
+
+def _has_coordinates(frontend_action):
+    return "point" in frontend_action or "point1" in frontend_action
+
+def _get_oriented_wm_size(device_id, wm_size):
+    """
+    Return `wm_size` as (width, height) in the current screen orientation.
+    With a live scrcpy connection the orientation comes from the latest frame
+    size (no device round trip); otherwise from the cached orientation state,
+    which is invalidated by app switches and coordinate actions.
+
+    The scrcpy manager is only consulted when it is already loaded, so plain
+    ADB setups never import scrcpy (which may not be installed).
+    """
+    frame_size = None
+    manager_module = sys.modules.get("copilot_front_end.scrcpy_connection_manager")
+    if manager_module is not None:
+        frame_size = manager_module.get_scrcpy_manager().get_frame_size(device_id)
+
+    if frame_size is not None:
+        landscape = frame_size[0] > frame_size[1]
+        if landscape != (wm_size[0] > wm_size[1]):
+            return (wm_size[1], wm_size[0])
+        return wm_size
+
+    orientation = _detect_screen_orientation(device_id)
+    if orientation in [1, 3]:
+        return (wm_size[1], wm_size[0])
+    return wm_size
+
 def act_on_device(frontend_action, device_id, wm_size, print_command=False, reflush_app=True, show_window=False):
     """
     Execute the frontend action on the device.
@@ -259,21 +321,22 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
 
     action_type = frontend_action["action_type"]
 
-    if action_type == "CLICK":
-        assert "point" in frontend_action, "Missing point in CLICK action"
+    # the action may change the screen, drop the cached device state
+    _invalidate_state_for_action(device_id, frontend_action)
 
-        orientation = _detect_screen_orientation(device_id)
+    if _has_coordinates(frontend_action):
+        wm_size = _get_oriented_wm_size(device_id, wm_size)
 
-        if orientation in [1, 3]:
-            wm_size = (wm_size[1], wm_size[0])
+    if action_type == "CLICK":
+        assert "point" in frontend_action, "Missing point in CLICK action"
 
         x, y = _convert_point_to_realworld_point(frontend_action["point"], wm_size)
 
-        cmd = f"adb -s {device_id} shell input tap {x} {y}"
+        cmd = f"input tap {x} {y}"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
         
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
     
@@ -282,11 +345,11 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
         assert "duration" in frontend_action, "Missing duration in LONGPRESS action"
         x, y = _convert_point_to_realworld_point(frontend_action["point"], wm_size)
         duration = frontend_action["duration"]
-        cmd = f"adb -s {device_id} shell app_process -Djava.class.path=/data/local/tmp/yadb /data/local/tmp com.ysbing.yadb.Main -touch {x} {y} {int(duration * 1000)}"
+        cmd = f"app_process -Djava.class.path=/data/local/tmp/yadb /data/local/tmp com.ysbing.yadb.Main -touch {x} {y} {int(duration * 1000)}"
 
         if print_command:
-            print(f"Executing command: {cmd}")
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
+        result = get_adb_client().run(device_id, cmd)
 
         return result
 
@@ -299,11 +362,12 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
         if not keyboard_exists:
             if "point" in frontend_action:
                 x, y = _convert_point_to_realworld_point(frontend_action["point"], wm_size)
-                cmd = f"adb -s {device_id} shell input tap {x} {y}"
+                cmd = f"input tap {x} {y}"
                 if print_command:
-                    print(f"Executing command: {cmd}")
-                result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-                time.sleep(1)
+                    print(f"Executing command: adb -s {device_id} shell {cmd}")
+                action_start = time.monotonic()
+                result = get_adb_client().run(device_id, cmd)
+                _wait_for_screen_settle(device_id, timeout=1.0, show_window=show_window, since=action_start)
             else:
                 print("Warning: keyboard does not exist and point is not given. Using current focus box.")
 
@@ -314,11 +378,11 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
             return text
 
 
-        cmd = f"adb -s {device_id} shell app_process -Djava.class.path=/data/local/tmp/yadb /data/local/tmp com.ysbing.yadb.Main -keyboard '{preprocess_text_for_adb(value)}'"
+        cmd = f"app_process -Djava.class.path=/data/local/tmp/yadb /data/local/tmp com.ysbing.yadb.Main -keyboard {preprocess_text_for_adb(value)}"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
         return result
     
     elif action_type == "SCROLL":
@@ -345,11 +409,11 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
         else:
             raise ValueError(f"Invalid direction: {direction}")
         
-        cmd = f"adb -s {device_id} shell input swipe {x1} {y1} {x2} {y2} 1200"
+        cmd = f"input swipe {x1} {y1} {x2} {y2} 1200"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
         
@@ -361,18 +425,18 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
             raise ValueError(f"App name {app_name} not found in package map.")
         
         if reflush_app:
-            cmd = f"adb -s {device_id} shell am force-stop {package_name}"
+            cmd = f"am force-stop {package_name}"
             if print_command:
-                print(f"Executing command: {cmd}")
+                print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            result = get_adb_client().run(device_id, cmd)
             time.sleep(1)
 
-        cmd = f"adb -s {device_id} shell monkey -p {package_name} -c android.intent.category.LAUNCHER 1"
+        cmd = f"monkey -p {package_name} -c android.intent.category.LAUNCHER 1"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
 
@@ -383,29 +447,29 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
         x2, y2 = _convert_point_to_realworld_point(frontend_action["point2"], wm_size)
         
         duration = frontend_action.get("duration", 1.5)
-        cmd = f"adb -s {device_id} shell input swipe {x1} {y1} {x2} {y2} {int(duration * 1000)}"
+        cmd = f"input swipe {x1} {y1} {x2} {y2} {int(duration * 1000)}"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
     
     elif action_type == "BACK":
-        cmd = f"adb -s {device_id} shell input keyevent 4"
+        cmd = f"input keyevent 4"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
     
     elif action_type == "HOME":
-        cmd = f"adb -s {device_id} shell input keyevent 3"
+        cmd = f"input keyevent 3"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
     
@@ -447,11 +511,11 @@ def act_on_device(frontend_action, device_id, wm_size, print_command=False, refl
             raise ValueError(f"Unsupported hot key: {key}")
 
         key_event = key_event_map[key.lower()]
-        cmd = f"adb -s {device_id} shell input keyevent {key_event}"
+        cmd = f"input keyevent {key_event}"
         if print_command:
-            print(f"Executing command: {cmd}")
+            print(f"Executing command: adb -s {device_id} shell {cmd}")
 
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = get_adb_client().run(device_id, cmd)
 
         return result
 
@@ -505,11 +569,17 @@ def act_on_device_scrcpy(frontend_action, device_id, wm_size, print_command=Fals
 
     action_type = frontend_action["action_type"]
     manager = get_scrcpy_manager()
+
+    # the action may change the screen, drop the cached device state
+    _invalidate_state_for_action(device_id, frontend_action)
     client = manager.get_client(device_id, show_window=show_window)
 
     if client is None:
         raise RuntimeError(f"无法连接到设备 {device_id}")
 
+    if _has_coordinates(frontend_action):
+        wm_size = _get_oriented_wm_size(device_id, wm_size)
+
     # 客户端逻辑动作，无需设备操作
     if action_type == "COMPLETE":
         logger.info("Task completed")
@@ -551,8 +621,9 @@ def act_on_device_scrcpy(frontend_action, device_id, wm_size, print_command=Fals
         # 如果键盘不存在且有点坐标，先点击
         if not keyboard_exists and "point" in frontend_action:
             x, y = _convert_point_to_realworld_point(frontend_action["point"], wm_size)
+            action_start = time.monotonic()
             client.tap(x, y)
-            time.sleep(1)
+            _wait_for_screen_settle(device_id, timeout=1.0, show_window=show_window, since=action_start)
         
         # scrcpy-py-ddlx 原生 UTF-8 支持，无需 yadb
         client.inject_text(value)
@@ -602,6 +673,7 @@ def act_on_device_scrcpy(frontend_action, device_id, wm_size, print_command=Fals
         app_name = frontend_action["value"]
         
         # scrcpy-py-ddlx 原生应用启动，无需 ADB monkey
+        action_start = time.monotonic()
         try:
             client.start_app(f"?{app_name}")
             logger.info(f"启动应用: {app_name} (模糊搜索)")
@@ -614,7 +686,7 @@ def act_on_device_scrcpy(frontend_action, device_id, wm_size, print_command=Fals
             client.start_app(package_name)
             logger.info(f"启动应用: {app_name} (包名: {package_name})")
         
-        time.sleep(1)
+        _wait_for_screen_settle(device_id, timeout=1.0, show_window=show_window, since=action_start)
         return None
 
     elif action_type == "BACK":
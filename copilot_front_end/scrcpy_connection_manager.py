@@ -16,6 +16,7 @@ import threading
 import time
 from typing import Optional, Dict, Tuple
 from dataclasses import dataclass
+from collections import deque
 
 # 添加 scrcpy-py-ddlx 路径（与 gelab-zero 平级）
 _current_file = os.path.abspath(__file__)
@@ -28,9 +29,56 @@ if os.path.exists(_scrcpy_path) and _scrcpy_path not in sys.path:
 # 导入 scrcpy-py-ddlx
 from scrcpy_py_ddlx import ScrcpyClient, ClientConfig
 
+from copilot_front_end.device_state_service import invalidate_device_state
+
 logger = logging.getLogger(__name__)
 
 
+class FrameRing:
+    """
+    带单调时间戳的有界帧环形缓冲区（线程安全）
+
+    - latest(): 最新一帧
+    - first_after(t): 时间戳晚于 t 的第一帧
+    - wait_for_frame_after(t, timeout): 阻塞等待晚于 t 的帧（基于条件变量，无轮询）
+    """
+
+    def __init__(self, capacity: int = 8):
+        self._frames = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+
+    def push(self, frame, timestamp: Optional[float] = None):
+        """写入一帧，timestamp 为 time.monotonic() 时间"""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._cond:
+            self._frames.append((timestamp, frame))
+            self._cond.notify_all()
+
+    def latest(self) -> Optional[Tuple[float, object]]:
+        """返回 (timestamp, frame)，没有帧时返回 None"""
+        with self._cond:
+            return self._frames[-1] if self._frames else None
+
+    def first_after(self, t: float) -> Optional[Tuple[float, object]]:
+        """返回时间戳晚于 t 的第一帧 (timestamp, frame)，没有则返回 None"""
+        with self._cond:
+            for timestamp, frame in self._frames:
+                if timestamp > t:
+                    return (timestamp, frame)
+            return None
+
+    def wait_for_frame_after(self, t: float, timeout: Optional[float] = None) -> Optional[Tuple[float, object]]:
+        """阻塞直到有时间戳晚于 t 的帧，超时返回 None"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frames and self._frames[-1][0] > t, timeout=timeout)
+        return self.first_after(t)
+
+    def clear(self):
+        with self._cond:
+            self._frames.clear()
+
+
 @dataclass
 class ScrcpyConnection:
     """scrcpy-py-ddlx 连接封装"""
@@ -39,10 +87,59 @@ class ScrcpyConnection:
     last_used: float
     health_check_failures: int = 0
     connection_info: dict = None  # 连接信息（连接方式、stay_awake 等）
+    frames: FrameRing = None  # 最近解码帧的环形缓冲区
+    frame_capacity: int = 8
 
     def __post_init__(self):
         if self.connection_info is None:
             self.connection_info = {}
+        if self.frames is None:
+            self.frames = FrameRing(self.frame_capacity)
+        self._stop_event = threading.Event()
+        self._frame_thread = None
+
+    def start_frame_collector(self, max_fps: int = 60):
+        """启动后台线程，把视频流中的新帧写入环形缓冲区"""
+        if self._frame_thread is not None:
+            return
+        self._frame_thread = threading.Thread(
+            target=self._collect_frames,
+            args=(1.0 / max_fps,),
+            name=f"scrcpy-frames-{self.device_id}",
+            daemon=True,
+        )
+        self._frame_thread.start()
+
+    def stop_frame_collector(self):
+        """停止帧收集线程"""
+        self._stop_event.set()
+        if self._frame_thread is not None and self._frame_thread is not threading.current_thread():
+            self._frame_thread.join(timeout=1.0)
+        self._frame_thread = None
+
+    def _collect_frames(self, interval: float):
+        import numpy as np
+
+        last_raw = None
+        last_size = None
+        while not self._stop_event.is_set():
+            try:
+                raw = getattr(self.client, "last_frame", None)
+                if raw is not None and raw is not last_raw:
+                    last_raw = raw
+                    frame = raw if isinstance(raw, np.ndarray) else self.client.screenshot()
+                    if frame is not None:
+                        self.frames.push(frame)
+
+                        # 帧尺寸变化即屏幕旋转，推送失效给设备状态缓存
+                        size = _frame_size(frame)
+                        if last_size is not None and size != last_size:
+                            logger.debug(f"设备 {self.device_id} 屏幕旋转: {last_size} -> {size}")
+                            invalidate_device_state(self.device_id, ["orientation"])
+                        last_size = size
+            except Exception as e:
+                logger.debug(f"设备 {self.device_id} 收集帧失败: {e}")
+            self._stop_event.wait(interval)
 
     def is_alive(self) -> bool:
         """检查连接是否存活"""
@@ -320,6 +417,7 @@ class ScrcpyConnectionManager:
                 last_used=time.time(),
                 connection_info=connection_info
             )
+            conn.start_frame_collector(max_fps=config.max_fps)
             self._connections[device_id] = conn
 
             logger.info(f"设备 {device_id} 连接成功 (尺寸: {client.device_size})")
@@ -378,6 +476,7 @@ class ScrcpyConnectionManager:
         """清理指定设备的连接"""
         if device_id in self._connections:
             conn = self._connections[device_id]
+            conn.stop_frame_collector()
             try:
                 if conn.client.is_connected:
                     conn.client.disconnect()
@@ -443,6 +542,128 @@ class ScrcpyConnectionManager:
             return client.device_size
         return None
 
+    def get_frame_size(self, device_id: str) -> Optional[Tuple[int, int]]:
+        """
+        最新一帧的尺寸 (width, height)，即当前方向下的屏幕尺寸
+
+        只读取已缓存的帧，不建立连接、不等待；没有可用帧时返回 None
+        """
+        with self._lock:
+            conn = self._connections.get(device_id)
+        if conn is None or not conn.is_alive():
+            return None
+        latest = conn.frames.latest()
+        if latest is None:
+            return None
+        return _frame_size(latest[1])
+
+    def get_frame_ring(self, device_id: str, show_window: bool = False) -> Optional[FrameRing]:
+        """获取设备的帧环形缓冲区（必要时先建立连接）"""
+        if self.get_client(device_id, show_window=show_window) is None:
+            return None
+        with self._lock:
+            conn = self._connections.get(device_id)
+            return conn.frames if conn is not None else None
+
+    def get_latest_frame(self, device_id: str, timeout: float = 5.0, show_window: bool = False):
+        """
+        获取设备最新一帧
+
+        环形缓冲区中已有帧时立即返回；刚建立连接、还没有帧时最多等待 timeout 秒。
+
+        Returns:
+            (timestamp, frame)，timestamp 为 time.monotonic() 时间；获取失败返回 None
+        """
+        ring = self.get_frame_ring(device_id, show_window=show_window)
+        if ring is None:
+            return None
+        latest = ring.latest()
+        if latest is not None:
+            return latest
+        return ring.wait_for_frame_after(float("-inf"), timeout=timeout)
+
+    def get_frame_after(self, device_id: str, t: float, timeout: float = 5.0, show_window: bool = False):
+        """
+        获取时间戳晚于 t（time.monotonic() 时间）的第一帧，例如某个动作之后的第一帧
+
+        Returns:
+            (timestamp, frame)，超时返回 None
+        """
+        ring = self.get_frame_ring(device_id, show_window=show_window)
+        if ring is None:
+            return None
+        return ring.wait_for_frame_after(t, timeout=timeout)
+
+    def wait_for_settle(
+        self,
+        device_id: str,
+        quiet_window: float = 0.4,
+        timeout: float = 3.0,
+        diff_threshold: float = 2.0,
+        show_window: bool = False,
+        since: Optional[float] = None,
+    ):
+        """
+        等待屏幕稳定（settle 模式），返回稳定后的第一帧
+
+        先等待时间戳晚于 since 的帧（动作之后的画面），再观察环形缓冲区中到达的新帧，
+        当画面在 quiet_window 秒内没有变化时立即返回当前帧；超过 timeout 仍未稳定
+        （或始终没有 since 之后的帧）则返回最后一帧。
+        用于替代动作之后、截图之前的固定 sleep。
+
+        Args:
+            device_id: 设备序列号
+            quiet_window: 画面保持不变的时长（秒）
+            timeout: 最长等待时间（秒）
+            diff_threshold: 判定画面变化的平均像素差阈值（0-255）
+            show_window: 是否显示实时预览窗口
+            since: 动作开始的时间（time.monotonic() 时间），默认为调用时间
+
+        Returns:
+            numpy 数组（RGB 帧），如果始终没有帧返回 None
+        """
+        ring = self.get_frame_ring(device_id, show_window=show_window)
+        if ring is None:
+            return None
+
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        if since is None:
+            since = start_time
+
+        # 动作之前的帧不能证明画面已稳定: 至少需要一帧晚于 since
+        latest = ring.wait_for_frame_after(since, timeout=timeout)
+        if latest is None:
+            latest = ring.latest()
+            logger.debug(f"设备 {device_id} 等待画面稳定超时 ({timeout}s)，没有动作之后的帧")
+            return latest[1] if latest is not None else None
+
+        last_timestamp, last_frame = ring.latest()
+        last_signature = _frame_signature(last_frame)
+        last_change_time = time.monotonic()
+
+        while True:
+            now = time.monotonic()
+            if now - last_change_time >= quiet_window:
+                logger.debug(f"设备 {device_id} 画面已稳定，耗时 {now - start_time:.2f}s")
+                return last_frame
+            if now >= deadline:
+                logger.debug(f"设备 {device_id} 等待画面稳定超时 ({timeout}s)")
+                return last_frame
+
+            wait_time = min(quiet_window - (now - last_change_time), deadline - now)
+            new_frame = ring.wait_for_frame_after(last_timestamp, timeout=wait_time)
+            if new_frame is None:
+                continue
+
+            # 只比较缓冲区中最新的一帧，中间帧无需逐帧比较
+            last_timestamp, frame = ring.latest()
+            signature = _frame_signature(frame)
+            if _signature_changed(last_signature, signature, diff_threshold):
+                last_change_time = time.monotonic()
+            last_signature = signature
+            last_frame = frame
+
     def is_connected(self, device_id: str) -> bool:
         """检查设备是否已连接"""
         with self._lock:
@@ -477,6 +698,28 @@ class ScrcpyConnectionManager:
             pass
 
 
+def _frame_size(frame) -> Tuple[int, int]:
+    """帧尺寸 (width, height)，支持 numpy 数组和 PIL Image"""
+    if hasattr(frame, "shape"):
+        height, width = frame.shape[:2]
+        return (width, height)
+    return tuple(frame.size)
+
+
+def _frame_signature(frame, step: int = 16):
+    """降采样后的帧签名，用于低成本比较两帧是否相同"""
+    import numpy as np
+    return np.asarray(frame)[::step, ::step].astype(np.int16)
+
+
+def _signature_changed(sig_a, sig_b, diff_threshold: float) -> bool:
+    """比较两个帧签名，尺寸变化（如旋转）也视为画面变化"""
+    import numpy as np
+    if sig_a is None or sig_b is None or sig_a.shape != sig_b.shape:
+        return True
+    return float(np.abs(sig_a - sig_b).mean()) > diff_threshold
+
+
 # 全局实例
 _connection_manager = None
 
@@ -490,6 +733,7 @@ def get_scrcpy_manager() -> ScrcpyConnectionManager:
 
 
 __all__ = [
+    "FrameRing",
     "ScrcpyConnectionManager",
     "get_scrcpy_manager",
 ]
@@ -16,6 +16,7 @@ if "." not in sys.path:
     sys.path.append(".")
 
 # from tools.prompt_tools import messages2sft
+from tools.prompt_tools import make_prompt_template
 
 from copy import deepcopy
 
@@ -51,6 +52,24 @@ task_define_prompt = """你是一个手机 GUI-Agent 操作专家，你需要根
 例如：action:LONGPRESS\tpoint:x,y
 """
 
+def status_prompt_variables(task, current_image, summary_history="", user_comment=""):
+    """
+    The per-step variables of the status prompt.
+    """
+    if user_comment == "":
+        history_display = summary_history if summary_history.strip() else "暂无历史操作"
+    else:
+        history_display = summary_history + user_comment if summary_history.strip() else "暂无历史操作"
+
+    user_instruction = f'''\n\n{user_comment}\n\n''' if user_comment != "" else ""
+    task = task + user_instruction + "指令结束\n\n"
+
+    return {
+        "task": task,
+        "history": history_display,
+        "image": current_image,
+    }
+
 def make_status_prompt(task, current_image, hints, summary_history="", user_comment=""):
 
     if len(hints) == 0:
@@ -59,50 +78,131 @@ def make_status_prompt(task, current_image, hints, summary_history="", user_comm
         hint_str = "\n".join([f"- {hint}" for hint in hints])
         hint_str = f"### HINT：\n{hint_str}\n"
 
-    if user_comment == "":
-        history_display = summary_history if summary_history.strip() else "暂无历史操作"
-    else:
-        history_display = summary_history + user_comment if summary_history.strip() else "暂无历史操作"
+    return fill_status_prompt(**status_prompt_variables(task, current_image, summary_history, user_comment))
 
-    user_instruction = f'''\n\n{user_comment}\n\n''' if user_comment != "" else ""
-    task = task + user_instruction + "指令结束\n\n"
+# the output format instructions that follow the screenshot in the status prompt
+status_instruction_prompt = '''
 
+在执行操作之前，请务必回顾你的历史操作记录和限定的动作空间，先进行思考和解释然后输出动作空间和对应的参数：
+1. 思考（THINK）：在 <THINK> 和 </THINK> 标签之间。
+2. 解释（explain）：在动作格式中，使用 explain: 开头，简要说明当前动作的目的和执行方式。
+在执行完操作后，请输出执行完当前步骤后的新历史总结。
+输出格式示例：
+<THINK> 思考的内容 </THINK>
+explain:解释的内容\taction:动作空间和对应的参数\tsummary:执行完当前步骤后的新历史总结
+'''
+
+def _status_head(task, history):
+    return f'''
+已知用户指令为：{task}
+已知已经执行过的历史动作如下：{history}
+当前手机屏幕截图如下：
+'''
+
+def fill_status_prompt(task, history, image):
     
     status_conversation = [
         {
             "type": "text",
-            "text": f'''
-已知用户指令为：{task}
-已知已经执行过的历史动作如下：{history_display}
-当前手机屏幕截图如下：
-'''
+            "text": _status_head(task, history)
         },
         {
             "type": "image_url",
-            "image_url": {"url": current_image}
+            "image_url": {"url": image}
         },
         {
             "type": "text",
-            "text": f'''
-
-在执行操作之前，请务必回顾你的历史操作记录和限定的动作空间，先进行思考和解释然后输出动作空间和对应的参数：
-1. 思考（THINK）：在 <THINK> 和 </THINK> 标签之间。
-2. 解释（explain）：在动作格式中，使用 explain: 开头，简要说明当前动作的目的和执行方式。
-在执行完操作后，请输出执行完当前步骤后的新历史总结。
-输出格式示例：
-<THINK> 思考的内容 </THINK>
-explain:解释的内容\taction:动作空间和对应的参数\tsummary:执行完当前步骤后的新历史总结
-'''
+            "text": status_instruction_prompt
         }
     ]
 
     return status_conversation
 
+def make_messages(task, history, image):
+    conversations = [
+        {
+            "type": "text",
+            "text": task_define_prompt
+        }
+    ] + fill_status_prompt(task, history, image)
+
+    return [
+        {
+            "role": "user",
+            "content": conversations
+        }
+    ]
+
+def make_messages_prefix_cache(task, history, image):
+    """
+    The same prompt laid out for serving engines with automatic prefix caching:
+    all static instructions come first, byte-identical in every step and
+    session, as a system message; the task, the history and the screenshot
+    follow in the user message, the most volatile part last.
+    """
+    return [
+        {
+            "role": "system",
+            "content": task_define_prompt + status_instruction_prompt
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": _status_head(task, history)
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image}
+                }
+            ]
+        }
+    ]
+
+# prompt layouts selectable with `prompt_layout` of the model_config
+PROMPT_LAYOUTS = {
+    "default": make_messages,
+    "prefix_cache": make_messages_prefix_cache,
+}
+
+# the messages with slots in place of the per-step variables; traces store its id
+# and the variables instead of repeating the static prompt text every step
+prompt_templates = {
+    layout: make_prompt_template(render, ["task", "history", "image"])
+    for layout, render in PROMPT_LAYOUTS.items()
+}
+prompt_template = prompt_templates["default"]
+
+
+# parameters each action type needs before it can be executed (see action2action)
+REQUIRED_ACTION_FIELDS = {
+    "CLICK": ["point"],
+    "LONGPRESS": ["point"],
+    "SLIDE": ["point1", "point2"],
+    "TYPE": ["value", "point"],
+    "AWAKE": ["value"],
+    "INFO": ["value"],
+    "WAIT": ["value"],
+    "COMPLETE": ["return"],
+    "ABORT": ["value"],
+    "HOME": [],
+    "BACK": [],
+    "MENU": [],
+    "ENTER": [],
+    "VOLUME_UP": [],
+    "VOLUME_DOWN": [],
+}
+
 
 class Parser0920Summary():
-    def __init__(self, *args, **kwargs):
+    prompt_template = prompt_template
+
+    def __init__(self, *args, prompt_layout="default", **kwargs):
         # super().__init__(*args, **kwargs)
-        pass
+        assert prompt_layout in PROMPT_LAYOUTS, f"prompt_layout must be one of {list(PROMPT_LAYOUTS)}, got {prompt_layout}"
+        self.prompt_layout = prompt_layout
+        self.prompt_template = prompt_templates[prompt_layout]
 
     def action2action(self, action):
         # assert single actions
@@ -256,9 +356,7 @@ class Parser0920Summary():
         return action_str
     
 
-    def str2action(self, command_str):
-        command_str = command_str.strip()
-        
+    def _normalize_command_str(self, command_str):
         # Normalize THINK tags: fix typos, case, and spacing
         command_str = (
             command_str
@@ -266,24 +364,9 @@ class Parser0920Summary():
             .replace("<think>", "<THINK>").replace("</think>", "</THINK>")
         )
         command_str = re.sub(r"<\s*/?THINK\s*>", lambda m: "<THINK>" if "/" not in m.group() else "</THINK>", command_str, flags=re.IGNORECASE)
-        
-        # Extract CoT and key-value parts
-        # Expected format: <THINK> cot </THINK>\nexplain:xxx\taction:xx\tvalue:xxx\tsummary:xxx
-        try:
-            cot_part = command_str.split("<THINK>")[1].split("</THINK>")[0].strip()
-            kv_part = command_str.split("</THINK>")[1].strip()
-        except IndexError:
-            print(f"[Parser Warning] Missing <THINK> tags, treating entire response as kv")
-            kv_part = command_str
-            cot_part = ""
-
-        action = OrderedDict()
-        action['cot'] = cot_part
-        
-        # FIX:issue 13
-        # Error split by \n, should split by tab separator 
-        kvs = [kv.strip() for kv in kv_part.split("\t") if kv.strip()]
+        return command_str
 
+    def _parse_kvs(self, kvs, action):
         for kv in kvs:
             if ":" not in kv:
                 continue
@@ -316,7 +399,66 @@ class Parser0920Summary():
 
         return action
 
-    def env2messages4ask(self, task, environments, actions, markov_mode=False, return_sft = False, hints = [], ) -> list:
+    def str2action(self, command_str):
+        command_str = self._normalize_command_str(command_str.strip())
+        
+        # Extract CoT and key-value parts
+        # Expected format: <THINK> cot </THINK>\nexplain:xxx\taction:xx\tvalue:xxx\tsummary:xxx
+        try:
+            cot_part = command_str.split("<THINK>")[1].split("</THINK>")[0].strip()
+            kv_part = command_str.split("</THINK>")[1].strip()
+        except IndexError:
+            print(f"[Parser Warning] Missing <THINK> tags, treating entire response as kv")
+            kv_part = command_str
+            cot_part = ""
+
+        action = OrderedDict()
+        action['cot'] = cot_part
+        
+        # FIX:issue 13
+        # Error split by \n, should split by tab separator 
+        kvs = [kv.strip() for kv in kv_part.split("\t") if kv.strip()]
+
+        return self._parse_kvs(kvs, action)
+
+    def str2action_partial(self, command_str):
+        """
+        Parse a streamed, possibly unfinished response.
+        Returns the action (without summary) as soon as the action type and all
+        its required parameters are complete, None before that.
+        A field is complete once the tab that starts the next one has arrived.
+        """
+        # keep the trailing tab, it completes the last field
+        command_str = self._normalize_command_str(command_str.lstrip())
+        if "</THINK>" not in command_str:
+            return None
+
+        cot_part = command_str.split("<THINK>")[1].split("</THINK>")[0].strip() if "<THINK>" in command_str else ""
+        kv_part = command_str.split("</THINK>", 1)[1].lstrip()
+
+        # the last field may still be streaming
+        kvs = [kv.strip() for kv in kv_part.split("\t")[:-1] if kv.strip()]
+
+        action = OrderedDict()
+        action['cot'] = cot_part
+        try:
+            self._parse_kvs(kvs, action)
+        except ValueError:
+            return None
+
+        action_type = action.get('action')
+        if action_type is None or "explain" not in action or action_type not in REQUIRED_ACTION_FIELDS:
+            return None
+        if any(field not in action for field in REQUIRED_ACTION_FIELDS[action_type]):
+            return None
+
+        action.pop('summary', None)
+        return action
+
+    def env2prompt_variables(self, task, environments, actions, hints = []) -> dict:
+        """
+        The per-step variables of the prompt (see `prompt_template`).
+        """
 
         assert len(environments) > 0, f"environments {environments} should not be empty"
         assert len(environments) - 1 == len(actions), f"environments {environments} should be one more than actions {actions}"
@@ -353,26 +495,16 @@ class Parser0920Summary():
         else:
             qa_prompt = ""
 
-
-        conversations = [
-            {
-                "type": "text",
-                "text": task_define_prompt
-            }
-        ] + make_status_prompt(
+        return status_prompt_variables(
             task, 
             current_env['image'], 
-            hints,
             summary_history,
             qa_prompt
         )
 
-        messages = [
-            {
-                "role": "user",
-                "content": conversations
-            }
-        ]
+    def env2messages4ask(self, task, environments, actions, markov_mode=False, return_sft = False, hints = [], ) -> list:
+
+        messages = PROMPT_LAYOUTS[self.prompt_layout](**self.env2prompt_variables(task, environments, actions, hints))
         # print(f"=============================================messages: \n\n{messages}\n=============================================")
         # print(f"{'='*45}\nmessages:\n{messages}\n{'='*45}")
 
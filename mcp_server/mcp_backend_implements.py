@@ -5,7 +5,7 @@ if "." not in sys.path:
     sys.path.append(".")
 
 from copilot_front_end.mobile_action_helper import list_devices, get_device_wm_size
-from copilot_agent_server.local_server import LocalServer
+from copilot_agent_server.local_server import get_local_server
 
 from copilot_agent_client.mcp_agent_loop import gui_agent_loop
 
@@ -41,17 +41,13 @@ def get_screenshot(device_id: str, ):
 
     """
 
-    from copilot_front_end.mobile_action_helper import capture_screenshot
+    from copilot_front_end.mobile_action_helper import capture_frame
 
-    screenshot_url = capture_screenshot(device_id)
+    frame = capture_frame(device_id)
 
-
-    with smart_open(screenshot_url, "rb") as f:
-        image_data = f.read()
+    image_data = frame.encode(format="PNG")
     screenshot_b64 = base64.b64encode(image_data).decode('utf-8')
 
-    smart_remove(screenshot_url)
-
     return screenshot_b64
 
     
@@ -193,7 +189,7 @@ def execute_task(
     max_steps = min(max_steps, agent_loop_config.get('max_steps', 40))
 
 
-    l2_server = LocalServer(mcp_server_config['server_config'])
+    l2_server = get_local_server(mcp_server_config['server_config'])
 
     result = gui_agent_loop(
         agent_server=l2_server,
@@ -16,7 +16,7 @@ from fastmcp import Context
 from pydantic import Field
 
 from copilot_front_end.mobile_action_helper import list_devices
-from copilot_agent_server.local_server import LocalServer
+from copilot_agent_server.local_server import get_local_server
 from copilot_agent_client.mcp_agent_loop import gui_agent_loop
 
 import yaml
@@ -88,7 +88,7 @@ async def execute_task_streaming(
     actual_timeout = min(max(timeout, 30), min(max_timeout, timeout))
 
     # 创建服务器
-    l2_server = LocalServer(server_config)
+    l2_server = get_local_server(server_config)
 
     # 报告开始
     await ctx.info(f"🚀 开始执行任务: {task}")
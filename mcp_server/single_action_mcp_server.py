@@ -32,13 +32,13 @@ from fastmcp import FastMCP, Context
 from fastmcp.utilities.logging import configure_logging
 from pydantic import Field
 from PIL import Image
-from openai import OpenAI
 
 # 添加项目路径
 if "." not in sys.path:
     sys.path.append(".")
 
 from copilot_front_end.scrcpy_connection_manager import get_scrcpy_manager
+from tools.ask_llm_v2 import ask_llm_anything_async, get_model_config
 
 # 配置日志
 log_dir = Path("running_log/mcp_server")
@@ -79,21 +79,12 @@ logger.info("=" * 70)
 screenshot_dir = Path("running_log/mcp_screenshots")
 screenshot_dir.mkdir(parents=True, exist_ok=True)
 
-# 读取模型配置
-import yaml
-with open("model_config.yaml", "r", encoding="utf-8") as f:
-    model_config = yaml.safe_load(f)
-
-local_config = model_config.get("local", {})
-llm_base_url = local_config.get("api_base", "http://localhost:11434/v1")
-llm_api_key = local_config.get("api_key", "ollama")
+# 模型配置: model_config.yaml 的 local 提供商（可以是 type: balancer 的多副本提供商）
+# 使用 ask_llm_anything_async（tools/ask_llm_v2.py），推理期间不阻塞事件循环
+model_provider = "local"
 model_name = "gelab-zero-4b-preview"
-
-# 创建 OpenAI 客户端
-llm_client = OpenAI(
-    base_url=llm_base_url,
-    api_key=llm_api_key
-)
+_local_config = get_model_config()[model_provider]
+llm_base_url = _local_config.get("api_base") or ", ".join(e["api_base"] for e in _local_config.get("endpoints", []))
 
 # 创建 FastMCP 服务器
 mcp = FastMCP(
@@ -312,19 +303,14 @@ async def screenshot(
     if not client or not client.is_connected:
         return {"error": f"设备 {device_id} 未连接"}
 
-    # 获取最后一帧
-    frame = client.last_frame
-    if frame is None:
-        client.start()
-        time.sleep(0.5)
-        frame = client.last_frame
-
-    if frame is None:
+    # 从帧环形缓冲区获取最新一帧（无需轮询）
+    latest = manager.get_latest_frame(device_id, show_window=False)
+    if latest is None:
         return {"error": "无法获取截图"}
 
     # 转换为 PIL Image
-    from scrcpy_py_ddlx_client.utils import convert_frame_to_image
-    pil_image = convert_frame_to_image(frame)
+    _, frame = latest
+    pil_image = Image.fromarray(frame)
 
     width, height = pil_image.size
 
@@ -385,14 +371,9 @@ async def do_action(
         # 使用提供的截图
         pil_image = Image.open(screenshot_path)
     else:
-        # 自动获取截图
-        frame = client.last_frame
-        if frame is None:
-            client.start()
-            time.sleep(0.5)
-            frame = client.last_frame
-
-        if frame is None:
+        # 自动获取截图（帧环形缓冲区中的最新一帧）
+        latest = manager.get_latest_frame(device_id, show_window=False)
+        if latest is None:
             return {
                 "error": "无法获取截图",
                 "thinking": None,
@@ -402,8 +383,8 @@ async def do_action(
                 "screenshot_after_path": None
             }
 
-        from scrcpy_py_ddlx_client.utils import convert_frame_to_image
-        pil_image = convert_frame_to_image(frame)
+        _, frame = latest
+        pil_image = Image.fromarray(frame)
 
     width, height = pil_image.size
 
@@ -433,15 +414,19 @@ async def do_action(
     ]
 
     try:
-        response = llm_client.chat.completions.create(
-            model=model_name,
+        response = await ask_llm_anything_async(
+            model_provider=model_provider,
+            model_name=model_name,
             messages=messages,
-            max_tokens=2048,
-            temperature=0.1
+            args={"max_tokens": 2048, "temperature": 0.1},
         )
 
-        raw_output = response.choices[0].message.content.strip()
-        result = _parse_action_response(raw_output)
+        raw_output = response.strip()
+        # 推理模型的输出可能带有 <think>…</think> 推理过程，只解析最后一个 </think> 之后的内容
+        action_output = raw_output
+        if "</think>" in action_output:
+            action_output = action_output.split("</think>")[-1].strip()
+        result = _parse_action_response(action_output)
         result["raw_output"] = raw_output
 
         thinking = result.get("thinking", "")
@@ -458,20 +443,12 @@ async def do_action(
             execution_result = _execute_action(device_id, predicted_action)
             executed = "错误" not in execution_result
 
-            # 等待动作生效
-            time.sleep(0.5)
-
-        # 4. 获取执行后的截图
-        frame_after = client.last_frame
-        if frame_after is None:
-            # 尝试重新获取
-            time.sleep(0.3)
-            frame_after = client.last_frame
+        # 4. 获取执行后的截图：等待画面稳定后的第一帧（替代固定 sleep）
+        frame_after = manager.wait_for_settle(device_id, quiet_window=0.3, timeout=2.0, show_window=False)
 
         screenshot_after_path = None
         if frame_after is not None:
-            from scrcpy_py_ddlx_client.utils import convert_frame_to_image
-            pil_image_after = convert_frame_to_image(frame_after)
+            pil_image_after = Image.fromarray(frame_after)
             screenshot_after_path = _save_screenshot(pil_image_after, "after")
 
         return {
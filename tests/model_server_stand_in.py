@@ -0,0 +1,164 @@
+"""
+测试用的模拟模型服务（OpenAI 兼容的 /v1/chat/completions）与辅助函数
+"""
+
+import base64
+import io
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from tools import ask_llm_v2
+
+
+class StandInModelServer:
+    """
+    模拟 OpenAI 兼容的模型服务: 返回固定回复，统计请求数与 TCP 连接数
+    """
+
+    def __init__(self, reply="explain:点击\taction:CLICK\tpoint:100,200\tsummary:点击设置", delay=0.0, chunk_delay=0.0, fail_first=0):
+        self.reply = reply
+        self.delay = delay
+        # 流式回复: 每 4 个字符一段，段间间隔 chunk_delay 秒
+        self.chunk_delay = chunk_delay
+        # 前 fail_first 个请求返回 503
+        self.fail_first = fail_first
+        self.requests = []
+        self.connections = 0
+        # 客户端中途断开的流式回复数
+        self.aborted = 0
+        # 为 True 时所有请求（含健康检查）返回 503
+        self.down = False
+        # 模拟前缀缓存: 与上一个请求的 messages 相同前缀的字符数记为 cached_tokens
+        self.last_prompt = ""
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                stand_in.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, data):
+                data = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if stand_in.down:
+                    return self._send_json(503, {"error": {"message": "down"}})
+                self._send_json(200, {"object": "list", "data": [{"id": "gelab-zero-4b-preview", "object": "model"}]})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stand_in.requests.append(body)
+                time.sleep(stand_in.delay)
+                if stand_in.down or len(stand_in.requests) <= stand_in.fail_first:
+                    return self._send_json(503, {"error": {"message": "overloaded"}})
+                prompt = json.dumps(body["messages"], ensure_ascii=False)
+                cached = len(os.path.commonprefix([prompt, stand_in.last_prompt]))
+                stand_in.last_prompt = prompt
+                usage = {
+                    "prompt_tokens": len(prompt),
+                    "completion_tokens": len(stand_in.reply),
+                    "total_tokens": len(prompt) + len(stand_in.reply),
+                    "prompt_tokens_details": {"cached_tokens": cached},
+                }
+                if body.get("stream"):
+                    return self._stream(body, usage)
+                data = json.dumps({
+                    "id": f"chatcmpl-{len(stand_in.requests)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": stand_in.reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, body, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(data):
+                    event = f"data: {data}\n\n".encode()
+                    self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                    self.wfile.flush()
+
+                reply = stand_in.reply
+                try:
+                    for i in range(0, len(reply), 4):
+                        send(json.dumps({
+                            "id": f"chatcmpl-{len(stand_in.requests)}",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": body["model"],
+                            "choices": [{"index": 0, "delta": {"content": reply[i:i + 4]}, "finish_reason": None}],
+                        }))
+                        time.sleep(stand_in.chunk_delay)
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        send(json.dumps({
+                            "id": f"chatcmpl-{len(stand_in.requests)}",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": body["model"],
+                            "choices": [],
+                            "usage": usage,
+                        }))
+                    send("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    stand_in.aborted += 1
+                    self.close_connection = True
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_client_registry(monkeypatch):
+    # 每个测试重新读取当前目录下的 model_config.yaml
+    monkeypatch.setattr(ask_llm_v2, "_llm_client_registry", ask_llm_v2.LLMClientRegistry(check_interval=0.0))
+
+
+def write_model_config(path, providers):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(providers, f)
+
+
+def screenshot(color="white"):
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 128), color).save(buffered, format="JPEG")
+    return {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + base64.b64encode(buffered.getvalue()).decode()}}
@@ -0,0 +1,213 @@
+"""
+adb 协议客户端测试
+
+使用本地模拟的 adb server 验证协议实现，无需真实设备
+"""
+
+import asyncio
+import socket
+import struct
+import sys
+import threading
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_front_end.adb_protocol import (
+    AdbClient,
+    AdbProtocolError,
+    AsyncAdbClient,
+    decode_shell_v2,
+)
+
+
+def _shell_v2_packet(packet_id, data):
+    return struct.pack("<BI", packet_id, len(data)) + data
+
+
+class StandInAdbServer:
+    """
+    模拟 adb server: 支持 host:version / host:devices / features / transport / shell / sync
+    """
+
+    def __init__(self, devices=None, shell_v2=True):
+        self.devices = devices or {"emulator-5554": "device"}
+        self.shell_v2 = shell_v2
+        self.requests = []
+        self.pushed = {}
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _recv_exactly(self, conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def _recv_request(self, conn):
+        length = int(self._recv_exactly(conn, 4), 16)
+        request = self._recv_exactly(conn, length).decode("utf-8")
+        self.requests.append(request)
+        return request
+
+    def _send_payload(self, conn, payload):
+        payload = payload.encode("utf-8")
+        conn.sendall(b"OKAY" + b"%04x" % len(payload) + payload)
+
+    def _fail(self, conn, message):
+        message = message.encode("utf-8")
+        conn.sendall(b"FAIL" + b"%04x" % len(message) + message)
+
+    def _handle(self, conn):
+        try:
+            serial = None
+            while True:
+                request = self._recv_request(conn)
+                if request == "host:version":
+                    self._send_payload(conn, "%04x" % 41)
+                    return
+                if request == "host:devices":
+                    self._send_payload(conn, "".join(f"{s}\t{state}\n" for s, state in self.devices.items()))
+                    return
+                if request.startswith("host-serial:") and request.endswith(":features"):
+                    self._send_payload(conn, "shell_v2,cmd" if self.shell_v2 else "cmd")
+                    return
+                if request.startswith("host:transport:"):
+                    serial = request[len("host:transport:"):]
+                    if serial not in self.devices:
+                        self._fail(conn, f"device '{serial}' not found")
+                        return
+                    conn.sendall(b"OKAY")
+                    continue
+                if request.startswith("shell,v2,raw:"):
+                    command = request[len("shell,v2,raw:"):]
+                    conn.sendall(b"OKAY")
+                    conn.sendall(_shell_v2_packet(1, f"{serial}:{command}\n".encode("utf-8")))
+                    conn.sendall(_shell_v2_packet(2, b"warning\n"))
+                    conn.sendall(_shell_v2_packet(3, b"\x00"))
+                    return
+                if request.startswith("shell:"):
+                    conn.sendall(b"OKAY")
+                    conn.sendall(f"{serial}:{request[len('shell:'):]}\n".encode("utf-8"))
+                    return
+                if request == "sync:":
+                    conn.sendall(b"OKAY")
+                    self._handle_sync(conn)
+                    return
+                self._fail(conn, f"unknown service {request}")
+                return
+        except ConnectionError:
+            pass
+        finally:
+            conn.close()
+
+    def _handle_sync(self, conn):
+        command = self._recv_exactly(conn, 4)
+        assert command == b"SEND"
+        length = struct.unpack("<I", self._recv_exactly(conn, 4))[0]
+        remote_path = self._recv_exactly(conn, length).decode("utf-8").rsplit(",", 1)[0]
+        data = b""
+        while True:
+            command = self._recv_exactly(conn, 4)
+            value = struct.unpack("<I", self._recv_exactly(conn, 4))[0]
+            if command == b"DATA":
+                data += self._recv_exactly(conn, value)
+            elif command == b"DONE":
+                break
+        self.pushed[remote_path] = data
+        conn.sendall(b"OKAY" + struct.pack("<I", 0))
+
+
+def test_decode_shell_v2():
+    data = _shell_v2_packet(1, b"out") + _shell_v2_packet(2, b"err") + _shell_v2_packet(3, b"\x02")
+    assert decode_shell_v2(data) == (2, b"out", b"err")
+
+
+def test_host_services():
+    server = StandInAdbServer(devices={"a": "device", "b": "offline"})
+    client = AdbClient(port=server.port, pool_size=2)
+    try:
+        assert client.version() == 41
+        assert client.devices() == {"a": "device", "b": "offline"}
+    finally:
+        client.close()
+        server.close()
+
+
+def test_shell_v2_and_legacy():
+    server = StandInAdbServer()
+    client = AdbClient(port=server.port, pool_size=0)
+    try:
+        result = client.run("emulator-5554", "input tap 1 2")
+        assert result.returncode == 0
+        assert result.stdout == "emulator-5554:input tap 1 2\n"
+        assert result.stderr == "warning\n"
+    finally:
+        server.close()
+
+    server = StandInAdbServer(shell_v2=False)
+    client = AdbClient(port=server.port, pool_size=0)
+    try:
+        assert client.shell("emulator-5554", "getprop") == "emulator-5554:getprop\n"
+    finally:
+        server.close()
+
+
+def test_unknown_device_fails():
+    server = StandInAdbServer()
+    client = AdbClient(port=server.port, pool_size=0)
+    try:
+        try:
+            client.run("missing", "ls")
+        except AdbProtocolError as e:
+            assert "not found" in str(e)
+        else:
+            assert False, "expected AdbProtocolError"
+    finally:
+        server.close()
+
+
+def test_push(tmp_path):
+    local_path = tmp_path / "yadb"
+    local_path.write_bytes(b"x" * (200 * 1024))
+
+    server = StandInAdbServer()
+    client = AdbClient(port=server.port, pool_size=0)
+    try:
+        client.push("emulator-5554", str(local_path), "/data/local/tmp/")
+        assert server.pushed["/data/local/tmp/yadb"] == b"x" * (200 * 1024)
+    finally:
+        server.close()
+
+
+def test_async_client_concurrent():
+    server = StandInAdbServer()
+    client = AsyncAdbClient(port=server.port)
+
+    async def run_all():
+        return await asyncio.gather(*[client.shell("emulator-5554", f"echo {i}") for i in range(8)])
+
+    try:
+        outputs = asyncio.run(run_all())
+        assert outputs == [f"emulator-5554:echo {i}\n" for i in range(8)]
+    finally:
+        server.close()
+
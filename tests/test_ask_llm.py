@@ -0,0 +1,375 @@
+"""
+ask_llm_v2 测试
+
+使用本地模拟的 OpenAI 兼容服务（/v1/chat/completions），无需真实模型
+"""
+
+import base64
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from tools import ask_llm_v2
+from model_server_stand_in import StandInModelServer, fresh_client_registry, screenshot, write_model_config  # noqa: F401
+from tools.ask_llm_v2 import (
+    LLMDeadlineExceeded, ask_llm_anything, ask_llm_anything_async, get_async_llm_client, get_endpoint_stats, get_llm_client,
+)
+
+
+def _ask(model_provider="stand_in"):
+    return ask_llm_anything(
+        model_provider=model_provider,
+        model_name="gelab-zero-4b-preview",
+        messages=[{"role": "user", "content": "你好"}],
+    )
+
+
+def test_clients_are_shared_and_reloaded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    server = StandInModelServer()
+    other = StandInModelServer(reply="other")
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+
+        client = get_llm_client("stand_in")
+        for _ in range(5):
+            assert "CLICK" in _ask()
+        assert get_llm_client("stand_in") is client
+        # 长连接复用: 5 次请求只建立一个连接
+        assert len(server.requests) == 5
+        assert server.connections == 1
+
+        # 配置文件修改后重新加载，提供商配置变化时重建客户端
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": other.api_base, "api_key": "EMPTY", "timeout": 30}})
+        mtime = os.path.getmtime("model_config.yaml") + 1
+        os.utime("model_config.yaml", (mtime, mtime))
+        assert _ask() == "other"
+        assert get_llm_client("stand_in") is not client
+
+        try:
+            _ask("unknown")
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    finally:
+        server.close()
+        other.close()
+
+
+def test_stream_callback(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer()
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+        partials = []
+        result = ask_llm_anything(
+            model_provider="stand_in",
+            model_name="gelab-zero-4b-preview",
+            messages=[{"role": "user", "content": "你好"}],
+            stream_callback=partials.append,
+        )
+        assert result == server.reply
+        assert len(partials) > 1 and partials[-1] == server.reply
+        assert server.requests[0]["stream"] is True
+    finally:
+        server.close()
+
+
+def test_async_calls_share_one_pool(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer(delay=0.5)
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+
+        async def ask_many():
+            client = get_async_llm_client("stand_in")
+            results = await asyncio.gather(*[
+                ask_llm_anything_async(
+                    model_provider="stand_in",
+                    model_name="gelab-zero-4b-preview",
+                    messages=[{"role": "user", "content": f"你好 {i}"}],
+                )
+                for i in range(8)
+            ])
+            partials = []
+            streamed = await ask_llm_anything_async(
+                model_provider="stand_in",
+                model_name="gelab-zero-4b-preview",
+                messages=[{"role": "user", "content": "你好"}],
+                stream_callback=partials.append,
+            )
+            assert get_async_llm_client("stand_in") is client
+            return results, streamed, partials
+
+        start = time.time()
+        results, streamed, partials = asyncio.run(ask_many())
+        # 8 个 0.5 秒的请求在同一个事件循环中并发完成（串行需要 4 秒以上）
+        assert time.time() - start < 2.5
+        assert all("CLICK" in result for result in results)
+        assert streamed == server.reply and partials[-1] == server.reply
+        assert len(server.requests) == 9
+        # 并发请求各占一个连接，之后的请求复用长连接
+        assert server.connections == 8
+    finally:
+        server.close()
+
+
+def test_retries_and_deadline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    flaky = StandInModelServer(fail_first=2)
+    stuck = StandInModelServer(delay=3.0)
+    try:
+        write_model_config("model_config.yaml", {
+            "flaky": {"api_base": flaky.api_base, "api_key": "EMPTY", "retries": 2, "retry_backoff": 0.01},
+            "stuck": {"api_base": stuck.api_base, "api_key": "EMPTY", "deadline": 0.5},
+        })
+        # 503 后指数退避重试
+        assert "CLICK" in _ask("flaky")
+        assert len(flaky.requests) == 3
+
+        start = time.time()
+        with pytest.raises(LLMDeadlineExceeded):
+            _ask("stuck")
+        assert time.time() - start < 1.5
+    finally:
+        flaky.close()
+        stuck.close()
+
+
+def test_non_transient_error_is_raised_after_deadline():
+    import httpx
+    import openai
+
+    provider_config = {"deadline": 1.0, "retries": 2, "retry_backoff": 0.01, "retry_backoff_max": 1.0}
+    deadline = time.monotonic() - 1.0
+    # 超过截止时间后: 不可重试的错误原样抛出，可重试的错误转为 LLMDeadlineExceeded
+    assert ask_llm_v2._retry_backoff(provider_config, 0, ValueError("bad request"), deadline) is None
+    with pytest.raises(LLMDeadlineExceeded):
+        ask_llm_v2._retry_backoff(provider_config, 0, openai.APIConnectionError(request=httpx.Request("POST", "http://stand-in")), deadline)
+
+
+def test_hedged_request_cancels_the_slow_replica(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.chdir(tmp_path)
+    # 慢副本: 回复需要约 4 秒
+    slow = StandInModelServer(reply="slow " * 40, chunk_delay=0.1)
+    fast = StandInModelServer(reply="fast")
+    try:
+        write_model_config("model_config.yaml", {
+            "primary": {"api_base": slow.api_base, "api_key": "EMPTY", "hedge_provider": "replica", "hedge_delay": 0.2},
+            "replica": {"api_base": fast.api_base, "api_key": "EMPTY"},
+        })
+
+        start = time.time()
+        assert _ask("primary") == "fast"
+        assert time.time() - start < 1.5
+        assert len(slow.requests) == 1 and len(fast.requests) == 1
+
+        start = time.time()
+        assert asyncio.run(ask_llm_anything_async(
+            model_provider="primary",
+            model_name="gelab-zero-4b-preview",
+            messages=[{"role": "user", "content": "你好"}],
+        )) == "fast"
+        assert time.time() - start < 1.5
+
+        # 落后的请求断开连接，服务端不再继续输出
+        deadline = time.time() + 2
+        while slow.aborted < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert slow.aborted == 2
+
+        # 只有获胜（到达）的请求计入延迟统计，被取消的请求不计入
+        registry = ask_llm_v2._llm_client_registry
+        assert registry.latency_percentile(("primary", "completion"), 50) is None
+        assert len(registry._latencies[("replica", "completion")]) == 2
+
+        # 对冲等待时间取历史延迟的分位数
+        config = registry.get_provider_config("primary")
+        for i in range(config["hedge_min_samples"]):
+            registry.record_latency(("history", "completion"), 0.01 * (i + 1))
+        assert registry.hedge_delay(("unseen", "completion"), config) == 0.2
+        assert abs(registry.hedge_delay(("history", "completion"), config) - 0.2) < 1e-9
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_balancer_routes_by_load_and_ejects_failing_replicas(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fast = StandInModelServer(reply="fast", delay=0.02)
+    slow = StandInModelServer(reply="slow", delay=0.3)
+    broken = StandInModelServer(reply="broken")
+    broken.down = True
+    try:
+        write_model_config("model_config.yaml", {"pool": {
+            "type": "balancer",
+            "api_key": "EMPTY",
+            "endpoints": [{"api_base": fast.api_base}, {"api_base": slow.api_base}, {"api_base": broken.api_base}],
+            "eject_after_failures": 2,
+            "health_check_interval": 0,
+            "retries": 3,
+            "retry_backoff": 0.01,
+        }, "pair": {
+            "type": "balancer",
+            "api_key": "EMPTY",
+            "endpoints": [{"api_base": fast.api_base}, {"api_base": slow.api_base}],
+            "health_check_interval": 0,
+        }})
+
+        # 延迟相同时，并发请求按在途请求数平均分配
+        fast.delay = 0.3
+        threads = [threading.Thread(target=_ask, args=("pair",)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(fast.requests) == len(slow.requests) == 3
+        fast.delay = 0.02
+        del fast.requests[:], slow.requests[:]
+
+        # 串行请求: 失败的副本被摘除，其余请求集中到延迟低的副本
+        results = [_ask("pool") for _ in range(12)]
+        assert set(results) <= {"fast", "slow"}
+        stats = {endpoint["api_base"]: endpoint for endpoint in get_endpoint_stats("pool")["pool"]}
+        assert stats[broken.api_base]["ejected"] and stats[broken.api_base]["failures"] == 2
+        assert len(broken.requests) == 2
+        assert len(fast.requests) > len(slow.requests)
+        assert stats[fast.api_base]["ewma_latency"] < stats[slow.api_base]["ewma_latency"]
+        assert all(endpoint["in_flight"] == 0 for endpoint in stats.values())
+
+        # 健康检查: 仍不可用时保持摘除，恢复后重新加入
+        balancer = ask_llm_v2._llm_client_registry.get_balancer("pool")
+        balancer.check_health()
+        assert get_endpoint_stats("pool")["pool"][2]["ejected"]
+        broken.down = False
+        balancer.check_health()
+        assert not get_endpoint_stats("pool")["pool"][2]["ejected"]
+    finally:
+        fast.close()
+        slow.close()
+        broken.close()
+
+
+def test_response_cache(tmp_path, monkeypatch):
+    from tools.llm_response_cache import ResponseCache
+
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer()
+    image_path = tmp_path / "screen.jpeg"
+    Image.new("RGB", (64, 128), "white").save(image_path, format="JPEG")
+    b64_url = "data:image/jpeg;base64," + base64.b64encode(image_path.read_bytes()).decode()
+
+    def ask(image_url, temperature=0.1):
+        return ask_llm_anything(
+            model_provider="stand_in",
+            model_name="gelab-zero-4b-preview",
+            messages=[{"role": "user", "content": [
+                {"type": "text", "text": "打开设置"},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ]}],
+            args={"max_tokens": 64, "temperature": temperature},
+        )
+
+    def write_config(**cache_config):
+        write_model_config("model_config.yaml", {
+            "stand_in": {"api_base": server.api_base, "api_key": "EMPTY"},
+            "response_cache": {"enabled": True, "cache_dir": str(tmp_path / "cache"), **cache_config},
+        })
+
+    try:
+        write_config()
+        assert ask(b64_url) == server.reply
+        # 同样的图片字节（文件路径或 data URL）命中缓存
+        assert ask(str(image_path)) == server.reply
+        assert ask(b64_url) == server.reply
+        assert len(server.requests) == 1
+        # 参数不同不命中
+        ask(b64_url, temperature=0.5)
+        assert len(server.requests) == 2
+        stats = ask_llm_v2.get_response_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 2)
+
+        # 只读: 命中照常，未命中的回复不写入
+        write_config(read_only=True)
+        assert ask(b64_url) == server.reply
+        ask(b64_url, temperature=0.9)
+        ask(b64_url, temperature=0.9)
+        assert len(server.requests) == 4
+        stats = ask_llm_v2.get_response_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    finally:
+        server.close()
+
+    # 超过大小上限时淘汰最久未使用的回复
+    cache = ResponseCache(str(tmp_path / "lru"), max_bytes=100)
+    for key in ("a", "b"):
+        cache.put(key, "m", "x" * 40)
+    assert cache.get("a") is not None
+    cache.put("c", "m", "x" * 40)
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+    # 没有内容的回复不缓存
+    cache.put("d", "m", None)
+    assert cache.get("d") is None
+
+
+def test_prefix_cache_layout_records_usage(tmp_path, monkeypatch):
+    from copilot_agent_server.local_server import LocalServer
+    from copilot_tools.parser_0920_summary import status_instruction_prompt, task_define_prompt
+
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer()
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+        agent_server = LocalServer({"log_dir": str(tmp_path / "traces"), "image_dir": str(tmp_path / "images")})
+
+        def run_steps(task, prompt_layout, stream=False):
+            session_id = agent_server.get_session({
+                "task": task,
+                "task_type": "parser_0920",
+                "model_config": {
+                    "model_name": "gelab-zero-4b-preview", "model_provider": "stand_in",
+                    "prompt_layout": prompt_layout, "stream": stream,
+                },
+            })
+            for color in ("white", "black"):
+                agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": screenshot(color), "query": ""}})
+            agent_server.flush(session_id)
+            return [step["message"] for step in agent_server.session_store.get(session_id).server_logger.read_logs()[1:]]
+
+        default_steps = run_steps("打开设置", "default")
+        steps = run_steps("打开设置", "prefix_cache")
+        requests = server.requests[-2:]
+
+        # 静态说明在第一条 system 消息中，每一步逐字节相同；截图在最后
+        static_prompt = task_define_prompt + status_instruction_prompt
+        assert all(request["messages"][0] == {"role": "system", "content": static_prompt} for request in requests)
+        assert requests[1]["messages"][1]["content"][-1]["type"] == "image_url"
+        assert status_instruction_prompt not in json.dumps(requests[1]["messages"][1], ensure_ascii=False)
+
+        # usage 记录在 llm_cost 中，第二步复用的前缀更长
+        usage = steps[1]["llm_cost"]["usage"]
+        assert usage["cached_tokens"] == usage["prompt_tokens_details"]["cached_tokens"]
+        assert usage["cached_tokens"] > default_steps[1]["llm_cost"]["usage"]["cached_tokens"]
+        assert steps[1]["asked_messages"][0]["role"] == "system"
+
+        # 另一个任务的会话也复用 system 消息；流式调用同样记录 usage
+        other_steps = run_steps("打开相册", "prefix_cache", stream=True)
+        assert server.requests[-1]["messages"][0]["content"] == static_prompt
+        assert other_steps[0]["llm_cost"]["usage"]["cached_tokens"] >= len(json.dumps(static_prompt, ensure_ascii=False))
+    finally:
+        server.close()
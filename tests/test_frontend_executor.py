@@ -0,0 +1,69 @@
+"""
+前端动作执行测试（纯 adb 路径）
+
+使用模拟的设备 shell 与 adb 客户端，无需真实设备，也不需要 scrcpy
+"""
+
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+import copilot_front_end.pu_frontend_executor as executor
+from copilot_front_end.device_state_service import DeviceStateService
+
+
+class StandInShell:
+    """
+    模拟设备 shell: 返回当前的屏幕方向，记录查询次数
+    """
+
+    def __init__(self, orientation=0):
+        self.orientation = orientation
+        self.commands = []
+
+    def run(self, command, timeout=5.0):
+        self.commands.append(command)
+        return f"orientation={self.orientation}\n"
+
+    def close(self):
+        pass
+
+
+class StandInAdbClient:
+    def __init__(self):
+        self.commands = []
+
+    def run(self, device_id, command):
+        self.commands.append(command)
+
+
+def _setup(monkeypatch, shell):
+    # 纯 adb 环境: 不应导入 scrcpy（可能未安装）
+    monkeypatch.delitem(sys.modules, "copilot_front_end.scrcpy_connection_manager", raising=False)
+    state = DeviceStateService("emulator-5554", shell=shell)
+    monkeypatch.setattr(executor, "get_device_state", lambda device_id: state)
+    monkeypatch.setattr(executor, "invalidate_device_state", lambda device_id, keys=None: state.invalidate(keys))
+    adb_client = StandInAdbClient()
+    monkeypatch.setattr(executor, "get_adb_client", lambda: adb_client)
+    return adb_client
+
+
+def test_oriented_wm_size_without_scrcpy(monkeypatch):
+    _setup(monkeypatch, StandInShell(orientation=1))
+    assert executor._get_oriented_wm_size("emulator-5554", (1080, 2400)) == (2400, 1080)
+    assert "copilot_front_end.scrcpy_connection_manager" not in sys.modules
+
+
+def test_rotation_after_click_is_picked_up(monkeypatch):
+    shell = StandInShell(orientation=0)
+    adb_client = _setup(monkeypatch, shell)
+
+    executor.act_on_device({"action_type": "CLICK", "point": (500, 500)}, "emulator-5554", (1080, 2400))
+    assert adb_client.commands[-1] == "input tap 540 1200"
+
+    # 点击打开了横屏应用（视频、游戏），下一步的点击按横屏坐标映射
+    shell.orientation = 1
+    executor.act_on_device({"action_type": "CLICK", "point": (500, 250)}, "emulator-5554", (1080, 2400))
+    assert adb_client.commands[-1] == "input tap 1200 270"
+    assert len(shell.commands) == 2
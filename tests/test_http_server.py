@@ -0,0 +1,166 @@
+"""
+HTTP agent server 测试
+
+在 localhost 上启动 http_server，使用 RemoteServer 访问，服务端为模拟的 agent server
+"""
+
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+import urllib.request
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+import uvicorn
+
+from copilot_agent_server.base_server import BaseCopilotServer
+from copilot_agent_server.http_server import create_app
+from copilot_agent_server.remote_server import RemoteServer, RemoteServerError
+
+
+JPEG_DATA = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 4
+
+
+class StandInAgentServer(BaseCopilotServer):
+    """
+    模拟 agent server: 记录收到的 payload，每个 session 的步数递增
+    """
+
+    def __init__(self, step_delay=0.0):
+        super().__init__()
+        self.step_delay = step_delay
+        self.steps = {}
+        self.payloads = []
+        self.flushed = []
+        self.lock = threading.Lock()
+
+    def get_session(self, payload):
+        assert "task" in payload, "payload must contain 'task'"
+        session_id = f"session-{len(self.steps)}"
+        self.steps[session_id] = 0
+        return session_id
+
+    def automate_step(self, payload):
+        time.sleep(self.step_delay)
+        with self.lock:
+            self.payloads.append(payload)
+            self.steps[payload["session_id"]] += 1
+            current_step = self.steps[payload["session_id"]]
+        return {"action": {"action_type": "WAIT"}, "current_step": current_step}
+
+    def flush(self, session_id=None):
+        self.flushed.append(session_id)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(agent_server):
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(agent_server), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def _step_payload(session_id, screenshot):
+    return {
+        "session_id": session_id,
+        "observation": {"screenshot": screenshot, "query": ""},
+    }
+
+
+def test_remote_steps_carry_binary_images():
+    agent_server = StandInAgentServer()
+    server, url = _serve(agent_server)
+    try:
+        client = RemoteServer({"server_url": url})
+        session_id = client.get_session({"task": "打开设置"})
+
+        result = client.automate_step(_step_payload(session_id, {"type": "image_bytes", "image_bytes": {"data": JPEG_DATA}}))
+        assert result == {"action": {"action_type": "WAIT"}, "current_step": 1}
+
+        # base64 URL 在客户端解码，以二进制发送
+        b64_url = "data:image/jpeg;base64," + base64.b64encode(JPEG_DATA).decode()
+        result = client.automate_step(_step_payload(session_id, {"type": "image_url", "image_url": {"url": b64_url}}))
+        assert result["current_step"] == 2
+
+        for payload in agent_server.payloads:
+            assert payload["observation"]["screenshot"] == {"type": "image_bytes", "image_bytes": {"data": JPEG_DATA}}
+            assert payload["observation"]["query"] == ""
+
+        client.flush(session_id)
+        assert agent_server.flushed == [session_id]
+    finally:
+        server.should_exit = True
+
+
+def test_errors_are_reported():
+    server, url = _serve(StandInAgentServer())
+    try:
+        client = RemoteServer({"server_url": url})
+        try:
+            client.get_session({})
+            assert False, "expected RemoteServerError"
+        except RemoteServerError as e:
+            assert "400" in str(e) and "task" in str(e)
+    finally:
+        server.should_exit = True
+
+
+def test_concurrent_sessions():
+    agent_server = StandInAgentServer(step_delay=0.2)
+    server, url = _serve(agent_server)
+    try:
+        client = RemoteServer({"server_url": url})
+        session_ids = [client.get_session({"task": f"task {i}"}) for i in range(8)]
+
+        start = time.time()
+        threads = [
+            threading.Thread(target=client.automate_step, args=(
+                _step_payload(session_id, {"type": "image_bytes", "image_bytes": {"data": JPEG_DATA}}),
+            ))
+            for session_id in session_ids
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 8 个 0.2 秒的步骤并行处理
+        assert time.time() - start < 1.0
+        assert all(agent_server.steps[session_id] == 1 for session_id in session_ids)
+    finally:
+        server.should_exit = True
+
+
+def test_llm_stats_include_the_response_cache(tmp_path, monkeypatch):
+    from tools import ask_llm_v2
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ask_llm_v2, "_llm_client_registry", ask_llm_v2.LLMClientRegistry(check_interval=0.0))
+    server, url = _serve(StandInAgentServer())
+    try:
+        # 未开启回复缓存
+        with open("model_config.yaml", "w", encoding="utf-8") as f:
+            json.dump({"stand_in": {"api_base": "http://127.0.0.1:1/v1", "api_key": "EMPTY"}}, f)
+        with urllib.request.urlopen(f"{url}/llm_stats") as response:
+            assert json.load(response) == {"endpoints": {}, "response_cache": None}
+
+        with open("model_config.yaml", "w", encoding="utf-8") as f:
+            json.dump({"response_cache": {"enabled": True, "cache_dir": str(tmp_path / "cache")}}, f)
+        with urllib.request.urlopen(f"{url}/llm_stats") as response:
+            stats = json.load(response)
+        assert stats["endpoints"] == {}
+        assert (stats["response_cache"]["hits"], stats["response_cache"]["entries"]) == (0, 0)
+    finally:
+        server.should_exit = True
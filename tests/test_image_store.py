@@ -0,0 +1,63 @@
+"""
+内容寻址截图存储（image_store: "cas"）与 tools/gc_images.py 测试
+"""
+
+import os
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_agent_server.image_store import ImageStore
+from tools.gc_images import release_deleted_sessions
+
+
+class StandInTraceStorage:
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def list_sessions(self):
+        return list(self.sessions)
+
+
+def test_put_refcount_release_gc(tmp_path):
+    store = ImageStore(str(tmp_path / "images"))
+    shared = store.put(b"x" * 100, "a", "step_1")
+    assert store.put(b"x" * 100, "b", "step_1") == shared
+    only_a = store.put(b"y" * 50, "a", "step_2")
+    # 相同内容只存一份
+    assert store.stats() == {"objects": 2, "bytes": 150, "refs": 3, "unreferenced": 0}
+
+    # 同名图片保存了不同内容: 旧对象失去引用
+    replaced = store.put(b"z" * 20, "b", "step_2")
+    store.put(b"w" * 10, "b", "step_2")
+    assert store.stats()["unreferenced"] == 1
+
+    # 试运行: 释放 a 之后可回收 only_a 与 replaced，共享对象仍被 b 引用
+    assert store.reclaimable(["a"]) == (2, 70)
+    assert store.gc(dry_run=True) == (1, 20)
+    assert store.stats()["objects"] == 4 and os.path.exists(replaced)
+
+    assert store.release_session("a") == 2
+    assert store.gc() == (2, 70)
+    assert not os.path.exists(only_a) and not os.path.exists(replaced)
+    assert os.path.exists(shared)
+    assert store.stats() == {"objects": 2, "bytes": 110, "refs": 2, "unreferenced": 0}
+
+
+def test_gc_dry_run_counts_deleted_sessions_and_keeps_young_ones(tmp_path):
+    store = ImageStore(str(tmp_path / "images"))
+    store.put(b"x" * 100, "deleted", "step_1")
+    store.put(b"y" * 50, "pending", "step_1")
+    # deleted 的引用早于宽限期，pending 的轨迹还未写入（写入滞后）
+    store._conn().execute("UPDATE refs SET created = 0 WHERE session_id = 'deleted'")
+    traces = StandInTraceStorage([])
+
+    deleted = release_deleted_sessions(store, traces, dry_run=True, grace_seconds=600)
+    assert deleted == ["deleted"]
+    assert store.reclaimable(deleted) == (1, 100)
+    assert store.stats()["refs"] == 2
+
+    release_deleted_sessions(store, traces, grace_seconds=600)
+    assert store.gc() == (1, 100)
+    assert store.list_sessions() == ["pending"]
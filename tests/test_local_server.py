@@ -0,0 +1,155 @@
+"""
+LocalServer 测试（流式单步: 提前返回动作）
+
+使用本地模拟的模型服务，无需真实模型
+"""
+
+import json
+import sys
+import time
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from model_server_stand_in import StandInModelServer, fresh_client_registry, screenshot, write_model_config  # noqa: F401
+
+
+def test_streamed_step_returns_action_before_summary(tmp_path, monkeypatch):
+    from copilot_agent_server.local_server import LocalServer
+
+    monkeypatch.chdir(tmp_path)
+    reply = "<THINK> 打开设置 </THINK>\nexplain:点击设置\taction:CLICK\tpoint:100,200\tsummary:" + "已经点击了设置图标，" * 10
+    server = StandInModelServer(reply=reply, chunk_delay=0.01)
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+        agent_server = LocalServer({"log_dir": str(tmp_path / "traces"), "image_dir": str(tmp_path / "images")})
+        session_id = agent_server.get_session({
+            "task": "打开设置",
+            "task_type": "parser_0920",
+            "model_config": {"model_name": "gelab-zero-4b-preview", "model_provider": "stand_in", "stream": True},
+        })
+
+        image = screenshot()
+
+        start = time.time()
+        result = agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": image, "query": ""}})
+        action_time = time.time() - start
+        assert result["current_step"] == 1
+        assert result["action"]["action"] == "CLICK" and "summary" not in result["action"]
+
+        # 下一步等待上一步的 summary 写入后才开始
+        result = agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": image, "query": ""}})
+        assert result["current_step"] == 2
+        second_prompt = json.dumps(server.requests[1]["messages"], ensure_ascii=False)
+        assert "已经点击了设置图标" in second_prompt
+
+        agent_server.flush(session_id)
+        steps = agent_server.session_store.get(session_id).server_logger.read_logs()[1:]
+        assert steps[0]["message"]["action"]["summary"].startswith("已经点击了设置图标")
+        assert steps[0]["message"]["llm_cost"]["action_time"] < steps[0]["message"]["llm_cost"]["llm_time"]
+        assert action_time < steps[0]["message"]["llm_cost"]["llm_time"]
+    finally:
+        server.close()
+
+
+def test_streamed_step_failure_after_action_is_logged(tmp_path, monkeypatch):
+    from copilot_agent_server import local_server
+    from copilot_agent_server.local_server import LocalServer
+
+    monkeypatch.chdir(tmp_path)
+    partial = "<THINK> 打开设置 </THINK>\nexplain:点击设置\taction:CLICK\tpoint:100,200\tsummary:已经"
+
+    # 动作返回之后流中断
+    def broken_stream(stream_callback=None, **kwargs):
+        stream_callback(partial)
+        raise ConnectionError("stream interrupted")
+
+    monkeypatch.setattr(local_server, "ask_llm_anything", broken_stream)
+    agent_server = LocalServer({"log_dir": str(tmp_path / "traces"), "image_dir": str(tmp_path / "images")})
+    session_id = agent_server.get_session({
+        "task": "打开设置",
+        "task_type": "parser_0920",
+        "model_config": {"model_name": "gelab-zero-4b-preview", "model_provider": "stand_in", "stream": True},
+    })
+
+    image = screenshot()
+
+    result = agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": image, "query": ""}})
+    assert result["action"]["action"] == "CLICK"
+
+    # 下一步等待上一步记录完成，上一步带着提前返回的动作与错误
+    result = agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": image, "query": ""}})
+    assert result["current_step"] == 2
+
+    agent_server.flush(session_id)
+    steps = agent_server.session_store.get(session_id).server_logger.read_logs()[1:]
+    assert len(steps) == 2
+    assert steps[0]["message"]["action"]["point"] == [100, 200]
+    assert steps[0]["message"]["model_response"] == partial
+    assert "stream interrupted" in steps[0]["message"]["error"]
+
+
+def _concurrent_steps(agent_server, session_ids, image):
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=len(session_ids)) as pool:
+        return list(pool.map(
+            lambda session_id: agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": image, "query": ""}}),
+            session_ids,
+        ))
+
+
+def test_steps_of_one_session_are_serialized(tmp_path, monkeypatch):
+    from copilot_agent_server.local_server import LocalServer
+
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer(delay=0.2)
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+        agent_server = LocalServer({"log_dir": str(tmp_path / "traces"), "image_dir": str(tmp_path / "images")})
+        session_id = agent_server.get_session({
+            "task": "打开设置",
+            "task_type": "parser_0920",
+            "model_config": {"model_name": "gelab-zero-4b-preview", "model_provider": "stand_in"},
+        })
+
+        # 同一会话的 4 个并发步骤依次执行: 步骤号连续不重复，耗时约为 4 次模型调用
+        start = time.time()
+        results = _concurrent_steps(agent_server, [session_id] * 4, screenshot())
+        elapsed = time.time() - start
+        assert sorted(result["current_step"] for result in results) == [1, 2, 3, 4]
+        assert elapsed >= 0.8
+
+        agent_server.flush(session_id)
+        steps = agent_server.session_store.get(session_id).server_logger.read_logs()[1:]
+        # 截图按步骤号命名，日志顺序与步骤号一致
+        assert [f"step_{i}" in step["message"]["environment"]["image"] for i, step in enumerate(steps, start=1)] == [True] * 4
+    finally:
+        server.close()
+
+
+def test_distinct_sessions_run_in_parallel(tmp_path, monkeypatch):
+    from copilot_agent_server.local_server import LocalServer
+
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer(delay=0.5)
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+        agent_server = LocalServer({"log_dir": str(tmp_path / "traces"), "image_dir": str(tmp_path / "images")})
+        session_ids = [
+            agent_server.get_session({
+                "task": "打开设置",
+                "task_type": "parser_0920",
+                "model_config": {"model_name": "gelab-zero-4b-preview", "model_provider": "stand_in"},
+            })
+            for _ in range(4)
+        ]
+
+        # 不同会话互不阻塞: 4 个会话的步骤耗时约为 1 次模型调用
+        start = time.time()
+        results = _concurrent_steps(agent_server, session_ids, screenshot())
+        elapsed = time.time() - start
+        assert [result["current_step"] for result in results] == [1, 1, 1, 1]
+        assert elapsed < 1.5
+    finally:
+        server.close()
@@ -0,0 +1,65 @@
+"""
+动作解析器测试（流式回复的提前解析）
+"""
+
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+
+def test_partial_action_parse():
+    from copilot_tools.parser_0920_summary import Parser0920Summary
+
+    parser = Parser0920Summary()
+    response = "<THINK> 需要打开设置 </THINK>\nexplain:点击设置\taction:CLICK\tpoint:100,200\tsummary:已点击设置"
+
+    # 参数完整（后面的 tab 已到达）之前不返回
+    assert parser.str2action_partial(response[:response.index("point")]) is None
+    assert parser.str2action_partial(response[:response.index("\tsummary")]) is None
+
+    action = parser.str2action_partial(response[:response.index("summary") + 2])
+    assert action["action"] == "CLICK" and action["point"] == [100, 200]
+    assert "summary" not in action
+
+    full = parser.str2action(response)
+    assert all(full[key] == value for key, value in action.items())
+
+    # 类型参数不完整
+    assert parser.str2action_partial("<THINK>x</THINK>\nexplain:滑动\taction:SLIDE\tpoint1:1,2\t") is None
+    assert parser.str2action_partial("<THINK>x</THINK>\nexplain:返回\taction:BACK\t")["action"] == "BACK"
+
+
+def test_partial_action_parse_all_action_types():
+    from copilot_tools.parser_0920_summary import Parser0920Summary, REQUIRED_ACTION_FIELDS
+
+    parser = Parser0920Summary()
+    params = {
+        "CLICK": "point:100,200",
+        "LONGPRESS": "point:100,200",
+        "SLIDE": "point1:100,200\tpoint2:100,800",
+        "TYPE": "value:你好\tpoint:300,400",
+        "AWAKE": "value:设置",
+        "INFO": "value:要打开哪个应用？",
+        "WAIT": "value:2",
+        "COMPLETE": "return:已完成",
+        "ABORT": "value:无法继续",
+    }
+    assert set(params) <= set(REQUIRED_ACTION_FIELDS)
+
+    for action_type in REQUIRED_ACTION_FIELDS:
+        kv = f"explain:说明\taction:{action_type}"
+        if action_type in params:
+            kv += "\t" + params[action_type]
+        response = f"<THINK> 思考 </THINK>\n{kv}\tsummary:历史总结"
+        full = parser.str2action(response)
+        full.pop("summary")
+
+        # 逐字符流式输入: 第一次返回的动作与完整解析一致，且之前参数都已完整
+        partial = None
+        for end in range(len(response) + 1):
+            partial = parser.str2action_partial(response[:end])
+            if partial is not None:
+                break
+        assert partial == full, action_type
+        assert end == response.index("\tsummary") + 1, action_type
@@ -0,0 +1,107 @@
+"""
+running_log 保留策略（tools/retention.py）测试
+"""
+
+import os
+import sys
+import time
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_agent_server.trace_storage import JsonlTraceStorage, SqliteTraceStorage
+from tools.retention import run_retention
+
+DAY = 24 * 3600
+
+
+def _tree(root):
+    return sorted(
+        (os.path.relpath(os.path.join(d, f), root), os.path.getsize(os.path.join(d, f)))
+        for d, _, files in os.walk(root) for f in files
+    )
+
+
+def _write_file(path, size, age_days):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age_days * DAY
+    os.utime(path, (mtime, mtime))
+
+
+def _trace(session_id, image_paths, timestamp="2026-01-01 00:00:00"):
+    records = [{"session_id": session_id, "timestamp": timestamp,
+                "message": {"log_type": "session_start", "task": "t", "task_type": "parser_0920", "model_config": {}}}]
+    for path in image_paths:
+        records.append({"session_id": session_id, "timestamp": timestamp,
+                        "message": {"environment": {"image": path}, "action": {"action": "CLICK"}}})
+    return records
+
+
+def test_files_policy_age_count_size(tmp_path):
+    shots = tmp_path / "shots"
+    shots.mkdir()
+    for i, age in enumerate([0, 1, 2, 3, 30]):
+        _write_file(str(shots / f"{i}.png"), 1024, age)
+    before = _tree(tmp_path)
+
+    def run(policy, dry_run=False):
+        return run_retention({"policies": [{"kind": "files", "path": str(shots), **policy}]}, dry_run=dry_run)[0]
+
+    # 试运行只报告，不做任何修改
+    report = run({"max_age_days": 10, "max_count": 3}, dry_run=True)
+    assert (report["scanned"], report["deleted"], report["deleted_bytes"]) == (5, 2, 2048)
+    assert _tree(tmp_path) == before
+
+    run({"max_age_days": 10})
+    assert sorted(os.listdir(shots)) == ["0.png", "1.png", "2.png", "3.png"]
+    run({"max_count": 3})
+    assert sorted(os.listdir(shots)) == ["0.png", "1.png", "2.png"]
+    # 总大小上限: 保留最新的文件
+    run({"max_total_mb": 2 / 1024})
+    assert sorted(os.listdir(shots)) == ["0.png", "1.png"]
+
+
+def test_jsonl_traces_policy_removes_flat_screenshots(tmp_path):
+    log_dir, image_dir = str(tmp_path / "traces"), str(tmp_path / "images")
+    os.makedirs(image_dir)
+    storage = JsonlTraceStorage(log_dir)
+    for session_id, age in [("new", 0), ("old", 30)]:
+        image_path = f"{image_dir}/{session_id}_step_1.jpeg"
+        _write_file(image_path, 100, age)
+        storage.append_many(session_id, _trace(session_id, [image_path]))
+        mtime = time.time() - age * DAY
+        os.utime(storage.session_file(session_id), (mtime, mtime))
+    before = _tree(tmp_path)
+
+    config = {"policies": [{"kind": "traces", "path": log_dir, "image_dir": image_dir, "max_age_days": 7}]}
+    report = run_retention(config, dry_run=True)[0]
+    assert (report["scanned"], report["deleted"]) == (2, 1)
+    assert _tree(tmp_path) == before
+
+    run_retention(config)
+    assert storage.list_sessions() == ["new"]
+    assert sorted(os.listdir(image_dir)) == ["new_step_1.jpeg"]
+
+
+def test_sqlite_traces_policy_by_size(tmp_path):
+    log_dir = str(tmp_path / "traces")
+    storage = SqliteTraceStorage(f"{log_dir}/traces.db")
+    storage.append_many("old", _trace("old", ["a.jpeg"], "2026-01-01 00:00:00"))
+    storage.append_many("new", _trace("new", ["b.jpeg"], "2026-01-02 00:00:00"))
+    storage.record_image("new", "step_1", "b.jpeg", 4000)
+    # 只有步骤、没有 session_start 的会话按第一步的时间处理
+    storage.append_many("orphan", _trace("orphan", ["c.jpeg"], "2025-12-31 00:00:00")[1:])
+
+    sizes = {session_id: size for session_id, _, size in storage.session_stats()}
+    assert sizes["new"] > 4000 and 0 < sizes["old"] < 4000 and 0 < sizes["orphan"]
+
+    # 只能保留最新会话的大小: 其余会话被删除
+    config = {"policies": [{"kind": "traces", "path": log_dir, "storage_backend": "sqlite",
+                            "max_total_mb": (sizes["new"] + 1) / 1024 / 1024}]}
+    report = run_retention(config, dry_run=True)[0]
+    assert (report["scanned"], report["deleted"]) == (3, 2)
+    assert sorted(s for s, _, _ in storage.session_stats()) == ["new", "old", "orphan"]
+
+    run_retention(config)
+    assert [s for s, _, _ in storage.session_stats()] == ["new"]
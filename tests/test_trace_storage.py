@@ -0,0 +1,99 @@
+"""
+轨迹存储后端（trace_storage）与 JSONL 轨迹迁移测试
+"""
+
+import os
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_agent_server.trace_storage import JsonlTraceStorage, SqliteTraceStorage
+from model_server_stand_in import StandInModelServer, fresh_client_registry, screenshot, write_model_config  # noqa: F401
+
+
+def _record(session_id, step):
+    if step == 0:
+        return {"session_id": session_id, "timestamp": "2026-01-01 00:00:00",
+                "message": {"log_type": "session_start", "task": "打开设置", "task_type": "parser_0920",
+                            "model_config": {"model_name": "m"}}}
+    return {"session_id": session_id, "timestamp": "2026-01-01 00:00:01",
+            "message": {"environment": {"image": f"{session_id}_{step}.jpeg"}, "action": {"action": "CLICK", "step": step}}}
+
+
+def test_sqlite_fsync_and_sync(tmp_path):
+    storage = SqliteTraceStorage(str(tmp_path / "traces.db"))
+    storage.append_many("s", [_record("s", 0), _record("s", 1)], fsync=True)
+    conn = storage._conn()
+    # 持久写入之后恢复 synchronous=NORMAL（1）
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+    storage.append_many("s", [_record("s", 2)])
+    wal_path = str(tmp_path / "traces.db-wal")
+    assert os.path.getsize(wal_path) > 0
+    # sync 将 WAL 中已提交的记录检查点写入数据库
+    storage.sync("s")
+    busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    assert busy == 0 and log_frames == checkpointed
+    assert len(storage.read_steps("s")) == 2
+
+
+def test_migrated_trace_keeps_prompt_templates(tmp_path, monkeypatch):
+    from copilot_agent_server import local_server_logger
+    from copilot_agent_server.local_server import LocalServer
+    from copilot_agent_server.local_server_logger import LocalServerLogger
+    from tools.migrate_traces_to_sqlite import migrate_session
+
+    monkeypatch.chdir(tmp_path)
+    server = StandInModelServer(reply="<THINK> 打开设置 </THINK>\nexplain:点击设置\taction:CLICK\tpoint:100,200\tsummary:点击了设置")
+    log_dir, image_dir = str(tmp_path / "traces"), str(tmp_path / "images")
+    try:
+        write_model_config("model_config.yaml", {"stand_in": {"api_base": server.api_base, "api_key": "EMPTY"}})
+        agent_server = LocalServer({"log_dir": log_dir, "image_dir": image_dir, "image_store": "cas"})
+        session_id = agent_server.get_session({
+            "task": "打开设置",
+            "task_type": "parser_0920",
+            "model_config": {"model_name": "gelab-zero-4b-preview", "model_provider": "stand_in"},
+        })
+
+        image = screenshot()
+        for _ in range(3):
+            agent_server.automate_step({"session_id": session_id, "observation": {"screenshot": image, "query": ""}})
+        agent_server.flush(session_id)
+        expected = agent_server.session_store.get(session_id).server_logger.read_logs()
+    finally:
+        server.close()
+
+    source = JsonlTraceStorage(log_dir)
+    assert isinstance(source.read_logs(session_id)[1]["message"]["asked_messages"], dict)
+    assert migrate_session(source, SqliteTraceStorage(f"{log_dir}/traces.db"), session_id) == 3
+
+    # 本进程已加载的模板不能掩盖目标库缺少模板
+    monkeypatch.setattr(local_server_logger, "_loaded_prompt_templates", {})
+    migrated = LocalServerLogger({
+        "log_dir": log_dir, "image_dir": image_dir, "session_id": session_id, "storage_backend": "sqlite",
+    }).read_logs()
+    assert [log["message"] for log in migrated] == [log["message"] for log in expected]
+
+
+def test_sqlite_round_trip(tmp_path):
+    storage = SqliteTraceStorage(str(tmp_path / "traces.db"))
+    storage.append_many("b", [_record("b", 0), _record("b", 1)])
+    storage.append_many("a", [_record("a", 0)] + [_record("a", step) for step in range(1, 4)])
+    storage.append("a", _record("a", 4))
+
+    assert sorted(storage.list_sessions()) == ["a", "b"]
+    assert storage.read_config("a")["message"]["task"] == "打开设置"
+    assert storage.read_config("missing") is None
+
+    logs = storage.read_logs("a")
+    assert len(logs) == 5 and logs[0]["message"]["log_type"] == "session_start"
+    assert [step["message"]["action"]["step"] for step in storage.read_steps("a")] == [1, 2, 3, 4]
+    assert [step["message"]["action"]["step"] for step in storage.read_steps("a", start=2, end=3)] == [2, 3]
+    environments, actions = storage.read_env_actions("a")
+    assert environments[0] == {"image": "a_1.jpeg"} and len(actions) == 4
+
+    storage.delete_session("a")
+    assert storage.list_sessions() == ["b"]
+    assert storage.read_logs("a") == [] and storage.read_steps("a") == []
+    assert len(storage.read_steps("b")) == 1
@@ -0,0 +1,69 @@
+"""
+轨迹异步写入（TraceWriter）测试
+"""
+
+import sys
+
+import pytest
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_agent_server.trace_writer import get_trace_writer
+
+
+def test_trace_writers_are_keyed_by_settings():
+    # 不同 trace_fsync 设置的 LocalServer 使用不同的写入线程
+    writer = get_trace_writer(max_queue=16, batch_size=4, fsync="flush")
+    assert get_trace_writer(max_queue=16, batch_size=4, fsync="flush") is writer
+    other = get_trace_writer(max_queue=16, batch_size=4, fsync="batch")
+    assert other is not writer
+    assert (writer.fsync, other.fsync) == ("flush", "batch")
+
+
+class StandInTraceStorage:
+    def __init__(self, fail_sessions=()):
+        self.fail_sessions = set(fail_sessions)
+        self.records = {}
+        self.synced = []
+
+    def append_many(self, session_id, records, fsync=False):
+        if session_id in self.fail_sessions:
+            raise OSError("disk full")
+        self.records.setdefault(session_id, []).extend(records)
+
+    def sync(self, session_id):
+        self.synced.append(session_id)
+
+
+def test_trace_writer_fsyncs_all_dirty_traces_at_barrier():
+    from copilot_agent_server.trace_writer import TraceWriter
+
+    storage = StandInTraceStorage()
+    # 每批只取一项: 两个会话的记录在屏障之前的不同批次中写入
+    writer = TraceWriter(batch_size=1, fsync="flush")
+    writer.log(storage, "a", {"step": 1})
+    writer.log(storage, "b", {"step": 1})
+    assert writer.flush("a", timeout=5.0)
+    assert sorted(storage.synced) == ["a", "b"]
+
+    # 屏障之后没有新写入，不再 fsync
+    assert writer.flush(timeout=5.0)
+    assert sorted(storage.synced) == ["a", "b"]
+
+
+def test_trace_writer_reports_write_errors_to_flush():
+    from copilot_agent_server.trace_writer import TraceWriteError, TraceWriter
+
+    storage = StandInTraceStorage(fail_sessions=["bad"])
+    writer = TraceWriter(batch_size=8)
+    writer.log(storage, "good", {"step": 1})
+    writer.log(storage, "bad", {"step": 1})
+
+    # 其他会话的错误不报告给本会话的 flush
+    assert writer.flush("good", timeout=5.0)
+    with pytest.raises(TraceWriteError, match="disk full"):
+        writer.flush("bad", timeout=5.0)
+    # 错误只报告一次
+    assert writer.flush(timeout=5.0)
+    assert storage.records == {"good": [{"step": 1}]}
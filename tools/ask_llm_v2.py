@@ -9,12 +9,319 @@ import base64
 from openai import OpenAI
 import yaml
 
+import os
 import json
 import time
+import threading
+import itertools
+import contextlib
+import collections
+import weakref
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
+MODEL_CONFIG_FILE = "model_config.yaml"
+
+# 每个模型提供商的连接设置默认值，可在 model_config.yaml 的提供商配置中覆盖
+DEFAULT_PROVIDER_SETTINGS = {
+    "timeout": 600.0,                # 单次请求超时（秒）
+    "connect_timeout": 10.0,         # 建立连接超时（秒）
+    "max_connections": 64,           # 连接池最大连接数
+    "max_keepalive_connections": 16, # 保持的空闲长连接数
+    "keepalive_expiry": 60.0,        # 空闲长连接保留时间（秒）
+    "max_retries": 0,                # OpenAI SDK 自带的重试次数（重试由下面的设置控制）
+    "deadline": None,                # 整次调用（含重试与对冲请求）的截止时间（秒），None 不限制
+    "retries": 2,                    # 连接错误、超时、429、5xx 的重试次数
+    "retry_backoff": 0.5,            # 第一次重试前的等待（秒），之后每次翻倍
+    "retry_backoff_max": 8.0,        # 重试等待上限（秒）
+    "hedge_provider": None,          # 对冲请求发往的提供商（model_config.yaml 中的另一项），None 不对冲
+    "hedge_percentile": 95,          # 超过本提供商该分位延迟仍无回复时发出对冲请求
+    "hedge_min_samples": 20,         # 延迟样本少于该数量时使用 hedge_delay
+    "hedge_delay": 2.0,              # 默认的对冲等待（秒）
+    "stream_usage": True,            # 流式调用时请求 usage（stream_options.include_usage），服务不支持时设为 False
+}
+
+# 每个提供商保留的最近延迟样本数
+LATENCY_WINDOW = 200
+
+
+def _make_llm_client(provider_config: dict) -> OpenAI:
+    """
+    创建带长连接池的 OpenAI 客户端
+    """
+    import httpx
+
+    timeout = httpx.Timeout(provider_config["timeout"], connect=provider_config["connect_timeout"])
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=provider_config["max_connections"],
+            max_keepalive_connections=provider_config["max_keepalive_connections"],
+            keepalive_expiry=provider_config["keepalive_expiry"],
+        ),
+        follow_redirects=True,
+    )
+    return OpenAI(
+        api_key=provider_config["api_key"],
+        base_url=provider_config["api_base"],
+        timeout=timeout,
+        max_retries=provider_config["max_retries"],
+        http_client=http_client,
+    )
+
+
+def _make_async_llm_client(provider_config: dict):
+    """
+    创建带长连接池的 AsyncOpenAI 客户端（连接绑定创建时的事件循环）
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    timeout = httpx.Timeout(provider_config["timeout"], connect=provider_config["connect_timeout"])
+    http_client = httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=provider_config["max_connections"],
+            max_keepalive_connections=provider_config["max_keepalive_connections"],
+            keepalive_expiry=provider_config["keepalive_expiry"],
+        ),
+        follow_redirects=True,
+    )
+    return AsyncOpenAI(
+        api_key=provider_config["api_key"],
+        base_url=provider_config["api_base"],
+        timeout=timeout,
+        max_retries=provider_config["max_retries"],
+        http_client=http_client,
+    )
+
+
+class LLMClientRegistry:
+    """
+    进程级 LLM 客户端注册表
+
+    每个模型提供商（balancer 提供商为每个副本）一个客户端（连接池与 TLS 连接在调用之间复用），
+    model_config.yaml 修改时间变化时重新加载配置，配置变化的提供商重建客户端。
+    异步客户端的连接不能跨事件循环使用，按事件循环分别缓存。
+    """
+
+    def __init__(self, config_file: str = MODEL_CONFIG_FILE, check_interval: float = 1.0):
+        self.config_file = config_file
+        # 两次检查配置文件修改时间的最小间隔（秒）
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._config = None
+        self._config_mtime = None
+        self._last_check = 0.0
+        # {(model_provider, api_base): (client_config, OpenAI)}
+        self._clients = {}
+        # {model_provider: (provider_config, EndpointBalancer)}
+        self._balancers = {}
+        # {event loop: {(model_provider, api_base): (client_config, AsyncOpenAI)}}
+        self._async_clients = weakref.WeakKeyDictionary()
+        # (response_cache 配置, ResponseCache)
+        self._response_cache = None
+        # {(model_provider, 延迟类型): 最近的延迟样本}，用于对冲等待时间
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+
+    def get_config(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            if self._config is not None and now - self._last_check < self.check_interval:
+                return self._config
+            self._last_check = now
+
+            mtime = os.path.getmtime(self.config_file)
+            if self._config is None or mtime != self._config_mtime:
+                with smart_open(self.config_file, "r", encoding="utf-8") as f:
+                    self._config = yaml.safe_load(f)
+                if self._config_mtime is not None:
+                    logger.info(f"模型配置已重新加载: {self.config_file}")
+                self._config_mtime = mtime
+            return self._config
+
+    def get_provider_config(self, model_provider: str) -> dict:
+        model_config = self.get_config()
+        if model_provider not in model_config:
+            logger.error(f"未知的模型提供商: {model_provider}")
+            raise ValueError(f"Unknown model provider: {model_provider}")
+        return {**DEFAULT_PROVIDER_SETTINGS, **model_config[model_provider]}
+
+    def get_balancer(self, model_provider: str):
+        """
+        type: balancer 提供商的副本负载均衡器（tools/llm_balancer.py），配置变化时重建
+        """
+        from tools.llm_balancer import EndpointBalancer
+
+        provider_config = self.get_provider_config(model_provider)
+        assert provider_config.get("type") == "balancer", f"{model_provider} is not a balancer provider"
+        with self._lock:
+            cached = self._balancers.get(model_provider)
+            if cached is not None and cached[0] == provider_config:
+                return cached[1]
+            if cached is not None:
+                cached[1].close()
+            balancer = EndpointBalancer(model_provider, provider_config)
+            self._balancers[model_provider] = (provider_config, balancer)
+            return balancer
+
+    def _client_config(self, model_provider: str, endpoint=None) -> dict:
+        if endpoint is not None:
+            return endpoint.config
+        provider_config = self.get_provider_config(model_provider)
+        if provider_config.get("type") == "balancer":
+            # 不经过 lease 的调用使用当前最优的副本（不计入在途请求）
+            return self.get_balancer(model_provider).peek().config
+        return provider_config
+
+    def get_client(self, model_provider: str, endpoint=None) -> OpenAI:
+        client_config = self._client_config(model_provider, endpoint)
+        key = (model_provider, client_config["api_base"])
+        with self._lock:
+            cached = self._clients.get(key)
+            if cached is not None and cached[0] == client_config:
+                return cached[1]
+
+            logger.debug(f"创建 LLM 客户端 - 提供商: {model_provider}, api_base: {client_config['api_base']}")
+            client = _make_llm_client(client_config)
+            # 旧客户端可能仍有请求在进行，不主动关闭
+            self._clients[key] = (client_config, client)
+            return client
+
+    def get_async_client(self, model_provider: str, endpoint=None):
+        """
+        当前事件循环的共享异步客户端，需在协程中调用
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        client_config = self._client_config(model_provider, endpoint)
+        key = (model_provider, client_config["api_base"])
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            cached = clients.get(key)
+            if cached is not None and cached[0] == client_config:
+                return cached[1]
+
+            logger.debug(f"创建异步 LLM 客户端 - 提供商: {model_provider}, api_base: {client_config['api_base']}")
+            client = _make_async_llm_client(client_config)
+            clients[key] = (client_config, client)
+            return client
+
+    @contextlib.contextmanager
+    def lease(self, model_provider: str, use_async: bool = False):
+        """
+        一次请求使用的客户端。balancer 提供商在这里选择副本，并统计在途请求数、
+        成功请求的延迟与副本故障（连接错误、超时、429、5xx）
+        """
+        get_client = self.get_async_client if use_async else self.get_client
+        provider_config = self.get_provider_config(model_provider)
+        if provider_config.get("type") != "balancer":
+            yield get_client(model_provider)
+            return
+
+        balancer = self.get_balancer(model_provider)
+        endpoint = balancer.acquire()
+        start = time.monotonic()
+        try:
+            yield get_client(model_provider, endpoint)
+        except BaseException as e:
+            # 取消（对冲中落后）与参数错误不计入副本故障
+            balancer.release(endpoint, failed=isinstance(e, Exception) and _is_transient_error(e))
+            raise
+        balancer.release(endpoint, latency=time.monotonic() - start)
+
+    def get_response_cache(self):
+        """
+        model_config.yaml 中 response_cache 配置的回复缓存（tools/llm_response_cache.py），未开启时为 None
+        """
+        from tools.llm_response_cache import DEFAULT_CACHE_SETTINGS, ResponseCache
+
+        cache_config = {**DEFAULT_CACHE_SETTINGS, **(self.get_config().get("response_cache") or {})}
+        if not cache_config["enabled"]:
+            return None
+        with self._lock:
+            if self._response_cache is None or self._response_cache[0] != cache_config:
+                cache = ResponseCache(
+                    cache_config["cache_dir"],
+                    max_bytes=int(cache_config["max_size_mb"] * 1024 * 1024),
+                    read_only=cache_config["read_only"],
+                )
+                self._response_cache = (cache_config, cache)
+            return self._response_cache[1]
+
+    def get_endpoint_stats(self, model_provider: str = None) -> dict:
+        """
+        balancer 提供商每个副本的统计: {model_provider: [{api_base, in_flight, requests, ...}]}
+        """
+        with self._lock:
+            balancers = {name: cached[1] for name, cached in self._balancers.items()}
+        if model_provider is not None:
+            balancers = {model_provider: self.get_balancer(model_provider)}
+        return {name: balancer.stats() for name, balancer in balancers.items()}
+
+    def record_latency(self, key, seconds: float):
+        with self._lock:
+            self._latencies[key].append(seconds)
+
+    def latency_percentile(self, key, percentile: float, min_samples: int = 1):
+        """
+        最近延迟样本的分位数，样本不足时返回 None
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(int(len(samples) * percentile / 100), len(samples) - 1)]
+
+    def hedge_delay(self, key, provider_config: dict) -> float:
+        """
+        发出对冲请求前的等待时间: 延迟的 hedge_percentile 分位数，样本不足时为 hedge_delay
+        """
+        delay = self.latency_percentile(key, provider_config["hedge_percentile"], provider_config["hedge_min_samples"])
+        return provider_config["hedge_delay"] if delay is None else delay
+
+
+_llm_client_registry = LLMClientRegistry()
+
+
+def get_llm_client(model_provider: str) -> OpenAI:
+    """
+    获取模型提供商的共享客户端
+    """
+    return _llm_client_registry.get_client(model_provider)
+
+
+def get_async_llm_client(model_provider: str):
+    """
+    获取模型提供商在当前事件循环上的共享异步客户端
+    """
+    return _llm_client_registry.get_async_client(model_provider)
+
+
+def get_endpoint_stats(model_provider: str = None) -> dict:
+    """
+    balancer 提供商每个副本的在途请求数、请求数、失败数、平均延迟与摘除状态
+    """
+    return _llm_client_registry.get_endpoint_stats(model_provider)
+
+
+def get_response_cache_stats():
+    """
+    回复缓存的命中/未命中次数与大小，未开启缓存时为 None
+    """
+    cache = _llm_client_registry.get_response_cache()
+    return None if cache is None else cache.stats()
+
+
+def get_model_config() -> dict:
+    """
+    当前的 model_config.yaml 内容（修改后自动重新加载）
+    """
+    return _llm_client_registry.get_config()
+
 # 控制台输出模型回复的标志（默认开启）
 _show_model_response = True
 
@@ -67,81 +374,56 @@ def _print_model_response(response: str, max_len=200):
     # 输出
     print('\n'.join(display_lines))
 
-def ask_llm_anything(model_provider, model_name, messages, args= {
-    "max_tokens": 256,
-    "temperature": 0.5,
-    "top_p": 1.0,
-    "frequency_penalty": 0.0,
-}, resize_config=None):
-
-    logger.debug(f"ask_llm_anything - 提供商: {model_provider}, 模型: {model_name}")
-
-    with smart_open("model_config.yaml", "r", encoding="utf-8") as f:
-        model_config = yaml.safe_load(f)
-
-    if model_provider in model_config:
-        client = OpenAI(
-            api_key=model_config[model_provider]["api_key"],
-            base_url=model_config[model_provider]["api_base"]
-        )
-    else:
-        logger.error(f"未知的模型提供商: {model_provider}")
-        raise ValueError(f"Unknown model provider: {model_provider}")
-
-    # preprocess
-    def preprocess_messages(messages):
-        image_count = 0
-        for msg in messages:
-            if type(msg['content']) == str:
+def _preprocess_messages(messages, resize_config=None):
+    """
+    图片统一转换为 base64 data URL（按 resize_config 缩放），原地修改并返回 messages
+    """
+    image_count = 0
+    for msg in messages:
+        if type(msg['content']) == str:
+            continue
+        assert type(msg['content']) == list
+        for content in msg['content']:
+            if content['type'] == "text":
                 continue
-            assert type(msg['content']) == list
-            for content in msg['content']:
-                if content['type'] == "text":
+            assert content['type'] == "image_url" or content['type'] == "image_b64"
+            if content['type'] == "image_url":
+                url = content['image_url']['url']
+                if not isinstance(url, str):
+                    # in-process image handle (ScreenFrame), serialized only here at the HTTP boundary
+                    content['image_url']['url'] = url.to_b64_url(resize_config=resize_config)
+                    image_count += 1
+                    continue
+                if url.startswith("data:image/"):
                     continue
-                assert content['type'] == "image_url" or content['type'] == "image_b64"
-                if content['type'] == "image_url":
-                    url = content['image_url']['url']
-                    if url.startswith("data:image/"):
-                        continue
-                    else:
-                        image_bytes = smart_open(url, mode="rb").read()
-                        b64 = base64.b64encode(image_bytes).decode('utf-8')
-                        if image_bytes[0:4] == b"\x89PNG":
-                            content['image_url']['url'] = "data:image/png;base64," + b64
-                        elif image_bytes[0:2] == b"\xff\xd8":
-                            content['image_url']['url'] = "data:image/jpeg;base64," + b64
-                        else:
-                            content['image_url']['url'] = "data:image/png;base64," + b64
-                        image_count += 1
                 else:
-                    assert content['type'] == "image_b64"
-                    b64 = content['image_b64']['b64_json']
-                    del content['image_b64']
-                    content['image_url'] = {"url": "data:image/png;base64," + b64}
-                    content['type'] = "image_url"
-
-                if resize_config is not None and resize_config.get("is_resize", False) == True:
-                    image_url = content['image_url']['url']
-                    image_b64_url = image_url.split(",", 1)[1]
-                    image_data = base64.b64decode(image_b64_url)
-                    from PIL import Image
-                    import io
-                    image = Image.open(io.BytesIO(image_data))
-                    image = image.resize(size= resize_config['target_image_size'])
-                    image_data = io.BytesIO()
-                    image = image.convert('RGB')
-                    image.save(image_data, format="JPEG", quality=85)
-                    image_data = image_data.getvalue()
-                    b64_image = base64.b64encode(image_data).decode('utf-8')
-                    content['image_url']['url'] = f"data:image/jpeg;base64,{b64_image}"
-
-        logger.debug(f"预处理完成，处理了 {image_count} 张图片")
-        return messages
-    messages = preprocess_messages(messages)
+                    image_bytes = smart_open(url, mode="rb").read()
+                    b64 = base64.b64encode(image_bytes).decode('utf-8')
+                    if image_bytes[0:4] == b"\x89PNG":
+                        content['image_url']['url'] = "data:image/png;base64," + b64
+                    elif image_bytes[0:2] == b"\xff\xd8":
+                        content['image_url']['url'] = "data:image/jpeg;base64," + b64
+                    else:
+                        content['image_url']['url'] = "data:image/png;base64," + b64
+                    image_count += 1
+            else:
+                assert content['type'] == "image_b64"
+                b64 = content['image_b64']['b64_json']
+                del content['image_b64']
+                content['image_url'] = {"url": "data:image/png;base64," + b64}
+                content['type'] = "image_url"
 
-    logger.debug("开始调用 OpenAI API...")
-    start_time = time.time()
-    completion = client.chat.completions.create(
+            if resize_config is not None and resize_config.get("is_resize", False) == True:
+                # shared, memoized resize-and-encode stage
+                from tools.image_tools import prepare_b64_url
+                content['image_url']['url'] = prepare_b64_url(content['image_url']['url'], resize_config=resize_config)
+
+    logger.debug(f"预处理完成，处理了 {image_count} 张图片")
+    return messages
+
+
+def _request_args(model_name, messages, args):
+    return dict(
         model=model_name,
         messages=messages,
         temperature=args.get("temperature", 0.5),
@@ -149,17 +431,550 @@ def ask_llm_anything(model_provider, model_name, messages, args= {
         frequency_penalty=args.get("frequency_penalty", 0.0),
         max_tokens=args.get("max_tokens", 100),
     )
-    end_time = time.time()
-    inference_time = end_time - start_time
-    logger.debug(f"LLM 调用耗时: {inference_time:.2f}s，ID: {completion.id}")
 
-    result = completion.choices[0].message.content
 
-    reasoning = getattr(completion.choices[0].message, "reasoning_content", "")
+def _finish_response(result, reasoning):
     if reasoning is not None and len(reasoning) > 0:
         result = "</think>" + reasoning + "</think>" + "\n" + result
 
     # 在控制台显示模型回复（简洁格式）
     _print_model_response(result)
-
     return result
+
+
+def ask_llm_anything(model_provider, model_name, messages, args= {
+    "max_tokens": 256,
+    "temperature": 0.5,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+}, resize_config=None, stream_callback=None, usage_container=None):
+    """
+    stream_callback: 指定时使用流式调用，每收到一段回复以当前已收到的文本调用一次，
+    返回值仍是完整回复
+
+    截止时间、重试与对冲请求按提供商配置（见 DEFAULT_PROVIDER_SETTINGS），
+    超过截止时间抛出 LLMDeadlineExceeded。
+    开启 response_cache 时相同的请求直接返回缓存的回复（有 stream_callback 时以完整回复调用一次）
+
+    usage_container: 指定时写入本次调用的 token 用量（prompt_tokens、completion_tokens、
+    提供商报告时的 cached_tokens 等），命中回复缓存时写入 response_cache_hit
+    """
+
+    logger.debug(f"ask_llm_anything - 提供商: {model_provider}, 模型: {model_name}")
+
+    # 未知提供商抛出 ValueError
+    provider_config = _llm_client_registry.get_provider_config(model_provider)
+
+    messages = _preprocess_messages(messages, resize_config)
+
+    logger.debug("开始调用 OpenAI API...")
+    request_args = _request_args(model_name, messages, args)
+
+    # 回复缓存（默认关闭）
+    cache = _llm_client_registry.get_response_cache()
+    cache_key = None
+    if cache is not None:
+        from tools.llm_response_cache import request_key
+
+        cache_key = request_key(request_args)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"回复缓存命中: {cache_key[:16]}")
+            if usage_container is not None:
+                usage_container["response_cache_hit"] = True
+            if stream_callback is not None:
+                stream_callback(cached[0])
+            return _finish_response(*cached)
+
+    start_time = time.time()
+    deadline = _call_deadline(provider_config)
+    emitted = [False]
+    if stream_callback is not None:
+        user_callback = stream_callback
+
+        def stream_callback(text):
+            emitted[0] = True
+            user_callback(text)
+
+    for attempt in itertools.count():
+        try:
+            if provider_config.get("hedge_provider"):
+                completion_id, result, reasoning, usage = _HedgedCompletion(
+                    model_provider, provider_config, request_args, stream_callback, deadline
+                ).run()
+            else:
+                with _llm_client_registry.lease(model_provider) as client:
+                    completion_id, result, reasoning, usage = _single_completion(
+                        client, request_args, stream_callback,
+                        _attempt_timeout(provider_config, deadline), deadline, provider_config["stream_usage"],
+                    )
+            break
+        except Exception as e:
+            # 已经转发过部分回复的流式调用不重试
+            backoff = None if emitted[0] else _retry_backoff(provider_config, attempt, e, deadline)
+            if backoff is None:
+                raise
+            logger.warning(f"LLM 调用失败 ({type(e).__name__}: {e})，{backoff:.2f}s 后第 {attempt + 1} 次重试")
+            time.sleep(backoff)
+    end_time = time.time()
+    inference_time = end_time - start_time
+    logger.debug(f"LLM 调用耗时: {inference_time:.2f}s，ID: {completion_id}")
+
+    if usage_container is not None and usage:
+        usage_container.update(usage)
+    if cache is not None:
+        cache.put(cache_key, model_name, result, reasoning)
+
+    return _finish_response(result, reasoning)
+
+
+async def ask_llm_anything_async(model_provider, model_name, messages, args= {
+    "max_tokens": 256,
+    "temperature": 0.5,
+    "top_p": 1.0,
+    "frequency_penalty": 0.0,
+}, resize_config=None, stream_callback=None, usage_container=None):
+    """
+    ask_llm_anything 的异步版本，等待模型回复期间不阻塞事件循环
+
+    使用当前事件循环的共享 AsyncOpenAI 客户端（连接池在调用之间复用），
+    图片读取与缩放在线程池中执行
+    """
+    import asyncio
+
+    logger.debug(f"ask_llm_anything_async - 提供商: {model_provider}, 模型: {model_name}")
+
+    provider_config = _llm_client_registry.get_provider_config(model_provider)
+
+    loop = asyncio.get_running_loop()
+    messages = await loop.run_in_executor(None, _preprocess_messages, messages, resize_config)
+
+    request_args = _request_args(model_name, messages, args)
+
+    cache = _llm_client_registry.get_response_cache()
+    cache_key = None
+    if cache is not None:
+        from tools.llm_response_cache import request_key
+
+        cache_key = request_key(request_args)
+        cached = await loop.run_in_executor(None, cache.get, cache_key)
+        if cached is not None:
+            logger.debug(f"回复缓存命中: {cache_key[:16]}")
+            if usage_container is not None:
+                usage_container["response_cache_hit"] = True
+            if stream_callback is not None:
+                stream_callback(cached[0])
+            return _finish_response(*cached)
+
+    start_time = time.time()
+    deadline = _call_deadline(provider_config)
+    emitted = [False]
+    if stream_callback is not None:
+        user_callback = stream_callback
+
+        def stream_callback(text):
+            emitted[0] = True
+            user_callback(text)
+
+    for attempt in itertools.count():
+        try:
+            if provider_config.get("hedge_provider"):
+                completion_id, result, reasoning, usage = await _hedged_completion_async(
+                    model_provider, provider_config, request_args, stream_callback, deadline
+                )
+            else:
+                with _llm_client_registry.lease(model_provider, use_async=True) as client:
+                    completion_id, result, reasoning, usage = await _single_completion_async(
+                        client, request_args, stream_callback,
+                        _attempt_timeout(provider_config, deadline), deadline, provider_config["stream_usage"],
+                    )
+            break
+        except Exception as e:
+            backoff = None if emitted[0] else _retry_backoff(provider_config, attempt, e, deadline)
+            if backoff is None:
+                raise
+            logger.warning(f"LLM 调用失败 ({type(e).__name__}: {e})，{backoff:.2f}s 后第 {attempt + 1} 次重试")
+            await asyncio.sleep(backoff)
+    inference_time = time.time() - start_time
+    logger.debug(f"LLM 异步调用耗时: {inference_time:.2f}s，ID: {completion_id}")
+
+    if usage_container is not None and usage:
+        usage_container.update(usage)
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, cache_key, model_name, result, reasoning)
+
+    return _finish_response(result, reasoning)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """
+    模型调用（含重试与对冲请求）超过提供商配置的 deadline
+    """
+
+
+def _call_deadline(provider_config):
+    if provider_config.get("deadline") is None:
+        return None
+    return time.monotonic() + provider_config["deadline"]
+
+
+def _attempt_timeout(provider_config, deadline):
+    """
+    单次请求的超时: 提供商的 timeout，且不超过剩余的截止时间
+    """
+    import httpx
+
+    timeout = provider_config["timeout"]
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded(f"LLM 调用超过截止时间 ({provider_config['deadline']}s)")
+        timeout = min(timeout, remaining)
+    return httpx.Timeout(timeout, connect=min(provider_config["connect_timeout"], timeout))
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise LLMDeadlineExceeded("LLM 调用超过截止时间")
+
+
+def _is_transient_error(error):
+    """
+    连接错误、超时、限流 (408/409/429) 与服务端错误 (5xx) 可以重试
+    """
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_backoff(provider_config, attempt, error, deadline):
+    """
+    第 attempt 次失败后的等待时间（指数退避），不应重试时返回 None
+    """
+    # 不可重试的错误（如 400/401）原样抛出，不论是否超过截止时间
+    if not _is_transient_error(error):
+        return None
+    if deadline is not None and time.monotonic() >= deadline:
+        raise LLMDeadlineExceeded(f"LLM 调用超过截止时间 ({provider_config['deadline']}s)") from error
+    if attempt >= provider_config["retries"]:
+        return None
+    backoff = min(provider_config["retry_backoff"] * 2 ** attempt, provider_config["retry_backoff_max"])
+    if deadline is not None and time.monotonic() + backoff >= deadline:
+        return None
+    return backoff
+
+
+def _single_completion(client, request_args, stream_callback, timeout, deadline=None, include_usage=False):
+    """
+    一次请求，返回 (completion_id, content, reasoning_content, usage)
+    """
+    if stream_callback is not None:
+        return _stream_completion(client, request_args, stream_callback, timeout, deadline, include_usage)
+    completion = client.chat.completions.create(**request_args, timeout=timeout)
+    return _completion_parts(completion)
+
+
+async def _single_completion_async(client, request_args, stream_callback, timeout, deadline=None, include_usage=False):
+    if stream_callback is not None:
+        return await _stream_completion_async(client, request_args, stream_callback, timeout, deadline, include_usage)
+    completion = await client.chat.completions.create(**request_args, timeout=timeout)
+    return _completion_parts(completion)
+
+
+def _completion_parts(completion):
+    message = completion.choices[0].message
+    return completion.id, message.content, getattr(message, "reasoning_content", ""), _usage_dict(completion.usage)
+
+
+def _usage_dict(usage):
+    """
+    token 用量，提供商报告时包含命中前缀缓存的 prompt token 数 cached_tokens
+    """
+    if usage is None:
+        return None
+    usage = usage.model_dump(exclude_none=True)
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached_tokens is not None:
+        usage["cached_tokens"] = cached_tokens
+    return usage
+
+
+def _stream_kwargs(include_usage):
+    if include_usage:
+        # usage 在最后一段（choices 为空）中返回
+        return {"stream": True, "stream_options": {"include_usage": True}}
+    return {"stream": True}
+
+
+class _HedgedCompletion:
+    """
+    对冲请求: 先向本提供商发出请求，超过 hedge_delay（或该提供商历史延迟的
+    hedge_percentile 分位数）仍无回复时，向 hedge_provider 发出同样的请求。
+    第一个回复的请求获胜，其余请求关闭连接（服务端随之取消推理）。
+
+    有 stream_callback 时以第一段回复判定获胜（只转发获胜请求的回复），否则以完整回复判定。
+    请求使用流式调用，以便随时关闭连接。
+    """
+
+    def __init__(self, model_provider, provider_config, request_args, stream_callback, deadline):
+        self.model_provider = model_provider
+        self.provider_config = provider_config
+        self.request_args = request_args
+        self.stream_callback = stream_callback
+        self.deadline = deadline
+        self.latency_key = (model_provider, "first_chunk" if stream_callback is not None else "completion")
+
+        self._cond = threading.Condition()
+        self._started = []      # [(provider, start time)]
+        self._measured = set()  # 已计入延迟统计的请求序号
+        self._streams = {}      # 请求序号 -> 进行中的流
+        self._errors = {}       # 请求序号 -> 异常
+        self._winner = None
+        self._result = None
+        self._closed = False
+
+    def run(self):
+        self._start(self.model_provider)
+        delay = _llm_client_registry.hedge_delay(self.latency_key, self.provider_config)
+        with self._cond:
+            self._cond.wait_for(lambda: self._winner is not None or self._errors, timeout=delay)
+            hedge = self._winner is None
+        if hedge:
+            logger.info(f"{self.model_provider} {delay:.2f}s 内无回复，发出对冲请求: {self.provider_config['hedge_provider']}")
+            self._start(self.provider_config["hedge_provider"])
+
+        remaining = None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+        with self._cond:
+            settled = self._cond.wait_for(self._settled, timeout=remaining)
+        if not settled:
+            self._close(keep=None)
+            raise LLMDeadlineExceeded(f"LLM 调用超过截止时间 ({self.provider_config['deadline']}s)")
+        if self._result is not None:
+            return self._result
+        # 获胜请求失败，或全部请求失败: 抛出获胜者（否则为首个请求）的异常
+        raise self._errors.get(self._winner, self._errors.get(0))
+
+    def _settled(self):
+        if self._result is not None:
+            return True
+        if self._winner is not None:
+            return self._winner in self._errors
+        return len(self._errors) == len(self._started)
+
+    def _start(self, provider):
+        timeout = _attempt_timeout(self.provider_config, self.deadline)
+        with self._cond:
+            index = len(self._started)
+            self._started.append((provider, time.monotonic()))
+        threading.Thread(
+            target=self._run_one, args=(index, provider, timeout), daemon=True, name=f"llm-hedge-{provider}"
+        ).start()
+
+    def _claim(self, index):
+        """
+        请求收到第一段回复（或完整回复）: 成为获胜者，已有获胜者时返回 False。
+        每个请求到达时都计入一次延迟统计，被关闭的请求没有到达，不计入。
+        """
+        with self._cond:
+            if index not in self._measured:
+                self._measured.add(index)
+                provider, started = self._started[index]
+                _llm_client_registry.record_latency((provider, self.latency_key[1]), time.monotonic() - started)
+            if self._winner is None:
+                self._winner = index
+                self._cond.notify_all()
+        if self._winner == index:
+            self._close(keep=index)
+            return True
+        return False
+
+    def _close(self, keep):
+        """
+        关闭除 keep 以外的请求（不计入延迟统计: 已等待时间只是下限，会拉低分位数）
+        """
+        with self._cond:
+            self._closed = True
+            losers = [(index, stream) for index, stream in self._streams.items() if index != keep]
+            for index, _ in losers:
+                del self._streams[index]
+        for index, stream in losers:
+            provider, _ = self._started[index]
+            logger.debug(f"取消对冲中落后的请求: {provider}")
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _run_one(self, index, provider, timeout):
+        try:
+            with _llm_client_registry.lease(provider) as client:
+                stream = client.chat.completions.create(
+                    **self.request_args, **_stream_kwargs(self.provider_config["stream_usage"]), timeout=timeout
+                )
+                with self._cond:
+                    cancelled = self._closed and self._winner != index
+                    if not cancelled:
+                        self._streams[index] = stream
+                if cancelled:
+                    stream.close()
+                    raise _HedgeLost()
+
+                completion_id, usage, content_parts, reasoning_parts = None, None, [], []
+                for chunk in stream:
+                    completion_id = chunk.id
+                    usage = getattr(chunk, "usage", None) or usage
+                    if len(chunk.choices) == 0:
+                        continue
+                    if self.stream_callback is not None and chunk.choices[0].delta.content and not self._claim(index):
+                        raise _HedgeLost()
+                    _collect_chunk(chunk, content_parts, reasoning_parts, self.stream_callback)
+                if not self._claim(index):
+                    raise _HedgeLost()
+            with self._cond:
+                self._streams.pop(index, None)
+                self._result = (completion_id, "".join(content_parts), "".join(reasoning_parts), _usage_dict(usage))
+                self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._errors[index] = e
+                self._cond.notify_all()
+
+
+class _HedgeLost(Exception):
+    """
+    对冲请求中落后的请求
+    """
+
+
+async def _hedged_completion_async(model_provider, provider_config, request_args, stream_callback, deadline):
+    """
+    _HedgedCompletion 的异步版本，落后的请求直接取消其 task（随之关闭连接）
+    """
+    import asyncio
+
+    latency_kind = "first_chunk" if stream_callback is not None else "completion"
+    tasks, started = [], []
+    claimed = asyncio.Event()
+    winner = []
+    measured = set()
+
+    def claim(index):
+        # 与 _HedgedCompletion._claim 相同: 只有到达的请求计入延迟统计，被取消的不计入
+        if index not in measured:
+            measured.add(index)
+            _llm_client_registry.record_latency((started[index][0], latency_kind), time.monotonic() - started[index][1])
+        if not winner:
+            winner.append(index)
+            for other, task in enumerate(tasks):
+                if other != index and not task.done():
+                    task.cancel()
+            claimed.set()
+        return winner[0] == index
+
+    async def run_one(index, provider, timeout):
+        content_parts, reasoning_parts = [], []
+        completion_id, usage = None, None
+        with _llm_client_registry.lease(provider, use_async=True) as client:
+            stream = await client.chat.completions.create(
+                **request_args, **_stream_kwargs(provider_config["stream_usage"]), timeout=timeout
+            )
+            async with stream:
+                async for chunk in stream:
+                    completion_id = chunk.id
+                    usage = getattr(chunk, "usage", None) or usage
+                    if len(chunk.choices) == 0:
+                        continue
+                    if stream_callback is not None and chunk.choices[0].delta.content and not claim(index):
+                        raise _HedgeLost()
+                    _collect_chunk(chunk, content_parts, reasoning_parts, stream_callback)
+            if not claim(index):
+                raise _HedgeLost()
+        return completion_id, "".join(content_parts), "".join(reasoning_parts), _usage_dict(usage)
+
+    def start(provider):
+        timeout = _attempt_timeout(provider_config, deadline)
+        started.append((provider, time.monotonic()))
+        tasks.append(asyncio.ensure_future(run_one(len(tasks), provider, timeout)))
+
+    start(model_provider)
+    delay = _llm_client_registry.hedge_delay((model_provider, latency_kind), provider_config)
+    waiter = asyncio.ensure_future(claimed.wait())
+    try:
+        await asyncio.wait([tasks[0], waiter], timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        if not winner:
+            logger.info(f"{model_provider} {delay:.2f}s 内无回复，发出对冲请求: {provider_config['hedge_provider']}")
+            start(provider_config["hedge_provider"])
+
+        pending = set(tasks)
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise LLMDeadlineExceeded(f"LLM 调用超过截止时间 ({provider_config['deadline']}s)")
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is None and winner and tasks.index(task) == winner[0]:
+                    return task.result()
+                if winner and tasks.index(task) == winner[0]:
+                    raise task.exception()
+        # 全部请求失败
+        raise tasks[0].exception()
+    finally:
+        waiter.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def _stream_completion(client, request_args, stream_callback, timeout=None, deadline=None, include_usage=False):
+    """
+    流式调用，每收到一段回复就以当前已收到的完整文本调用 stream_callback
+    返回 (completion_id, content, reasoning_content, usage)
+    """
+    content_parts, reasoning_parts = [], []
+    completion_id, usage = None, None
+    stream = client.chat.completions.create(**request_args, **_stream_kwargs(include_usage), timeout=timeout)
+    with stream:
+        for chunk in stream:
+            # 读超时只限制两段回复之间的间隔，截止时间需逐段检查
+            _check_deadline(deadline)
+            completion_id = chunk.id
+            usage = getattr(chunk, "usage", None) or usage
+            _collect_chunk(chunk, content_parts, reasoning_parts, stream_callback)
+    return completion_id, "".join(content_parts), "".join(reasoning_parts), _usage_dict(usage)
+
+
+async def _stream_completion_async(client, request_args, stream_callback, timeout=None, deadline=None, include_usage=False):
+    """
+    _stream_completion 的异步版本
+    """
+    content_parts, reasoning_parts = [], []
+    completion_id, usage = None, None
+    stream = await client.chat.completions.create(**request_args, **_stream_kwargs(include_usage), timeout=timeout)
+    async with stream:
+        async for chunk in stream:
+            _check_deadline(deadline)
+            completion_id = chunk.id
+            usage = getattr(chunk, "usage", None) or usage
+            _collect_chunk(chunk, content_parts, reasoning_parts, stream_callback)
+    return completion_id, "".join(content_parts), "".join(reasoning_parts), _usage_dict(usage)
+
+
+def _collect_chunk(chunk, content_parts, reasoning_parts, stream_callback):
+    """
+    累积一段流式回复
+    """
+    if len(chunk.choices) == 0:
+        return
+    delta = chunk.choices[0].delta
+    reasoning_delta = getattr(delta, "reasoning_content", None)
+    if reasoning_delta:
+        reasoning_parts.append(reasoning_delta)
+    if delta.content:
+        content_parts.append(delta.content)
+        if stream_callback is not None:
+            stream_callback("".join(content_parts))
@@ -0,0 +1,83 @@
+"""
+Garbage-collect the content-addressed screenshot store (image_store: "cas").
+
+Usage:
+    python tools/gc_images.py --image_dir running_log/server_log/os-copilot-local-eval-logs/images \
+        --log_dir running_log/server_log/os-copilot-local-eval-logs/traces
+    python tools/gc_images.py --image_dir <images> --log_dir <traces> --storage_backend sqlite --dry_run
+
+The references of sessions whose trace no longer exists in the trace storage
+are released first, then the objects without any reference are removed.
+Sessions whose first screenshot is younger than --grace_seconds are kept: the
+trace writer is write-behind, so their trace may not be stored yet.
+"""
+
+import argparse
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from copilot_agent_server.image_store import ImageStore
+from copilot_agent_server.trace_storage import get_trace_storage
+
+
+def find_deleted_sessions(image_store, trace_storage, grace_seconds=600):
+    """
+    Sessions holding references but missing from `trace_storage`, leaving out
+    those referenced for less than `grace_seconds` (their trace may still be pending).
+    """
+    live_sessions = set(trace_storage.list_sessions())
+    return [
+        session_id for session_id in image_store.list_sessions(min_age=grace_seconds)
+        if session_id not in live_sessions
+    ]
+
+
+def release_deleted_sessions(image_store, trace_storage, dry_run=False, grace_seconds=600):
+    """
+    Release the references of the sessions missing from `trace_storage`.
+    Returns the released (in a dry run: the deleted) sessions.
+    """
+    deleted_sessions = find_deleted_sessions(image_store, trace_storage, grace_seconds=grace_seconds)
+    if not dry_run:
+        for session_id in deleted_sessions:
+            image_store.release_session(session_id)
+    return deleted_sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove unreferenced screenshots of the content-addressed image store")
+    parser.add_argument("--image_dir", required=True, help="image_dir of the server config")
+    parser.add_argument("--image_index_path", default=None, help="reference index, defaults to <image_dir>/objects/index.db")
+    parser.add_argument("--log_dir", default=None, help="traces, to release the references of deleted sessions")
+    parser.add_argument("--storage_backend", default="jsonl", choices=["jsonl", "sqlite"])
+    parser.add_argument("--sqlite_path", default=None, help="database file, defaults to <log_dir>/traces.db")
+    parser.add_argument("--grace_seconds", type=float, default=600,
+                        help="keep sessions referenced for less than this, their trace may not be written yet")
+    parser.add_argument("--dry_run", action="store_true", help="only report what would be removed")
+    args = parser.parse_args()
+
+    image_store = ImageStore(args.image_dir, index_path=args.image_index_path)
+
+    deleted_sessions = []
+    if args.log_dir is not None:
+        storage_config = {"log_dir": args.log_dir, "storage_backend": args.storage_backend}
+        if args.sqlite_path:
+            storage_config["sqlite_path"] = args.sqlite_path
+        deleted_sessions = release_deleted_sessions(
+            image_store, get_trace_storage(storage_config), dry_run=args.dry_run, grace_seconds=args.grace_seconds
+        )
+        print(f"{'Would release' if args.dry_run else 'Released'} the images of {len(deleted_sessions)} deleted sessions")
+
+    if args.dry_run:
+        # nothing was released: count what releasing the deleted sessions would free
+        removed, removed_bytes = image_store.reclaimable(deleted_sessions)
+    else:
+        removed, removed_bytes = image_store.gc()
+    print(f"{'Would remove' if args.dry_run else 'Removed'} {removed} objects ({removed_bytes / 1024 / 1024:.1f} MB)")
+    print(image_store.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import base64
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from PIL import Image, ImageDraw
 from megfile import smart_open
 import io
@@ -7,28 +10,226 @@ import io
 
 from megfile import smart_open, smart_makedirs, smart_exists, smart_copy
 
-def make_b64_url(image_path, resize_config=None):
+# memo of prepared (resized + encoded) images, keyed by source digest and target spec
+_PREPARED_IMAGE_CACHE_SIZE = 64
+_prepared_image_cache = OrderedDict()
+_prepared_image_cache_lock = threading.Lock()
+
+def _get_target_size(resize_config):
+    if resize_config and resize_config.get("is_resize", False) == True:
+        return tuple(resize_config['target_image_size'])
+    return None
+
+def resize_image(image, target_size):
     """
-    Convert an image file to a base64 URL.
+    Resize a PIL Image to `target_size`.
+    Large downscales first go through `Image.reduce` (cheap integer box
+    reduction) so the final resampling filter only runs on a small image.
     """
-    image_postfix = os.path.splitext(image_path)[-1].lower()
-    with smart_open(image_path, "rb") as f:
-        image_data = f.read()
-    
-    # print(resize_config)
-    image = Image.open(io.BytesIO(image_data))
+    target_size = tuple(target_size)
+    if image.size == target_size:
+        return image
+
+    factor = min(image.size[0] // target_size[0], image.size[1] // target_size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize(size= target_size)
+
+def encode_image(image, resize_config=None, format="JPEG", quality=85):
+    """
+    Resize (optionally) and encode a PIL Image, return the encoded bytes.
+    """
+    target_size = _get_target_size(resize_config)
+    if target_size is not None:
+        image = resize_image(image, target_size)
 
-    if resize_config and resize_config.get("is_resize", False) == True:
-        image = image.resize(size= resize_config['target_image_size'])
-    
     image_data = io.BytesIO()
-    image = image.convert('RGB')
-    image.save(image_data, format="JPEG", quality=85)
-    image_postfix = ".jpeg"
-    image_data = image_data.getvalue()
+    if format.upper() == "JPEG":
+        image = image.convert('RGB')
+        image.save(image_data, format="JPEG", quality=quality)
+    else:
+        image.save(image_data, format=format)
+    return image_data.getvalue()
 
+def bytes_to_b64_url(image_data, image_format="jpeg"):
+    """
+    Wrap encoded image bytes into a base64 data URL.
+    """
     b64_image = base64.b64encode(image_data).decode('utf-8')
-    return f"data:image/{image_postfix[1:]};base64,{b64_image}"
+    return f"data:image/{image_format.lower()};base64,{b64_image}"
+
+def prepare_image(image_data, resize_config=None, format="JPEG", quality=85):
+    """
+    The single resize-and-encode stage for encoded image bytes.
+
+    Results are memoized by (sha1 of the source bytes, target size, format,
+    quality), so the same screenshot is resized and encoded at most once per
+    target spec, whoever asks for it (client, server or LLM preprocessing).
+    Bytes that are already in the target format and size are returned as-is,
+    and JPEG sources use the decoder's draft mode for large downscales.
+    """
+    target_size = _get_target_size(resize_config)
+    key = (hashlib.sha1(image_data).hexdigest(), target_size, format.upper(), quality)
+
+    with _prepared_image_cache_lock:
+        if key in _prepared_image_cache:
+            _prepared_image_cache.move_to_end(key)
+            return _prepared_image_cache[key]
+
+    image = Image.open(io.BytesIO(image_data))
+    source_format = sniff_image_format(image_data)
+
+    if (target_size is None or image.size == target_size) and source_format == format.lower():
+        prepared_data = image_data
+    else:
+        if target_size is not None and source_format == "jpeg":
+            # let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+            image.draft("RGB", target_size)
+        prepared_data = encode_image(image, resize_config=resize_config, format=format, quality=quality)
+
+    with _prepared_image_cache_lock:
+        _prepared_image_cache[key] = prepared_data
+        while len(_prepared_image_cache) > _PREPARED_IMAGE_CACHE_SIZE:
+            _prepared_image_cache.popitem(last=False)
+
+    return prepared_data
+
+def prepare_b64_url(image_url, resize_config=None):
+    """
+    Prepare an image (base64 URL or file path) for the model, return a JPEG base64 URL.
+    """
+    image_format, image_data = read_bytes_from_url(image_url)
+    image_data = prepare_image(image_data, resize_config=resize_config, format="JPEG", quality=85)
+    return bytes_to_b64_url(image_data, "jpeg")
+
+def make_b64_url(image_path, resize_config=None):
+    """
+    Convert an image file to a base64 URL.
+    """
+    return prepare_b64_url(image_path, resize_config=resize_config)
+
+
+class ScreenFrame:
+    """
+    An in-memory screenshot, used as the image handle inside one process.
+
+    It wraps either a raw frame (numpy RGB array or PIL Image, e.g. from
+    scrcpy) or already encoded bytes (e.g. an uploaded JPEG). Encoded bytes
+    are cached per (size, format, quality), so a frame is resized and encoded
+    at most once per target no matter how many consumers ask for it. Nothing
+    touches the disk unless `save` is called, and nothing is base64 encoded
+    unless `to_b64_url` is called.
+    """
+    def __init__(self, frame, timestamp=None):
+        self._array = None
+        self._image = None
+        self._data = None
+
+        if isinstance(frame, Image.Image):
+            self._image = frame
+        elif isinstance(frame, (bytes, bytearray)):
+            self._data = bytes(frame)
+        else:
+            self._array = frame
+
+        self.timestamp = timestamp
+        self._encoded = {}
+
+    @classmethod
+    def from_bytes(cls, image_data, timestamp=None):
+        """
+        Wrap encoded image bytes (JPEG/PNG) without decoding them.
+        """
+        return cls(image_data, timestamp=timestamp)
+
+    def __deepcopy__(self, memo):
+        # frames are never mutated in place, copies of messages can share them
+        return self
+
+    def __repr__(self):
+        width, height = self.size
+        return f"<ScreenFrame {width}x{height}>"
+
+    @property
+    def size(self):
+        """
+        (width, height) of the raw frame.
+        """
+        if self._image is not None:
+            return self._image.size
+        if self._data is not None:
+            with Image.open(io.BytesIO(self._data)) as image:
+                return image.size
+        height, width = self._array.shape[:2]
+        return (width, height)
+
+    def to_pil(self):
+        """
+        Get the frame as a PIL Image (converted once, then reused).
+        """
+        if self._image is None:
+            if self._data is not None:
+                self._image = Image.open(io.BytesIO(self._data))
+            else:
+                self._image = Image.fromarray(self._array)
+        return self._image
+
+    def encode(self, resize_config=None, format="JPEG", quality=85):
+        """
+        Encode the frame to the target size and format, return the bytes.
+        """
+        if self._data is not None:
+            # memoized by content in the shared prepare stage
+            return prepare_image(self._data, resize_config=resize_config, format=format, quality=quality)
+
+        key = (_get_target_size(resize_config), format.upper(), quality)
+        if key not in self._encoded:
+            self._encoded[key] = encode_image(self.to_pil(), resize_config=resize_config, format=format, quality=quality)
+        return self._encoded[key]
+
+    def to_b64_url(self, resize_config=None, format="JPEG", quality=85):
+        """
+        Encode the frame and wrap it as a base64 data URL.
+        """
+        image_data = self.encode(resize_config=resize_config, format=format, quality=quality)
+        return bytes_to_b64_url(image_data, "jpeg" if format.upper() == "JPEG" else format.lower())
+
+    def save(self, image_path, resize_config=None, quality=85):
+        """
+        Write the frame to `image_path`; the format follows the file extension.
+        Returns the path where the image is saved.
+        """
+        image_postfix = os.path.splitext(image_path)[-1].lower()
+        format = "PNG" if image_postfix == ".png" else "JPEG"
+
+        image_data = self.encode(resize_config=resize_config, format=format, quality=quality)
+        with smart_open(image_path, "wb") as f:
+            f.write(image_data)
+        return image_path
+
+def sniff_image_format(image_data):
+    """
+    Detect the format of encoded image bytes from the magic number.
+    Returns "jpeg", "png" or None.
+    """
+    if image_data[0:2] == b"\xff\xd8":
+        return "jpeg"
+    if image_data[0:4] == b"\x89PNG":
+        return "png"
+    return None
+
+def read_bytes_from_url(image_url):
+    """
+    Read the encoded bytes of an image from a base64 URL or a file path, without decoding.
+    Returns (image_format, image_data).
+    """
+    if image_url.startswith("data:image/"):
+        header, b64_data = image_url.split(",", 1)
+        image_data = base64.b64decode(b64_data)
+    else:
+        with smart_open(image_url, "rb") as f:
+            image_data = f.read()
+    return sniff_image_format(image_data), image_data
 
 def read_from_url(image_url):
     """
@@ -0,0 +1,191 @@
+"""
+多副本模型服务的负载均衡（model_config.yaml 中 type: balancer 的提供商）
+
+配置示例:
+
+    local_pool:
+        type: balancer
+        api_key: "EMPTY"
+        endpoints:
+            - api_base: "http://10.0.0.1:8000/v1"
+            - api_base: "http://10.0.0.2:8000/v1"
+              api_key: "..."          # 每个副本可覆盖提供商的其他设置
+        eject_after_failures: 3       # 连续失败（请求或健康检查）次数达到后摘除
+        health_check_interval: 5.0    # 健康检查间隔（秒），0 关闭
+        health_check_timeout: 2.0
+
+每次调用选择 (在途请求数 + 1) * 平均延迟 最小的副本（连续失败的副本加权）；
+摘除的副本在健康检查（GET {api_base}/models）成功后恢复。全部副本都被摘除时
+仍在全部副本中选择。
+"""
+
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# balancer 提供商的默认设置
+DEFAULT_BALANCER_SETTINGS = {
+    "eject_after_failures": 3,
+    "health_check_interval": 5.0,
+    "health_check_timeout": 2.0,
+    "latency_ewma_alpha": 0.3,     # 延迟滑动平均的权重
+}
+
+
+class Endpoint:
+    """
+    一个模型服务副本的状态与统计
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.api_base = config["api_base"]
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ewma_latency = None
+        self.ejected = False
+        self.ejections = 0
+
+    def stats(self) -> dict:
+        return {
+            "api_base": self.api_base,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ewma_latency": self.ewma_latency,
+            "ejected": self.ejected,
+            "ejections": self.ejections,
+        }
+
+
+class EndpointBalancer:
+    """
+    按在途请求数与观测延迟在多个副本间分配请求，连续失败的副本摘除，健康检查通过后恢复
+    """
+
+    def __init__(self, name: str, provider_config: dict):
+        config = {**DEFAULT_BALANCER_SETTINGS, **provider_config}
+        assert len(config.get("endpoints") or []) > 0, f"balancer provider {name} needs endpoints"
+
+        self.name = name
+        self.eject_after_failures = config["eject_after_failures"]
+        self.health_check_interval = config["health_check_interval"]
+        self.health_check_timeout = config["health_check_timeout"]
+        self.latency_ewma_alpha = config["latency_ewma_alpha"]
+
+        # 副本配置: 提供商设置 + 副本自己的设置
+        shared = {k: v for k, v in provider_config.items() if k not in ("type", "endpoints")}
+        self.endpoints = [Endpoint({**shared, **endpoint}) for endpoint in config["endpoints"]]
+
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._health_thread = None
+        if self.health_check_interval and self.health_check_interval > 0:
+            self._health_thread = threading.Thread(
+                target=self._health_loop, daemon=True, name=f"llm-health-{name}"
+            )
+            self._health_thread.start()
+
+    def acquire(self) -> Endpoint:
+        """
+        选择副本并计入在途请求，请求结束后必须调用 release
+        """
+        with self._lock:
+            endpoint = self._pick()
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def peek(self) -> Endpoint:
+        """
+        当前会被选中的副本（不计入在途请求）
+        """
+        with self._lock:
+            return self._pick()
+
+    def release(self, endpoint: Endpoint, latency: float = None, failed: bool = False):
+        """
+        请求结束: latency 为成功请求的耗时，failed 为副本故障（连接错误、超时、5xx）；
+        两者都没有（如请求被取消、参数错误）时只减少在途请求数
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            if failed:
+                self._record_failure(endpoint, "请求失败")
+            elif latency is not None:
+                endpoint.consecutive_failures = 0
+                if endpoint.ewma_latency is None:
+                    endpoint.ewma_latency = latency
+                else:
+                    alpha = self.latency_ewma_alpha
+                    endpoint.ewma_latency = alpha * latency + (1 - alpha) * endpoint.ewma_latency
+
+    def check_health(self):
+        """
+        对所有副本做一次健康检查: 失败计入连续失败次数，被摘除的副本检查成功后恢复
+        """
+        import httpx
+
+        for endpoint in self.endpoints:
+            try:
+                response = httpx.get(
+                    endpoint.api_base.rstrip("/") + "/models",
+                    headers={"Authorization": f"Bearer {endpoint.config.get('api_key', '')}"},
+                    timeout=self.health_check_timeout,
+                )
+                healthy = response.status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+
+            with self._lock:
+                if not healthy:
+                    self._record_failure(endpoint, "健康检查失败")
+                elif endpoint.ejected:
+                    endpoint.ejected = False
+                    endpoint.consecutive_failures = 0
+                    logger.info(f"[{self.name}] 副本恢复: {endpoint.api_base}")
+
+    def stats(self) -> list:
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def close(self):
+        self._closed.set()
+
+    def _pick(self) -> Endpoint:
+        candidates = [endpoint for endpoint in self.endpoints if not endpoint.ejected]
+        if not candidates:
+            # 全部被摘除: 仍然选择，避免调用全部失败
+            candidates = self.endpoints
+
+        # 还没有延迟样本的副本按已知最小延迟的一半估计，以便尽快得到样本；
+        # 连续失败的副本按失败次数加权
+        known = [endpoint.ewma_latency for endpoint in candidates if endpoint.ewma_latency is not None]
+        default_latency = min(known) / 2 if known else 1.0
+
+        def score(endpoint):
+            latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else default_latency
+            return (endpoint.in_flight + 1) * latency * (1 + endpoint.consecutive_failures)
+
+        best = min(score(endpoint) for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates if score(endpoint) == best])
+
+    def _record_failure(self, endpoint: Endpoint, reason: str):
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        if not endpoint.ejected and endpoint.consecutive_failures >= self.eject_after_failures:
+            endpoint.ejected = True
+            endpoint.ejections += 1
+            logger.warning(f"[{self.name}] 副本连续失败 {endpoint.consecutive_failures} 次，摘除 ({reason}): {endpoint.api_base}")
+
+    def _health_loop(self):
+        while not self._closed.wait(self.health_check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"[{self.name}] 健康检查出错: {e}")
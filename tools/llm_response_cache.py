@@ -0,0 +1,197 @@
+"""
+模型回复的磁盘缓存（默认关闭），用于回归测试与回放: 相同的请求直接返回缓存的回复
+
+在 model_config.yaml 中开启:
+
+    response_cache:
+        enabled: true
+        cache_dir: "running_log/llm_cache"
+        max_size_mb: 1024       # 超过后按最近使用时间淘汰
+        read_only: false        # CI 中设为 true: 只读取，不写入也不更新使用时间
+
+缓存键为请求的规范化摘要: 模型名、采样参数、消息的文本与图片字节（base64 解码后
+的 SHA-256），与提供商和图片 URL 的编码方式无关。
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": False,
+    "cache_dir": "running_log/llm_cache",
+    "max_size_mb": 1024,
+    "read_only": False,
+}
+
+
+def _canonical_content(content):
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    parts = []
+    for part in content:
+        if part["type"] == "text":
+            parts.append({"type": "text", "text": part["text"]})
+            continue
+        url = part["image_url"]["url"]
+        if isinstance(url, str) and url.startswith("data:") and ";base64," in url:
+            image_bytes = base64.b64decode(url.split(";base64,", 1)[1])
+            parts.append({"type": "image", "sha256": hashlib.sha256(image_bytes).hexdigest()})
+        else:
+            parts.append({"type": "image_url", "url": str(url)})
+    return parts
+
+
+def request_key(request_args: dict) -> str:
+    """
+    请求（_request_args 的结果，图片已预处理为 data URL）的规范化摘要
+    """
+    canonical = {
+        "model": request_args["model"],
+        "args": {k: v for k, v in request_args.items() if k not in ("model", "messages")},
+        "messages": [
+            {**{k: v for k, v in message.items() if k != "content"}, "content": _canonical_content(message["content"])}
+            for message in request_args["messages"]
+        ],
+    }
+    data = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite 保存的回复缓存，总大小超过 max_bytes 时淘汰最久未使用的回复。
+    可被多个进程同时使用。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        content TEXT,
+        reasoning TEXT,
+        size INTEGER,
+        created REAL,
+        last_access REAL
+    );
+    CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, read_only: bool = False, timeout: float = 30.0):
+        self.cache_dir = cache_dir.rstrip('/')
+        self.db_path = f"{self.cache_dir}/responses.db"
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.timeout = timeout
+        # sqlite3 连接不在线程之间共享
+        self._local = threading.local()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if not read_only:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = self._conn()
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                if not os.path.exists(self.db_path):
+                    return None
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=self.timeout)
+            else:
+                conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def get(self, key: str):
+        """
+        缓存的 (content, reasoning)，未命中返回 None
+        """
+        conn = self._conn()
+        row = None
+        if conn is not None:
+            row = conn.execute("SELECT content, reasoning FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        if not self.read_only:
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0], row[1]
+
+    def put(self, key: str, model: str, content: str, reasoning: str = ""):
+        # 没有内容的回复（如只有工具调用）不缓存
+        if self.read_only or content is None:
+            return
+        reasoning = reasoning or ""
+        size = len(content.encode("utf-8")) + len(reasoning.encode("utf-8"))
+        now = time.time()
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, reasoning, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, reasoning, size, now, now),
+            )
+            evicted = self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes")
+        if evicted:
+            self._count("evictions", evicted)
+            logger.debug(f"回复缓存淘汰 {evicted} 条")
+
+    def _evict(self, conn) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        """
+        本进程的命中/未命中/写入/淘汰次数，以及缓存的条目数与大小
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        conn = self._conn()
+        entries, size = (0, 0) if conn is None else conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "read_only": self.read_only,
+        })
+        return stats
@@ -0,0 +1,95 @@
+"""
+Import existing JSONL session traces into the SQLite trace storage.
+
+Usage:
+    python tools/migrate_traces_to_sqlite.py --log_dir running_log/server_log/os-copilot-local-eval-logs/traces
+    python tools/migrate_traces_to_sqlite.py --log_dir <traces> --sqlite_path <db> --overwrite
+
+Sessions already present in the database are skipped unless --overwrite is given.
+"""
+
+import argparse
+import os
+import sys
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+from tqdm import tqdm
+
+from copilot_agent_server.trace_storage import JsonlTraceStorage, SqliteTraceStorage
+
+
+def migrate_session(source, target, session_id, overwrite=False, copied_templates=None):
+    """
+    Copy one session from `source` to `target`, with the prompt templates its
+    steps reference. `copied_templates` (a set of template ids) avoids copying
+    a template again for every session.
+    Returns the number of steps copied, or None if the session was skipped.
+    """
+    if copied_templates is None:
+        copied_templates = set()
+
+    if target.read_config(session_id) is not None:
+        if not overwrite:
+            return None
+        target.delete_session(session_id)
+
+    logs = source.read_logs(session_id)
+    if len(logs) == 0:
+        return None
+
+    target.append(session_id, logs[0])
+    for step, record in enumerate(logs[1:], start=1):
+        # steps stored as {"template_id", "variables"} need their template in the target
+        asked_messages = record['message'].get('asked_messages')
+        if isinstance(asked_messages, dict) and "template_id" in asked_messages:
+            template_id = asked_messages["template_id"]
+            if template_id not in copied_templates:
+                target.save_prompt_template(source.load_prompt_template(template_id))
+                copied_templates.add(template_id)
+
+        target.append(session_id, record)
+
+        image_path = record['message'].get('environment', {}).get('image')
+        if isinstance(image_path, str) and os.path.exists(image_path):
+            target.record_image(session_id, f"step_{step}", image_path, os.path.getsize(image_path))
+
+    return len(logs) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import JSONL session traces into SQLite")
+    parser.add_argument("--log_dir", required=True, help="directory of the <session_id>.jsonl traces")
+    parser.add_argument("--sqlite_path", default=None, help="database file, defaults to <log_dir>/traces.db")
+    parser.add_argument("--overwrite", action="store_true", help="re-import sessions already in the database")
+    args = parser.parse_args()
+
+    log_dir = args.log_dir.rstrip('/')
+    sqlite_path = args.sqlite_path or f"{log_dir}/traces.db"
+
+    source = JsonlTraceStorage(log_dir)
+    target = SqliteTraceStorage(sqlite_path)
+
+    session_ids = source.list_sessions()
+    copied_templates = set()
+    migrated_sessions, migrated_steps, skipped_sessions = 0, 0, 0
+    for session_id in tqdm(session_ids):
+        try:
+            steps = migrate_session(
+                source, target, session_id, overwrite=args.overwrite, copied_templates=copied_templates
+            )
+        except Exception as e:
+            print(f"Failed to migrate session {session_id}: {e}")
+            continue
+        if steps is None:
+            skipped_sessions += 1
+        else:
+            migrated_sessions += 1
+            migrated_steps += steps
+
+    print(f"Migrated {migrated_steps} steps of {migrated_sessions} sessions into {sqlite_path} ({skipped_sessions} skipped)")
+
+
+if __name__ == "__main__":
+    main()
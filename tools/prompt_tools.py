@@ -1,4 +1,5 @@
 import json
+import hashlib
 
 def extra_json_from_model_output(model_output):
     """
@@ -80,4 +81,46 @@ def messages2sft(messages):
         "images": images
     }
 
-    return sft
\ No newline at end of file
+    return sft
+
+
+def prompt_slot(name):
+    """
+    Placeholder of a per-step variable inside a prompt template.
+    """
+    return f"\x00{name}\x00"
+
+def make_prompt_template(render, slot_names):
+    """
+    Render the messages with slots in place of the per-step variables.
+    The template id is the digest of the rendered template, so any change of the
+    static prompt text yields a new id and old traces keep their own template.
+    """
+    messages = render(**{name: prompt_slot(name) for name in slot_names})
+    template_json = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return {
+        "template_id": hashlib.sha1(template_json.encode("utf-8")).hexdigest()[:16],
+        "slots": list(slot_names),
+        "messages": messages,
+    }
+
+def fill_prompt_template(template, variables):
+    """
+    Rebuild the exact messages from a prompt template and the per-step variables.
+    """
+    slots = {prompt_slot(name): value for name, value in variables.items()}
+
+    def fill(node):
+        if isinstance(node, dict):
+            return {k: fill(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [fill(v) for v in node]
+        if isinstance(node, str) and "\x00" in node:
+            if node in slots:
+                # a whole-value slot keeps the variable as it is (e.g. an image reference)
+                return slots[node]
+            for slot, value in slots.items():
+                node = node.replace(slot, value)
+        return node
+
+    return fill(template["messages"])
@@ -0,0 +1,359 @@
+"""
+Retention and compaction of the running_log directories.
+
+The policies are read from the `retention_config` section of
+mcp_server_config.yaml, one per directory:
+- "kind": "traces" (session traces of a log_dir, with their screenshots) or
+  "files" (screenshot directories such as running_log/mcp_screenshots)
+- "max_age_days" / "max_count" / "max_total_mb": what is kept, newest first
+- "archive_after_days" (traces): pack older sessions into
+  {log_dir}/archive/{session_id}.zip, still readable by the trace storage
+- "transcode_after_days" (files): re-encode older screenshots as smaller JPEGs
+  ("transcode_quality", "transcode_max_side")
+
+Paths go through megfile, so log_dir / image_dir / screenshot directories may
+also be remote (the image index of a "cas" store must be a local file).
+
+Usage:
+    python tools/retention.py --dry_run     # report only
+    python tools/retention.py
+    python tools/retention.py --config mcp_server_config.yaml --workers 4
+"""
+
+import argparse
+import fnmatch
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+if "." not in sys.path:
+    sys.path.append(".")
+
+import yaml
+from megfile import smart_exists, smart_isdir, smart_open, smart_remove, smart_rename, smart_scandir, smart_stat
+from PIL import Image
+
+from copilot_agent_server.trace_storage import get_trace_storage, JsonlTraceStorage
+from copilot_agent_server.image_store import ImageStore
+
+# JPEG comment marking the screenshots already transcoded
+TRANSCODED_MARK = b"gelab-retention"
+
+DAY = 24 * 3600
+
+
+class Deleter:
+    """
+    Runs deletions on at most `max_workers` threads, so pruning a huge
+    directory does not saturate the disk the device hosts are writing to.
+    """
+
+    def __init__(self, max_workers: int = 4, dry_run: bool = False):
+        self.dry_run = dry_run
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retention-delete")
+        # bound the pending work as well, not only the running one
+        self._slots = threading.Semaphore(max_workers * 4)
+        self._futures = []
+
+    def submit(self, fn, *args):
+        if self.dry_run:
+            return
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def remove(self, path: str):
+        self.submit(_remove_file, path)
+
+    def wait(self) -> int:
+        """
+        Wait for all submitted deletions, returns the number of failed ones.
+        """
+        failed = 0
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Deletion failed: {e}")
+                failed += 1
+        self._futures = []
+        return failed
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+def _remove_file(path: str):
+    smart_remove(path, missing_ok=True)
+
+
+def select_expired(entries, policy, now):
+    """
+    Split `entries` [(key, mtime, size), ...] into (kept, expired) following the
+    age, count and total size limits of `policy`, newest entries kept first.
+    """
+    max_age = policy.get("max_age_days")
+    max_count = policy.get("max_count")
+    max_bytes = policy["max_total_mb"] * 1024 * 1024 if policy.get("max_total_mb") is not None else None
+
+    kept, expired = [], []
+    total = 0
+    for entry in sorted(entries, key=lambda entry: entry[1], reverse=True):
+        _, mtime, size = entry
+        if (max_age is not None and now - mtime > max_age * DAY) \
+                or (max_count is not None and len(kept) >= max_count) \
+                or (max_bytes is not None and total + size > max_bytes):
+            expired.append(entry)
+        else:
+            kept.append(entry)
+            total += size
+    return kept, expired
+
+
+def _new_report(policy):
+    return {
+        "path": policy["path"],
+        "kind": policy.get("kind", "files"),
+        "scanned": 0,
+        "scanned_bytes": 0,
+        "deleted": 0,
+        "deleted_bytes": 0,
+        "archived": 0,
+        "transcoded": 0,
+        "saved_bytes": 0,
+    }
+
+
+def _session_image_paths(storage, session_id):
+    environments, _ = storage.read_env_actions(session_id)
+    return list(dict.fromkeys(
+        env['image'] for env in environments if isinstance(env.get('image'), str)
+    ))
+
+
+def _drop_session_images(session_id, image_paths, image_store, deleter):
+    # content-addressed objects are released and collected by the gc,
+    # flat screenshots (and their visualization copies) are removed
+    if image_store is not None:
+        image_store.release_session(session_id)
+    for image_path in image_paths:
+        if image_store is None or image_store.digest_of_path(image_path) is None:
+            deleter.remove(image_path)
+            deleter.remove(image_path.replace(".jpeg", "_processed.jpeg"))
+
+
+def apply_traces_policy(policy, deleter, now, dry_run=False):
+    """
+    Retention of the session traces of a log_dir and of their screenshots.
+    Flat screenshots are removed with their session, the references of
+    content-addressed ones are released and unreferenced objects collected.
+    A dry run counts the objects its deletions and archives would free.
+    """
+    report = _new_report(policy)
+    log_dir = policy["path"].rstrip('/')
+    storage = get_trace_storage({**policy, "log_dir": log_dir})
+    image_dir = policy.get("image_dir")
+    image_store = None
+    if image_dir is not None:
+        # only an existing index: opening the store would create an empty one
+        index_path = policy.get("image_index_path") or f"{image_dir.rstrip('/')}/objects/index.db"
+        if smart_exists(index_path):
+            image_store = ImageStore(image_dir, index_path=index_path)
+    # sessions whose content-addressed references a dry run would release
+    released_sessions = []
+
+    entries = []
+    if isinstance(storage, JsonlTraceStorage):
+        for session_id in storage.list_sessions():
+            session_file = storage.session_file(session_id)
+            if session_file is None:
+                # removed meanwhile
+                continue
+            stat = smart_stat(session_file)
+            entries.append((session_id, stat.mtime, stat.size))
+    else:
+        # sqlite: the session start time, records and image bytes
+        for session_id, timestamp, size in storage.session_stats():
+            if timestamp is None:
+                print(f"Skipping session {session_id}: no timestamp")
+                continue
+            start = time.mktime(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+            entries.append((session_id, start, size))
+    report["scanned"] = len(entries)
+    report["scanned_bytes"] = sum(size for _, _, size in entries)
+
+    kept, expired = select_expired(entries, policy, now)
+
+    for session_id, _, size in expired:
+        report["deleted"] += 1
+        report["deleted_bytes"] += size
+        if dry_run:
+            released_sessions.append(session_id)
+            continue
+        image_paths = _session_image_paths(storage, session_id)
+        storage.delete_session(session_id)
+        _drop_session_images(session_id, image_paths, image_store, deleter)
+
+    archive_after = policy.get("archive_after_days")
+    if archive_after is not None and isinstance(storage, JsonlTraceStorage):
+        for session_id, mtime, _ in kept:
+            if now - mtime <= archive_after * DAY or storage.is_archived(session_id):
+                continue
+            report["archived"] += 1
+            if dry_run:
+                released_sessions.append(session_id)
+                continue
+            try:
+                image_paths = storage.archive_session(session_id)
+            except Exception as e:
+                print(f"Failed to archive session {session_id}: {e}")
+                continue
+            _drop_session_images(session_id, image_paths, image_store, deleter)
+
+    deleter.wait()
+    if image_store is not None:
+        if dry_run:
+            removed, removed_bytes = image_store.reclaimable(released_sessions)
+        else:
+            removed, removed_bytes = image_store.gc()
+        report["deleted_bytes"] += removed_bytes
+
+    return report
+
+
+def transcode_image(path, quality=60, max_side=None, dry_run=False) -> int:
+    """
+    Re-encode a screenshot as a smaller JPEG, keeping its modification time.
+    Non-JPEG files are replaced by a .jpeg file next to them.
+    Returns the saved bytes (0 if skipped).
+    The modification time can only be kept on local files.
+    """
+    with smart_open(path, "rb") as f, Image.open(f) as image:
+        if image.format == "JPEG" and image.info.get("comment") == TRANSCODED_MARK:
+            return 0
+        image = image.convert("RGB")
+        if max_side is not None and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffered = BytesIO()
+        image.save(buffered, format="JPEG", quality=quality, comment=TRANSCODED_MARK)
+        data = buffered.getvalue()
+
+    stat = smart_stat(path)
+    if len(data) >= stat.size:
+        return 0
+    if dry_run:
+        return stat.size - len(data)
+
+    target = path if path.lower().endswith((".jpeg", ".jpg")) else os.path.splitext(path)[0] + ".jpeg"
+    tmp_path = f"{target}.tmp"
+    with smart_open(tmp_path, "wb") as f:
+        f.write(data)
+    smart_rename(tmp_path, target)
+    if "://" not in target:
+        # age based policies keep seeing the original time
+        os.utime(target, (stat.mtime, stat.mtime))
+    if target != path:
+        smart_remove(path, missing_ok=True)
+    return stat.size - len(data)
+
+
+def apply_files_policy(policy, deleter, now, dry_run=False):
+    """
+    Retention of a flat screenshot directory (no recursion).
+    """
+    report = _new_report(policy)
+    directory = policy["path"]
+    pattern = policy.get("pattern", "*")
+
+    entries = []
+    if smart_isdir(directory):
+        for entry in smart_scandir(directory):
+            if entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                entries.append((entry.path, entry.stat.mtime, entry.stat.size))
+    report["scanned"] = len(entries)
+    report["scanned_bytes"] = sum(size for _, _, size in entries)
+
+    kept, expired = select_expired(entries, policy, now)
+    for path, _, size in expired:
+        report["deleted"] += 1
+        report["deleted_bytes"] += size
+        deleter.remove(path)
+
+    transcode_after = policy.get("transcode_after_days")
+    if transcode_after is not None:
+        for path, mtime, _ in kept:
+            if now - mtime <= transcode_after * DAY or path.endswith("_processed.jpeg"):
+                continue
+            try:
+                saved = transcode_image(
+                    path,
+                    quality=policy.get("transcode_quality", 60),
+                    max_side=policy.get("transcode_max_side"),
+                    dry_run=dry_run,
+                )
+            except Exception as e:
+                print(f"Failed to transcode {path}: {e}")
+                continue
+            if saved > 0:
+                report["transcoded"] += 1
+                report["saved_bytes"] += saved
+
+    deleter.wait()
+    return report
+
+
+def run_retention(retention_config: dict, dry_run: bool = False, workers: int = None) -> list:
+    """
+    Apply all policies of a retention_config, returns one report per policy.
+    """
+    now = time.time()
+    deleter = Deleter(max_workers=workers or retention_config.get("delete_workers", 4), dry_run=dry_run)
+    reports = []
+    try:
+        for policy in retention_config.get("policies", []):
+            kind = policy.get("kind", "files")
+            assert kind in ["traces", "files"], f"Unknown retention policy kind: {kind}"
+            if kind == "traces":
+                reports.append(apply_traces_policy(policy, deleter, now, dry_run=dry_run))
+            else:
+                reports.append(apply_files_policy(policy, deleter, now, dry_run=dry_run))
+    finally:
+        deleter.close()
+    return reports
+
+
+def print_reports(reports, dry_run=False):
+    mb = 1024 * 1024
+    print(f"Retention report{' (dry run)' if dry_run else ''}:")
+    for report in reports:
+        print(
+            f"- {report['path']} [{report['kind']}]: "
+            f"{report['scanned']} scanned ({report['scanned_bytes'] / mb:.1f} MB), "
+            f"{report['deleted']} deleted ({report['deleted_bytes'] / mb:.1f} MB), "
+            f"{report['archived']} archived, "
+            f"{report['transcoded']} transcoded (-{report['saved_bytes'] / mb:.1f} MB)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune, archive and transcode the running_log traces and screenshots")
+    parser.add_argument("--config", default="mcp_server_config.yaml", help="yaml file with a retention_config section")
+    parser.add_argument("--dry_run", action="store_true", help="only report what would be done")
+    parser.add_argument("--workers", type=int, default=None, help="concurrent deletions, overrides delete_workers")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    assert "retention_config" in config, f"{args.config} has no retention_config section"
+
+    reports = run_retention(config["retention_config"], dry_run=args.dry_run, workers=args.workers)
+    print_reports(reports, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ if "." not in sys.path:
     sys.path.append(".")
 
 from tools.image_tools import draw_points
+from copilot_agent_server.trace_storage import get_trace_storage
 
 from megfile import smart_open, smart_exists
 
@@ -37,7 +38,7 @@ def make_b64_url(image):
     img_data = f"data:image/jpeg;base64,{img_str}"
     return img_data
 
-def meta2messages(logs):
+def meta2messages(logs, storage, session_id):
 
     messages = []
     config_log = logs[0]
@@ -57,26 +58,30 @@ def meta2messages(logs):
 
         image_new_url = env['image'].replace(".jpeg", "_processed.jpeg")
 
-        if smart_exists(image_new_url):
-            image_url = image_new_url
+        if "point1" in act:
+            points = [act["point1"], act["point2"]]
+        elif "point" in act:
+            points = [act["point"]]
         else:
-            with smart_open(image_url, "rb") as f:
-                image = Image.open(f)
-                image = long_side_resize(image, long_side=800)
-
-            if "point1" in act:
-                points = [act["point1"], act["point2"]]
+            points = []
 
-                draw_points(image, image_new_url, points)
+        # content-addressed objects are shared between steps and archived
+        # images are packed with their trace: those are drawn in memory
+        in_memory = "image_digest" in env or not smart_exists(image_url)
 
-                image_url = image_new_url
+        if not in_memory and smart_exists(image_new_url):
+            image_url = image_new_url
+        elif in_memory or len(points) > 0:
+            image = Image.open(BytesIO(storage.read_image(session_id, env['image'])))
+            image = long_side_resize(image, long_side=800)
 
-            elif "point" in act:
-                points =[ act["point"]]
+            if in_memory:
+                image_url = draw_points(image, None, points, return_image=True) if len(points) > 0 else image
+            else:
                 draw_points(image, image_new_url, points)
 
                 image_url = image_new_url
-        
+
         thought = act.get("cot","")
         act['cot'] = thought
         del act['cot']
@@ -98,31 +103,40 @@ def meta2messages(logs):
 
 st.title("根据Session ID查找Copilot 数据")
 
+LOG_DIR = "running_log/server_log/os-copilot-local-eval-logs/traces"
+
+with st.sidebar:
+    storage_backend = st.selectbox("存储后端", ["jsonl", "sqlite"])
+    sqlite_path = st.text_input("SQLite 路径", f"{LOG_DIR}/traces.db") if storage_backend == "sqlite" else None
+
 # with st.sidebar:
 session_id = st.text_input("输入Session ID")
 
 if st.button("查找"):
     session_id = session_id.strip()
 
-    log_file = f"running_log/server_log/os-copilot-local-eval-logs/traces/{session_id}.jsonl"
-
-    if smart_exists(log_file):
-        # with smart_open(log_file, "r") as f:
-        with smart_open(log_file, "r",encoding='utf-8') as f:
-            reader = jsonlines.Reader(f)
-            logs = [log for log in reader]
-
-            messages = meta2messages(logs)
-
-            for mes in messages:
-                with st.chat_message(mes['role']):
-                    if type(mes['content']) == str:
-                        st.markdown(mes['content'])
-                    else:
-                        # interleave_contents = try_pause_json(mes['content'])
-                        for item in mes['content']:
-                            if item['type'] == 'text':
-                                st.markdown(
+    storage_config = {"log_dir": LOG_DIR, "storage_backend": storage_backend}
+    if sqlite_path:
+        storage_config["sqlite_path"] = sqlite_path
+    storage = get_trace_storage(storage_config)
+
+    # only the config row and the step rows, fetched by session_id
+    config_log = storage.read_config(session_id)
+
+    if config_log is not None:
+        logs = [config_log] + storage.read_steps(session_id)
+
+        messages = meta2messages(logs, storage, session_id)
+
+        for mes in messages:
+            with st.chat_message(mes['role']):
+                if type(mes['content']) == str:
+                    st.markdown(mes['content'])
+                else:
+                    # interleave_contents = try_pause_json(mes['content'])
+                    for item in mes['content']:
+                        if item['type'] == 'text':
+                            st.markdown(
     """
     <style>
     [data-testid="stJson"] {
@@ -133,12 +147,15 @@ if st.button("查找"):
     """,
     unsafe_allow_html=True
 )
-                                st.markdown(item['text'])
-                            elif item['type'] == 'image_url':
-                                image_url = item['image_url']['url']
-                                with smart_open(image_url, "rb") as f:
-                                    image = Image.open(f)
-                                    st.image(image)
+                            st.markdown(item['text'])
+                        elif item['type'] == 'image_url':
+                            image_url = item['image_url']['url']
+                            if isinstance(image_url, Image.Image):
+                                st.image(image_url)
+                                continue
+                            with smart_open(image_url, "rb") as f:
+                                image = Image.open(f)
+                                st.image(image)
 
     else:
         st.write("未找到数据")